@@ -0,0 +1,154 @@
+import numpy
+
+def boltzmannAverage(energies:numpy.array, temp:float, useAltAveragingMethod:bool = False) -> numpy.array:
+	"""
+	Boltzmann averages energies over their last axis. A temperature of 0 takes the minimum
+	and -1 (standing in for inf) the mean. The exponentials are shifted by the lowest
+	energy so that low temperatures do not overflow
+
+	@param energies					double[...][microstate] of energies
+	@param temp						float, Boltzmann averaging temperature
+	@param useAltAveragingMethod	bool, use the -log(sum(exp(-E/T))) expression instead of the weighted mean?
+	@return double[...] of averaged energies
+	"""
+	if temp == 0.0:
+		return numpy.amin(energies, axis = -1);
+	elif temp == -1.0:
+		return numpy.mean(energies, axis = -1);
+	temp = float(temp);		# python float keeps the precision of the energies
+
+	# shift so that every exponent is <= 0
+	shift = numpy.amin(energies, axis = -1, keepdims = True) if temp > 0 else numpy.amax(energies, axis = -1, keepdims = True);
+	boltzmannFactors = numpy.exp((energies - shift) / -temp);
+	if not useAltAveragingMethod:
+		return numpy.sum(energies * boltzmannFactors, axis = -1) / numpy.sum(boltzmannFactors, axis = -1);
+	else:
+		return shift[..., 0] / temp - numpy.log(numpy.sum(boltzmannFactors, axis = -1));
+
+def boltzmannAverageDerivative(energies:numpy.array, temp:float, useAltAveragingMethod:bool = False) -> numpy.array:
+	"""
+	Derivative of boltzmannAverage() with respect to the temperature. For the weighted mean it is
+	the Boltzmann weighted variance of the energies over T^2, for the alternate expression it
+	is minus the weighted mean over T^2. Not defined at the min (0) and mean (-1) endpoints
+
+	@param energies					double[...][microstate] of energies
+	@param temp						float, Boltzmann averaging temperature, not 0 or -1
+	@param useAltAveragingMethod	bool, use the -log(sum(exp(-E/T))) expression instead of the weighted mean?
+	@return double[...] of d(average)/dT
+	"""
+	if temp == 0.0 or temp == -1.0:
+		raise ValueError("Boltzmann average is not differentiable at the min and mean endpoints");
+	temp = float(temp);
+
+	shift = numpy.amin(energies, axis = -1, keepdims = True) if temp > 0 else numpy.amax(energies, axis = -1, keepdims = True);
+	boltzmannFactors = numpy.exp((energies - shift) / -temp);
+	boltzmannFactors /= numpy.sum(boltzmannFactors, axis = -1, keepdims = True);
+	mean = numpy.sum(energies * boltzmannFactors, axis = -1);
+	if not useAltAveragingMethod:
+		return (numpy.sum(energies * energies * boltzmannFactors, axis = -1) - mean * mean) / (temp * temp);
+	else:
+		return -mean / (temp * temp);
+
+class BoltzmannTable:
+	"""
+	Boltzmann averaged energies of one picked ensemble, precalculated on a log-spaced grid of
+	temperatures so that averaging at any temperature in the grid's range is an interpolation
+	between two tabulated tensors instead of a pass of exponentials over the whole ensemble.
+
+	The grid starts evenly spaced in log(T) and intervals are halved until the interpolated
+	value at each interval's midpoint is within the tolerance of the exact value, or the grid
+	reaches its maximum size. The largest remaining midpoint error is kept in errorBound.
+	The min (T = 0) and mean (T = -1) endpoints are stored as well, and temperatures outside
+	the grid are averaged exactly.
+	"""
+
+	energies = numpy.array(0);			# double[position][residue energy][macrostate][microstate] the picked ensemble
+	useAltAveragingMethod = False;		# which averaging expression the table holds
+	temps = numpy.array(0);				# float[temp] grid of temperatures, ascending
+	logTemps = numpy.array(0);			# float[temp] log of the grid
+	values = numpy.array(0);			# double[temp][position][residue energy][macrostate] averaged energies at each temperature
+	minEnergies = numpy.array(0);		# double[position][residue energy][macrostate] T = 0 endpoint
+	meanEnergies = numpy.array(0);		# double[position][residue energy][macrostate] T = -1 endpoint
+	errorBound = 0.0;					# float, largest estimated interpolation error over the grid
+
+	def __init__(self, energies:numpy.array, tempRange:"float[]", useAltAveragingMethod:bool = False, tolerance:float = 1e-3, nTemps:int = 32, maxTemps:int = 512):
+		"""
+		Default constructor. Builds the table
+
+		@param energies					double[position][residue energy][macrostate][microstate] of the picked ensemble
+		@param tempRange				float[] of length 2: {lowest, highest} positive temperature to tabulate
+		@param useAltAveragingMethod	bool, use the other Boltzmann averaging calculation method?
+		@param tolerance				float, largest interpolation error wanted, in energy units
+		@param nTemps					int, size of the initial grid
+		@param maxTemps					int, cap on the size of the refined grid
+		"""
+		if tempRange[0] <= 0 or tempRange[1] <= tempRange[0]:
+			raise ValueError("Temperature range must be positive and increasing");
+
+		self.energies = energies;
+		self.useAltAveragingMethod = useAltAveragingMethod;
+		self.minEnergies = boltzmannAverage(energies, 0.0);
+		self.meanEnergies = boltzmannAverage(energies, -1.0);
+
+		temps = list(numpy.geomspace(tempRange[0], tempRange[1], nTemps));
+		values = [boltzmannAverage(energies, t, useAltAveragingMethod) for t in temps];
+		errors = [None] * (len(temps) - 1);		# midpoint error of each interval, None when not yet checked
+		while True:
+			nInserted = 0;
+			newTemps = [temps[0]];
+			newValues = [values[0]];
+			newErrors = [];
+			for i in range(len(temps) - 1):
+				if errors[i] is None:
+					mid = numpy.sqrt(temps[i] * temps[i + 1]);	# midpoint in log space
+					midValue = boltzmannAverage(energies, mid, useAltAveragingMethod);
+					errors[i] = float(numpy.amax(numpy.abs(0.5 * (values[i] + values[i + 1]) - midValue)));
+					# split intervals that are too coarse, as long as there is room
+					if errors[i] > tolerance and len(temps) + nInserted < maxTemps:
+						nInserted += 1;
+						newTemps.append(mid);
+						newValues.append(midValue);
+						newErrors += [None, None];
+					else:
+						newErrors.append(errors[i]);
+				else:
+					newErrors.append(errors[i]);
+				newTemps.append(temps[i + 1]);
+				newValues.append(values[i + 1]);
+			isDone = nInserted == 0;
+			temps, values, errors = newTemps, newValues, newErrors;
+			if isDone:
+				break;
+
+		self.temps = numpy.array(temps);
+		self.logTemps = numpy.log(self.temps);
+		self.values = numpy.array(values);
+		self.errorBound = max(errors);
+
+	def getAveragedEnergies(self, temp:float) -> numpy.array:
+		"""
+		Looks up the Boltzmann averaged energies at a temperature
+
+		@param temp		float, Boltzmann averaging temperature
+		@return double[position][residue energy][macrostate]
+		"""
+		if temp == 0.0:
+			return self.minEnergies;
+		elif temp == -1.0:
+			return self.meanEnergies;
+		elif temp < self.temps[0] or temp > self.temps[-1]:
+			return boltzmannAverage(self.energies, temp, self.useAltAveragingMethod);
+
+		logTemp = numpy.log(temp);
+		i = min(int(numpy.searchsorted(self.logTemps, logTemp, side = 'right')) - 1, self.temps.size - 2);
+		frac = float((logTemp - self.logTemps[i]) / (self.logTemps[i + 1] - self.logTemps[i]));	# python float keeps the precision of the table
+		return (1.0 - frac) * self.values[i] + frac * self.values[i + 1];
+
+	def getNBytes(self) -> int:
+		"""
+		Memory held by the table, including the ensemble it keeps for temperatures off the grid
+
+		@param void
+		@return int
+		"""
+		return self.values.nbytes + self.minEnergies.nbytes + self.meanEnergies.nbytes + self.temps.nbytes * 2 + self.energies.nbytes;
@@ -15,7 +15,7 @@ class Chi2Kernel(SimilarityMeasure):
 	def __init__(self, targetFrequencies = None, coeff:int = 1):
 		super().__init__(targetFrequencies);
 		self.coeff = -coeff;
-		if self.targetFrequencies != None:
+		if self.targetFrequencies is not None:
 			self.targetFrequencies = numpy.nan_to_num(self.targetFrequencies / numpy.linalg.norm(self.targetFrequencies));
 
 	def clone(self):
@@ -23,7 +23,7 @@ class Chi2Kernel(SimilarityMeasure):
 
 	def setTargetFreqs(self, targetFrequencies):
 		super().setTargetFreqs(targetFrequencies);
-		if self.targetFrequencies != None:
+		if self.targetFrequencies is not None:
 			self.targetFrequencies = numpy.nan_to_num(self.targetFrequencies / numpy.linalg.norm(self.targetFrequencies));
 
 	def getSimilarityMeasure(self, expFrequencies):
@@ -35,5 +35,15 @@ class Chi2Kernel(SimilarityMeasure):
 		val = self.coeff * numpy.sum(val);
 		return numpy.exp(val);
 
+	def getSimilarityGradient(self, expFrequencies):
+		norm = numpy.linalg.norm(expFrequencies);
+		normFrequencies = numpy.nan_to_num(expFrequencies / norm);
+		similarity = self.getSimilarityMeasure(expFrequencies);
+		# d/de of (t - e)^2 / (t + e) is -(t - e)(3t + e) / (t + e)^2
+		sums = self.targetFrequencies + normFrequencies;
+		grad = numpy.nan_to_num(similarity * self.coeff * -(self.targetFrequencies - normFrequencies) * (3 * self.targetFrequencies + normFrequencies) / numpy.power(sums, 2));
+		# through the normalization to unit length
+		return (grad - numpy.sum(grad * normFrequencies) * normFrequencies) / norm;
+
 	def __str__(self, **kwargs):
 		return "Chi-2 kernel with parameter " + str(self.coeff);
@@ -10,7 +10,7 @@ class CosineSimilarity(SimilarityMeasure):
 		super().__init__(targetFrequencies);
 
 		# normalize to unit vect in (nPosition * 20)-space
-		if self.targetFrequencies != None:
+		if self.targetFrequencies is not None:
 			self.targetFrequencies = numpy.nan_to_num(self.targetFrequencies / numpy.linalg.norm(self.targetFrequencies));
 
 	def setTargetFreqs(self, targetFrequencies):
@@ -25,6 +25,16 @@ class CosineSimilarity(SimilarityMeasure):
 			similarity += numpy.dot(self.targetFrequencies[i], expFrequencies[i]);
 		return similarity;	# since all vals are positive, they'll definitely be >= 0
 
+	def getSimilarityMeasures(self, expFrequencies):
+		norms = numpy.linalg.norm(expFrequencies.reshape(expFrequencies.shape[0], -1), axis = 1);
+		expFrequencies = numpy.nan_to_num(expFrequencies / norms[:, numpy.newaxis, numpy.newaxis]);
+		return numpy.einsum('cpr,pr->c', expFrequencies, self.targetFrequencies, dtype = numpy.float64);
+
+	def getSimilarityGradient(self, expFrequencies):
+		# similarity = t . p / |p| where t is already unit length
+		norm = numpy.linalg.norm(expFrequencies);
+		return self.targetFrequencies / norm - numpy.sum(self.targetFrequencies * expFrequencies) * expFrequencies / norm**3;
+
 	def clone(self) -> SimilarityMeasure:
 		return CosineSimilarity(self.targetFrequencies);
 
@@ -22,8 +22,7 @@ class CosineSimilarityByPosition(SimilarityMeasure):
 	
 	# override
 	def getSimilarityMeasure(self, expFrequencies):
-		for i in range(self.targetFrequencies.shape[0]):
-			expFrequencies[i] = numpy.nan_to_num(expFrequencies[i] / numpy.linalg.norm(expFrequencies[i]));
+		expFrequencies = numpy.nan_to_num(expFrequencies / numpy.linalg.norm(expFrequencies, axis = 1, keepdims = True));
 		similarity = 0;
 		for i in range(self.targetFrequencies.shape[0]):
 			similarity += numpy.dot(self.targetFrequencies[i], expFrequencies[i]);
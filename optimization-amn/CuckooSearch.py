@@ -1,10 +1,48 @@
 from SearchAlgorithm import SearchAlgorithm
 from SimilarityMeasure import SimilarityMeasure
-from model import Model
+from model import Model, calcFitnesses, weightedProduct, fitnessesToFrequencies
+from ModelView import ModelView
+from BoltzmannTable import boltzmannAverage
+from ParsedDataCache import ParsedDataCache
+from EvaluationStore import EvaluationStore
 from datetime import *
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import copy
+import os
+import pickle
 import numpy
 import scipy.stats
 
+islandTemplate = None;		# CuckooSearch the islands of this process are evolved with, see initIslandWorker()
+
+def initIslandWorker(template:"CuckooSearch") -> None:
+	"""
+	Keeps the search that islands are evolved with in this process, so the data models are only
+	sent once to each worker process instead of with every island
+
+	@param template		CuckooSearch with the bounds, models and similarity measure of the search
+	@return void
+	"""
+	global islandTemplate;
+	islandTemplate = template;
+	return None;
+
+def runIsland(island:{}, generations:int) -> {}:
+	"""
+	Evolves one island for some generations. Picklable, so it can run in a worker process
+
+	@param island		Map<string, object> state of the island, see CuckooSearch.getIslandState()
+	@param generations	int, number of generations
+	@return Map<string, object> the new state of the island
+	"""
+	islandTemplate.setIslandState(island);
+	for i in range(generations):
+		islandTemplate.nextGeneration();
+	if islandTemplate.evaluationCache is not None:
+		islandTemplate.evaluationCache.flush();
+	return islandTemplate.getIslandState();
+
 class CuckooSearch(SearchAlgorithm):
 	"""
 	Cuckoo search for parameter optimization.
@@ -14,7 +52,31 @@ class CuckooSearch(SearchAlgorithm):
 	scaleParam = 1.0;			# scale parameter c used by the Levy distribution
 	elimination = 0.20;			# fraction of individuals elimiated on each generation, i.e. discovery rate by parent birds
 	populationSize = 512;		# number of eggs
-	population = [];			# model[populationSize]
+	usesEvaluationCache = True;
+
+	# the population, one row per egg
+	eggWeights = numpy.array([]);			# float[egg][macrostate]
+	eggSteepness = numpy.array([]);			# float[egg]
+	eggBoltzmannTemps = numpy.array([]);	# float[egg]
+	eggIndices = numpy.array([]);			# int[egg][3] indices of the ensemble size, backrub temperature and, when discrete, Boltzmann temperature in the bounds
+	eggRecovery = numpy.array([]);			# float[egg] similarity of each egg to the target
+	bestModel = None;						# ModelView of the best egg found
+
+	# island model, see setIslands()
+	nIslands = 1;				# number of sub-populations evolved independently
+	migrationInterval = 16;		# generations between migrations
+	migrationSize = 2;			# number of eggs each island sends on every migration
+	topology = 'ring';			# where islands send their eggs, 'ring' or 'random'
+	nProcesses = None;			# number of worker processes evolving the islands, None for one per island up to one per core
+	islandMatches = numpy.array([]);	# float[island] best match found by each island in the last search
+
+	# checkpoints of the search state, see setCheckpoints()
+	checkpointPath = None;				# file the state is saved to and resumed from, None to not checkpoint
+	checkpointGenerations = None;		# generations between checkpoints, None for no limit
+	checkpointInterval = None;			# timedelta between checkpoints, None for no limit
+	lastCheckpoint = (0, None);			# (generation, datetime) of the last checkpoint written
+	checkpointDataHash = None;			# hash of the data searched, e.g. Optimizer.getDataHash(), checkpoints of other data are not resumed
+	resumedGeneration = None;			# generation the last search resumed from, None if it started afresh
 
 	# TODO: update the models parameter
 	def __init__(self, models, similarityMeasure:SimilarityMeasure, continuousBoltzmann:bool, populationSize:int, scaleParam:float, elimination:float):
@@ -33,7 +95,74 @@ class CuckooSearch(SearchAlgorithm):
 		self.scaleParam = scaleParam;
 		self.populationSize = populationSize;
 		self.elimination = elimination;
-		self.population = [];
+		self.bestModel = None;
+		self.nIslands = 1;
+		self.islandMatches = numpy.array([]);
+		self.checkpointPath = None;
+		self.checkpointGenerations = None;
+		self.checkpointInterval = None;
+		self.checkpointDataHash = None;
+		self.resumedGeneration = None;
+
+	def setIslands(self, nIslands:int, migrationInterval:int = 16, migrationSize:int = 2, topology:str = 'ring', nProcesses:int = None) -> None:
+		"""
+		Splits the search into islands: independent populations of populationSize eggs each, evolved in
+		worker processes. Every migrationInterval generations, each island sends copies of its best eggs
+		to another island, where they replace the worst eggs. With a ring topology island i always
+		sends to island i + 1, with a random topology each island picks a different island every time.
+		The best parameters found by any island are reported as those of the search
+
+		@param nIslands				int, number of islands, 1 for a single population
+		@param migrationInterval	int, generations between migrations
+		@param migrationSize		int, eggs sent by each island on every migration
+		@param topology				string, 'ring' or 'random'
+		@param nProcesses			int, optional, number of worker processes. By default one per island, up to one per core.
+										With 1, the islands are evolved one after the other in this process
+		@return void
+		"""
+		if nIslands < 1:
+			raise ValueError("Need at least one island, not {:d}".format(nIslands));
+		if migrationInterval < 1:
+			raise ValueError("Need at least one generation between migrations, not {:d}".format(migrationInterval));
+		if migrationSize < 0 or migrationSize >= self.populationSize:
+			raise ValueError("Cannot migrate {:d} eggs from populations of {:d}".format(migrationSize, self.populationSize));
+		if topology not in ('ring', 'random'):
+			raise ValueError("Unknown island topology " + str(topology));
+		self.nIslands = nIslands;
+		self.migrationInterval = migrationInterval;
+		self.migrationSize = migrationSize;
+		self.topology = topology;
+		self.nProcesses = nProcesses;
+		return None;
+
+	def setCheckpoints(self, path:str, everyGenerations:int = None, everySeconds = None, dataHash:str = None) -> None:
+		"""
+		Saves the complete state of the search to a file as it runs: the population, the random state,
+		the best parameters, the generation and the trace. A search started while the file exists
+		resumes from it and gives the same result as if it had never stopped. A finished search leaves
+		its last state in the file, so running it again only reports the result.
+		Checkpoints are written when either interval has passed, checked once per generation, or once
+		per migration interval with islands. The file is written under a temporary name then renamed,
+		so a job killed while writing keeps the previous checkpoint. The evaluation cache is flushed
+		on every checkpoint.
+		A checkpoint is only resumed by a search with the same settings and target frequencies, and
+		with the same dataHash, so pass one to not resume a checkpoint after the data has changed
+
+		@param path					string, file to save to and resume from, None to stop checkpointing
+		@param everyGenerations		int, optional, generations between checkpoints
+		@param everySeconds			float seconds or timedelta, optional, wall-clock time between checkpoints
+		@param dataHash				string, optional, hash of the data searched, e.g. Optimizer.getDataHash()
+		@return void
+		"""
+		if path is not None and everyGenerations is None and everySeconds is None:
+			raise ValueError("Need a number of generations or of seconds between checkpoints");
+		if everyGenerations is not None and everyGenerations < 1:
+			raise ValueError("Need at least one generation between checkpoints, not {:d}".format(everyGenerations));
+		self.checkpointPath = path;
+		self.checkpointGenerations = everyGenerations;
+		self.checkpointInterval = timedelta(seconds = everySeconds) if everySeconds is not None and not isinstance(everySeconds, timedelta) else everySeconds;
+		self.checkpointDataHash = dataHash;
+		return None;
 
 	# PRIVATE
 	def initPopulation(self):
@@ -44,37 +173,180 @@ class CuckooSearch(SearchAlgorithm):
 		@return void
 		"""
 		self.bestMatchVal = 0;
-		self.population = [];
-		for i in range(self.populationSize):
-			# rand continuous params
-			thisSteepness = (numpy.random.rand() * (self.steepnessRange[1] - self.steepnessRange[0])) + self.steepnessRange[0] if self.searchSteepness else	self.steepnessRange[0];
-
-			thisWeights = numpy.random.rand(self.weightMins.size);	# rand init first
-			thisWeights *= (numpy.subtract(self.weightMaxs, self.weightMins));
-			thisWeights += self.weightMins;
-			thisWeights /= numpy.max(thisWeights); # TODO: normalize max to 1 or sum to 1?
-			for j in range(thisWeights.shape[0]):					# then force non-search weights to preset val
-				if not self.searchWeights[j]:
-					thisWeights[j] = self.weightMins[j];
-
-			# rand discrete params
-			thisEnsembleSize = self.ensembleSizes[numpy.random.randint(0, self.ensembleSizes.size)] if self.searchEnsemble else	self.ensembleSizes[0];
-			thisBackrubTemp = self.backrubTemps[numpy.random.randint(0, self.backrubTemps.size)] if self.searchBackrub else self.backrubTemps[0];
-			thisBoltzmannTemp = self.boltzmannTemps[numpy.random.randint(0, self.boltzmannTemps.size)] if self.searchBoltzmann else self.boltzmannTemps[0];
-			
-			# different IDs depending on whether boltzmann is continuous or not
-			if not self.continuousBoltzmann:
-				m = Model.constructFromExisting(self.getModelByParams(thisBackrubTemp, thisEnsembleSize, thisBoltzmannTemp), thisEnsembleSize, thisBackrubTemp, thisBoltzmannTemp, thisWeights, thisSteepness);
-			else:
-				m = Model.constructFromExisting(self.getModelByParams(thisBackrubTemp, None, None), thisEnsembleSize, thisBackrubTemp, thisBoltzmannTemp, thisWeights, thisSteepness);
-			m.macrostatesUsed = self.searchWeights;
-			m.recovery = self.similarityMeasure.getSimilarityMeasure(m.getFrequencies());
-			self.population.append(m);
-		self.population.sort(reverse = True);
+		n = self.populationSize;
+		# rand continuous params
+		steepness = numpy.random.rand(n) * (self.steepnessRange[1] - self.steepnessRange[0]) + self.steepnessRange[0] if self.searchSteepness else numpy.full(n, self.steepnessRange[0], dtype = numpy.float64);
+		weights = numpy.random.rand(n, self.weightMins.size);		# rand init first
+		weights *= numpy.subtract(self.weightMaxs, self.weightMins);
+		weights += self.weightMins;
+		weights /= numpy.max(weights, axis = 1, keepdims = True);	# TODO: normalize max to 1 or sum to 1?
+		weights = numpy.where(numpy.asarray(self.searchWeights, dtype = bool), weights, self.weightMins);	# then force non-search weights to preset val
+
+		# rand discrete params
+		indices = self.drawDiscreteIndices(n);
+		self.eggIndices = indices;
+		self.eggWeights = weights;
+		self.eggSteepness = steepness;
+		if self.continuousBoltzmann and self.searchBoltzmann:	# start from either end of the range
+			self.eggBoltzmannTemps = numpy.asarray(self.boltzmannTemps, dtype = numpy.float64)[numpy.random.randint(0, self.boltzmannTemps.size, n)];
+		else:
+			self.eggBoltzmannTemps = numpy.asarray(self.boltzmannTemps, dtype = numpy.float64)[indices[:, 2]];
+		self.eggRecovery = self.evaluateEggs(indices, self.eggBoltzmannTemps, weights, steepness);
 		self.recordBestParams();
 
+	# PRIVATE
+	def drawDiscreteIndices(self, n:int) -> numpy.array:
+		"""
+		Draws discrete parameters at random for new eggs, as indices in the bounds.
+		Parameters that are not searched get their first value
+
+		@param n		int, number of eggs
+		@return int[egg][3] indices of the ensemble size, backrub temperature and Boltzmann temperature.
+				The Boltzmann temperature index is only meaningful when its values are discrete
+		"""
+		indices = numpy.zeros([n, 3], dtype = int);
+		if self.searchEnsemble:
+			indices[:, 0] = numpy.random.randint(0, self.ensembleSizes.size, n);
+		if self.searchBackrub:
+			indices[:, 1] = numpy.random.randint(0, self.backrubTemps.size, n);
+		if self.searchBoltzmann and not self.continuousBoltzmann:
+			indices[:, 2] = numpy.random.randint(0, self.boltzmannTemps.size, n);
+		return indices;
+
+	# PRIVATE
+	def evaluateEggs(self, indices:numpy.array, boltzmannTemps:numpy.array, weights:numpy.array, steepness:numpy.array) -> numpy.array:
+		"""
+		Calculates the similarity to the target of a set of eggs. Eggs with the same discrete
+		parameters share a data model, so with macrostate data the frequencies of each group are
+		calculated in one pass over its energies. With microstate data every egg averages its own
+		ensemble. All eggs are then scored at once. Keeps the best egg as a candidate model if it
+		beats the best found so far. Eggs found in the evaluation cache are not evaluated again
+
+		@param indices			int[egg][3] of discrete parameter indices, see drawDiscreteIndices()
+		@param boltzmannTemps	float[egg] of Boltzmann temperatures
+		@param weights			float[egg][macrostate] of weights
+		@param steepness		float[egg] of steepnesses
+		@return float[egg] of similarities
+		"""
+		n = indices.shape[0];
+		recovery = numpy.zeros(n, dtype = numpy.float64);
+		keys = [None] * n;
+		evaluate = numpy.ones(n, dtype = bool);		# eggs that are not in the evaluation cache
+		if self.evaluationCache is not None:
+			for i in range(n):
+				keys[i] = self.evaluationCache.getKey([self.ensembleSizes[indices[i, 0]], self.backrubTemps[indices[i, 1]]], numpy.concatenate([[boltzmannTemps[i], steepness[i]], weights[i]]));
+				cached = self.evaluationCache.lookup(keys[i]);
+				if cached is not None:
+					recovery[i] = cached[0];
+					evaluate[i] = False;
+					if self.isNewBest(cached[0]):
+						self.bestModel = self.constructModel(self.ensembleSizes[indices[i, 0]], self.backrubTemps[indices[i, 1]], boltzmannTemps[i], weights[i], steepness[i]);
+						self.bestModel.macrostatesUsed = self.searchWeights;
+						self.bestModel.recovery = cached[0];
+						self.bestModel.frequencies = cached[1];
+		rows = numpy.flatnonzero(evaluate);
+		if rows.size == 0:
+			return recovery;
+
+		combinations, group = numpy.unique(indices[rows], axis = 0, return_inverse = True);
+		group = group.reshape(-1);
+		templates = [self.getTemplateModel(self.ensembleSizes[c[0]], self.backrubTemps[c[1]], self.boltzmannTemps[c[2]]) for c in combinations];
+		frequencies = None;			# float[evaluated egg][position][residue]
+		picks = None;				# (energies, microstates used, ensemble seed)[evaluated egg] with microstate data
+		if self.getModelLattice().useMicrostateData:
+			picks = [];
+			for j in range(rows.size):		# in egg order, so ensembles are picked in the same order for any grouping
+				i = rows[j];
+				picks.append(self.averageEggEnergies(templates[group[j]], self.ensembleSizes[indices[i, 0]], self.backrubTemps[indices[i, 1]], boltzmannTemps[i]));
+				f = self.calcEggFrequencies(picks[j][0], weights[i:i + 1], steepness[i:i + 1]);
+				if frequencies is None:
+					frequencies = numpy.empty((rows.size,) + f.shape[1:], dtype = f.dtype);
+				frequencies[j] = f[0];
+		else:
+			for g in range(len(templates)):
+				members = numpy.flatnonzero(group == g);
+				f = self.calcEggFrequencies(templates[g].macrostateResidueEnergies, weights[rows[members]], steepness[rows[members]]);
+				if frequencies is None:
+					frequencies = numpy.empty((rows.size,) + f.shape[1:], dtype = f.dtype);
+				frequencies[members] = f;
+		recovery[rows] = self.similarityMeasure.getSimilarityMeasures(frequencies);
+		self.nEvaluations += rows.size;
+		if self.evaluationCache is not None:
+			for j in range(rows.size):
+				self.evaluationCache.insert(keys[rows[j]], recovery[rows[j]], frequencies[j]);
+
+		# a NaN match (e.g. all weights 0) is never the best
+		j = int(numpy.argmax(numpy.nan_to_num(recovery[rows], nan = -numpy.inf)));
+		i = rows[j];
+		if self.isNewBest(recovery[i]):
+			m = ModelView(templates[group[j]], self.ensembleSizes[indices[i, 0]], self.backrubTemps[indices[i, 1]], boltzmannTemps[i], weights[i], steepness[i], None if picks is None else picks[j][2], self.ensembleCache, self.sigmoidCache);
+			m.macrostatesUsed = self.searchWeights;
+			m.recovery = recovery[i];
+			m.frequencies = numpy.array(frequencies[j]);
+			m.frequencies.flags.writeable = False;
+			if picks is not None:
+				m.macrostateResidueEnergies, m.microstatesUsed = picks[j][0], picks[j][1];
+				m.areMicrostatesPicked = True;
+			self.bestModel = m;
+		return recovery;
+
+	# PRIVATE
+	def calcEggFrequencies(self, energies:numpy.array, weights:numpy.array, steepness:numpy.array) -> numpy.array:
+		"""
+		Frequencies of a batch of eggs sharing one set of energies. With a sigmoid cache, the sigmoid
+		terms of each distinct steepness come from it, e.g. when the steepness is not searched
+
+		@param energies		double[position][residue energy][macrostate] of averaged energies
+		@param weights		float[egg][macrostate] of weights
+		@param steepness	float[egg] of steepnesses
+		@return float[egg][position][residue] of frequencies, NaN for eggs with all weights 0
+		"""
+		with numpy.errstate(divide = 'ignore', invalid = 'ignore'):		# all weights 0 has no frequencies
+			if self.sigmoidCache is None:
+				return fitnessesToFrequencies(calcFitnesses(energies, weights, steepness));
+			values, which = numpy.unique(steepness, return_inverse = True);
+			which = which.reshape(-1);
+			fitnesses = None;
+			for v in range(values.size):
+				members = numpy.flatnonzero(which == v);
+				sigmoids = self.sigmoidCache.getSigmoids(energies, values[v]);
+				f = weightedProduct(sigmoids, weights[members].astype(sigmoids.dtype)[:, numpy.newaxis, numpy.newaxis, :]);
+				if fitnesses is None:
+					fitnesses = numpy.empty((steepness.size,) + f.shape[1:], dtype = f.dtype);
+				fitnesses[members] = f;
+			return fitnessesToFrequencies(fitnesses);
+
+	# PRIVATE
+	def isNewBest(self, match:float) -> bool:
+		"""
+		Does a match beat that of the best model so far? A NaN best is beaten by anything
+
+		@param match	float
+		@return bool
+		"""
+		return self.bestModel is None or match > self.bestModel.recovery or numpy.isnan(self.bestModel.recovery);
+
+	# PRIVATE
+	def averageEggEnergies(self, template:Model, ensembleSize:int, backrubTemp:float, boltzmannTemp:float) -> (numpy.array, numpy.array, int):
+		"""
+		Picks a microstate ensemble for an egg and Boltzmann averages it, through the ensemble cache if there is one
+
+		@param template			Model of the microstate data
+		@param ensembleSize		int, ensemble size
+		@param backrubTemp		float, backrub temperature
+		@param boltzmannTemp	float, Boltzmann averaging temperature
+		@return double[position][residue energy][macrostate] of averaged energies,
+				int[position][macrostate][microstate index] of the picks and the int seed they were picked with, or None
+		"""
+		if self.ensembleCache is not None:
+			# the cache fills in models, see EnsembleCache.averageMicrostates()
+			view = ModelView(template, ensembleSize, backrubTemp, boltzmannTemp, None, None, numpy.random.randint(0, self.nEnsembleSeeds), self.ensembleCache);
+			view.averageMicrostates();
+			return view.macrostateResidueEnergies, view.microstatesUsed, view.ensembleSeed;
+		used, selected = template.selectMicrostates(ensembleSize, numpy.random);
+		return boltzmannAverage(selected, boltzmannTemp, template.useAltAveragingMethod), used, None;
+
 	def iterate(self):
-		self.initPopulation();
 		# structure from the cuckoo search implementation in MATLAB by the authors
 		# cuckoo = individual solution
 		# on each iteration, every cuckoo does a Levy flight from its nest and lays a new egg
@@ -83,8 +355,15 @@ class CuckooSearch(SearchAlgorithm):
 		# a certain percentage of birds are replaced by new birds
 		#	the authors say some of the worse nests are replaced, but their code implies
 		#	the all nests have an equal chance of being replaced....
+		# every step is done for the whole population at once
 
 		start = datetime.now();	# track runtime
+		self.startTrace(start);
+		self.nEvaluations = 0;
+		checkpoint = self.readCheckpoint();
+		self.resumedGeneration = None if checkpoint is None else checkpoint['generation'];
+		if checkpoint is not None and not self.suppressOutputs:
+			print("resuming from generation {:d} of {:s}".format(checkpoint['generation'], self.checkpointPath));
 
 		# a little progress bar to make the wait bearable
 		if not self.suppressOutputs:
@@ -97,65 +376,408 @@ class CuckooSearch(SearchAlgorithm):
 				print('_', end='');
 			print();
 
-		for i in range(self.maxIterations):
-			for j in range(self.populationSize):
-				# Levy flight away from this bird's parameters
-				# TODO: should the Levy steps be scales differently for each parameter? probably yes.
-				newSteepness = self.boundCheckSteepness(self.nextLevyStep() + self.population[j].getSteepness());
-				newWeights = self.boundCheckWeights(self.nextLevySteps(self.bestWeights.size) + self.population[j].getWeights());
-
-				# TODO: implement something that is a single hop in the discrete vars instead of random
-				newEnsembleSize = self.ensembleSizes[numpy.random.randint(0, self.ensembleSizes.size)] if self.searchEnsemble else self.ensembleSizes[0];
-				newBackrubTemp = self.backrubTemps[numpy.random.randint(0, self.backrubTemps.size)] if self.searchBackrub else self.backrubTemps[0];
-				# 2 differents conditions for Boltzmann temperatures
-				if not self.continuousBoltzmann:
-					newBoltzmannTemp = self.boltzmannTemps[numpy.random.randint(0, self.boltzmannTemps.size)] if self.searchBoltzmann else self.boltzmannTemps[0];
-					newModel = Model.constructFromExisting(self.getModelByParams(newBackrubTemp, newEnsembleSize, newBoltzmannTemp), newEnsembleSize, newBackrubTemp, newBoltzmannTemp, newWeights, newSteepness);
-				else:
-					newBoltzmannTemp = self.boundCheckBoltzmann(self.nextLevyStep() + self.population[j].getBoltzmannTemp());
-					newModel = Model.constructFromExisting(self.getModelByParams(newBackrubTemp, None, None), newEnsembleSize, newBackrubTemp, newBoltzmannTemp, newWeights, newSteepness);
-					
-				newModel.recovery = self.similarityMeasure.getSimilarityMeasure(newModel.getFrequencies());
-				# replace parent if better
-				if newModel.recovery > self.population[j].recovery:
-					self.population[j] = newModel;
-
-				# is this egg to be replaced?
-				if (numpy.random.rand() < self.elimination):
-					# if so, the replacement egg should be somewhat similar to the original egg
-					# see auther's MATLAB implementation. I don't *quite* understand why this method. Yet.
-					randParent1 = numpy.random.randint(0, self.populationSize);
-					randParent2 = numpy.random.randint(0, self.populationSize);
-					multiplier = numpy.random.rand();
-					steepnessStep = multiplier * (self.population[randParent1].getSteepness() - self.population[randParent2].getSteepness());
-					weightsStep = multiplier * (self.population[randParent1].getWeights() - self.population[randParent2].getWeights());
-					newSteepness = self.boundCheckSteepness(self.population[j].getSteepness() + steepnessStep);
-					newWeights = self.boundCheckWeights(self.population[j].getWeights() + weightsStep);
-
-					# TODO implement something to move between discrete vars instead of random
-					newEnsembleSize = self.ensembleSizes[numpy.random.randint(0, self.ensembleSizes.size)] if self.searchEnsemble else self.ensembleSizes[0];
-					newBackrubTemp = self.backrubTemps[numpy.random.randint(0, self.backrubTemps.size)] if self.searchBackrub else self.backrubTemps[0];
-					if not self.continuousBoltzmann:
-						newBoltzmannTemp = self.boltzmannTemps[numpy.random.randint(0, self.boltzmannTemps.size)] if self.searchBoltzmann else self.boltzmannTemps[0];	
-						newModel = Model.constructFromExisting(self.getModelByParams(newBackrubTemp, newEnsembleSize, newBoltzmannTemp), newEnsembleSize, newBackrubTemp, newBoltzmannTemp, newWeights, newSteepness);
-					else:
-						boltzmannStep = multiplier * (self.population[randParent1].getBoltzmannTemp() - self.population[randParent2].getBoltzmannTemp());
-						newBoltzmannTemp = self.boundCheckBoltzmann(self.population[j].getBoltzmannTemp() + boltzmannStep);
-						newModel = Model.constructFromExisting(self.getModelByParams(newBackrubTemp, None, None), newEnsembleSize, newBackrubTemp, newBoltzmannTemp, newWeights, newSteepness);
-						
-					newModel.recovery = self.similarityMeasure.getSimilarityMeasure(newModel.getFrequencies());
-
-					self.population[j] = newModel;
-
-			self.population.sort(reverse = True);
-			if (self.population[0].recovery > self.bestMatchVal):
-				self.recordBestParams();
-			if not self.suppressOutputs:
-				if int(numpy.mod(i, updateStep)) == 0:
-					print(">", end='');
+		if self.nIslands > 1:
+			self.iterateIslands(None if self.suppressOutputs else updateStep, checkpoint);
+		else:
+			if checkpoint is None:
+				self.bestModel = None;
+				self.initPopulation();
+				self.recordGeneration(0, numpy.nanmean(self.eggRecovery));
+				generation = 0;
+				stopped = False;
+			else:
+				self.restoreCheckpoint(checkpoint);
+				self.setIslandState(checkpoint['population']);
+				self.rebuildBestModel();
+				generation = checkpoint['generation'];
+				stopped = checkpoint['stopped'];
+			self.lastCheckpoint = (generation, datetime.now());
+			while not stopped and generation < self.maxIterations:
+				self.nextGeneration();
+				if not self.suppressOutputs:
+					if int(numpy.mod(generation, updateStep)) == 0:
+						print(">", end='');
+				generation += 1;
+				stopped = self.recordGeneration(generation, numpy.nanmean(self.eggRecovery));
+				if self.checkpointDue(generation, stopped):
+					self.writeCheckpoint(generation, stopped, population = self.getIslandState());
 		if not self.suppressOutputs:
 			print();
-		self.elapsedTime = datetime.now() - start;
+		if self.evaluationCache is not None:
+			self.evaluationCache.flush();
+		self.elapsedTime = datetime.now() - self.searchStart;		# including the time before a resume
+
+	# PRIVATE
+	def nextGeneration(self) -> None:
+		"""
+		Evolves the population by one generation
+
+		@param void
+		@return void
+		"""
+		n = self.populationSize;
+		# Levy flight away from each bird's parameters
+		# TODO: should the Levy steps be scales differently for each parameter? probably yes.
+		newSteepness = self.boundCheckSteepness(self.nextLevySteps(n) + self.eggSteepness);
+		newWeights = self.boundCheckWeights(self.nextLevySteps([n, self.eggWeights.shape[1]]) + self.eggWeights);
+		# TODO: implement something that is a single hop in the discrete vars instead of random
+		newIndices = self.drawDiscreteIndices(n);
+		# 2 differents conditions for Boltzmann temperatures
+		if not self.continuousBoltzmann:
+			newBoltzmannTemps = numpy.asarray(self.boltzmannTemps, dtype = numpy.float64)[newIndices[:, 2]];
+		else:
+			newBoltzmannTemps = self.boundCheckBoltzmann(self.nextLevySteps(n) + self.eggBoltzmannTemps);
+		newRecovery = self.evaluateEggs(newIndices, newBoltzmannTemps, newWeights, newSteepness);
+		# replace parents that are worse
+		self.replaceEggs(newRecovery > self.eggRecovery, newIndices, newBoltzmannTemps, newWeights, newSteepness, newRecovery);
+
+		# eggs discovered by the host are replaced by eggs somewhat similar to the original
+		# see auther's MATLAB implementation. I don't *quite* understand why this method. Yet.
+		discovered = numpy.flatnonzero(numpy.random.rand(n) < self.elimination);
+		if discovered.size > 0:
+			randParents1 = numpy.random.randint(0, n, discovered.size);
+			randParents2 = numpy.random.randint(0, n, discovered.size);
+			multipliers = numpy.random.rand(discovered.size);
+			newSteepness = self.boundCheckSteepness(self.eggSteepness[discovered] + multipliers * (self.eggSteepness[randParents1] - self.eggSteepness[randParents2]));
+			newWeights = self.boundCheckWeights(self.eggWeights[discovered] + multipliers[:, numpy.newaxis] * (self.eggWeights[randParents1] - self.eggWeights[randParents2]));
+			# TODO implement something to move between discrete vars instead of random
+			newIndices = self.drawDiscreteIndices(discovered.size);
+			if not self.continuousBoltzmann:
+				newBoltzmannTemps = numpy.asarray(self.boltzmannTemps, dtype = numpy.float64)[newIndices[:, 2]];
+			else:
+				newBoltzmannTemps = self.boundCheckBoltzmann(self.eggBoltzmannTemps[discovered] + multipliers * (self.eggBoltzmannTemps[randParents1] - self.eggBoltzmannTemps[randParents2]));
+			newRecovery = self.evaluateEggs(newIndices, newBoltzmannTemps, newWeights, newSteepness);
+			replaced = numpy.zeros(n, dtype = bool);
+			replaced[discovered] = True;
+			self.replaceEggs(replaced, newIndices, newBoltzmannTemps, newWeights, newSteepness, newRecovery, discovered);
+
+		if self.bestModel.recovery > self.bestMatchVal:
+			self.recordBestParams();
+		return None;
+
+	# PRIVATE
+	def iterateIslands(self, updateStep:int = None, checkpoint:{} = None) -> None:
+		"""
+		Runs the search as islands, see setIslands(). Each island is seeded from the global numpy
+		random state, so results only depend on the seed and not on the number of processes
+
+		@param updateStep	int, generations per progress mark, None to print nothing
+		@param checkpoint	Map<string, object>, optional, state to resume from, see readCheckpoint()
+		@return void
+		"""
+		template = copy.copy(self);		# what the workers evolve the islands with
+		template.nIslands = 1;
+		template.suppressOutputs = True;
+		template.checkpointPath = None;
+		if checkpoint is None:
+			islands = [{'seed' : seed} for seed in numpy.random.randint(0, 2**31 - 1, self.nIslands)];
+			done = 0;
+			stopped = False;
+		else:
+			self.restoreCheckpoint(checkpoint);
+			islands = checkpoint['islands'];
+			done = checkpoint['generation'];
+			stopped = checkpoint['stopped'];
+		self.lastCheckpoint = (done, datetime.now());
+		nProcesses = self.nProcesses if self.nProcesses is not None else min(self.nIslands, os.cpu_count() or 1);
+
+		pool = None;
+		if nProcesses > 1 and not stopped and done < self.maxIterations:
+			pool = ProcessPoolExecutor(max_workers = nProcesses, initializer = initIslandWorker, initargs = (template,));
+		try:
+			while not stopped and done < self.maxIterations:
+				generations = min(self.migrationInterval, self.maxIterations - done);
+				if pool is not None:
+					islands = list(pool.map(runIsland, islands, itertools.repeat(generations)));
+				else:
+					state = numpy.random.get_state();		# the islands have random states of their own
+					initIslandWorker(template);
+					islands = [runIsland(island, generations) for island in islands];
+					initIslandWorker(None);
+					numpy.random.set_state(state);
+				if updateStep is not None:
+					print(">" * len([i for i in range(done, done + generations) if i % updateStep == 0]), end='');
+				done += generations;
+				self.nEvaluations = sum([island['evaluations'] for island in islands]);
+				self.recordBestIsland(islands);
+				stopped = self.recordGeneration(done, numpy.nanmean(numpy.concatenate([island['recovery'] for island in islands])));
+				if not stopped and done < self.maxIterations:
+					self.migrate(islands);
+				if self.checkpointDue(done, stopped):
+					self.writeCheckpoint(done, stopped, islands = islands);
+		finally:
+			if pool is not None:
+				pool.shutdown();
+
+		# the population is that of all the islands
+		self.eggWeights = numpy.concatenate([island['weights'] for island in islands]);
+		self.eggSteepness = numpy.concatenate([island['steepness'] for island in islands]);
+		self.eggBoltzmannTemps = numpy.concatenate([island['boltzmannTemps'] for island in islands]);
+		self.eggIndices = numpy.concatenate([island['indices'] for island in islands]);
+		self.eggRecovery = numpy.concatenate([island['recovery'] for island in islands]);
+		self.rebuildBestModel();
+		return None;
+
+	# PRIVATE
+	def recordBestIsland(self, islands:[{}]) -> None:
+		"""
+		Takes the best parameters found by any island as those of the search
+
+		@param islands		Map<string, object>[] island states, see getIslandState()
+		@return void
+		"""
+		self.islandMatches = numpy.array([island['best']['match'] for island in islands]);
+		self.setBestParams(islands[int(numpy.argmax(numpy.nan_to_num(self.islandMatches, nan = -numpy.inf)))]['best']);
+		return None;
+
+	# PRIVATE
+	def setBestParams(self, best:{}) -> None:
+		"""
+		Takes saved best parameters as those of the search
+
+		@param best		Map<string, object> from getBestParameters(), with the frequencies under 'frequencies'
+		@return void
+		"""
+		self.bestEnsembleSize = best['ensembleSize'];
+		self.bestBackrubTemp = best['backrubTemp'];
+		self.bestBoltzmannTemp = best['boltzmannTemp'];
+		self.bestSteepness = best['steepness'];
+		self.bestWeights = best['weights'];
+		self.bestFrequencies = best['frequencies'];
+		self.bestMatchVal = best['match'];
+		return None;
+
+	# PRIVATE
+	def rebuildBestModel(self) -> None:
+		"""
+		Makes the best model from the best parameters, e.g. after they were put together from islands
+		or a checkpoint. Does not draw from the random state of the search
+
+		@param void
+		@return void
+		"""
+		state = numpy.random.get_state();		# picking an ensemble seed draws a random number
+		self.bestModel = self.constructModel(self.bestEnsembleSize, self.bestBackrubTemp, self.bestBoltzmannTemp, self.bestWeights, self.bestSteepness);
+		numpy.random.set_state(state);
+		self.bestModel.macrostatesUsed = self.searchWeights;
+		self.bestModel.recovery = self.bestMatchVal;
+		self.bestModel.frequencies = self.bestFrequencies;
+		return None;
+
+	# PRIVATE
+	def migrate(self, islands:[{}]) -> None:
+		"""
+		Sends copies of the best eggs of every island to another island, where they replace the worst eggs.
+		All emigrants are picked before any of them arrive
+
+		@param islands		Map<string, object>[] island states, see getIslandState(). Changed in place
+		@return void
+		"""
+		k = self.migrationSize;
+		if k == 0:
+			return None;
+		n = len(islands);
+		if self.topology == 'ring':
+			destinations = (numpy.arange(n) + 1) % n;
+		else:
+			destinations = (numpy.arange(n) + numpy.random.randint(1, n, n)) % n;	# any island but itself
+		fields = ('weights', 'steepness', 'boltzmannTemps', 'indices', 'recovery');
+		emigrants = [];
+		for island in islands:
+			elite = CuckooSearch.getElite(island['recovery'], k);
+			emigrants.append({field : island[field][elite].copy() for field in fields});
+		for d in numpy.unique(destinations):
+			# with a random topology, an island may get eggs from several others at once
+			senders = numpy.flatnonzero(destinations == d);
+			island = islands[d];
+			nArrivals = min(k * senders.size, island['recovery'].size);
+			worst = numpy.argpartition(numpy.nan_to_num(island['recovery'], nan = -numpy.inf), nArrivals - 1)[:nArrivals];
+			for field in fields:
+				island[field][worst] = numpy.concatenate([emigrants[i][field] for i in senders])[:nArrivals];
+		return None;
+
+	# PRIVATE
+	def getIslandState(self) -> {}:
+		"""
+		The state of the population evolved by this search, as an island
+
+		@param void
+		@return Map<string, object> with the egg arrays, the best parameters and the random state
+		"""
+		island = {};
+		island['weights'] = self.eggWeights;
+		island['steepness'] = self.eggSteepness;
+		island['boltzmannTemps'] = self.eggBoltzmannTemps;
+		island['indices'] = self.eggIndices;
+		island['recovery'] = self.eggRecovery;
+		island['best'] = self.getBestParameters();
+		island['best']['frequencies'] = self.bestFrequencies;
+		island['evaluations'] = self.nEvaluations;
+		island['random'] = numpy.random.get_state();
+		return island;
+
+	# PRIVATE
+	def setIslandState(self, island:{}) -> None:
+		"""
+		Continues evolving an island. A new island only holds its seed, its population is initialized
+
+		@param island		Map<string, object> state from getIslandState(), or {'seed' : int}
+		@return void
+		"""
+		self.bestModel = None;
+		self.nEvaluations = island.get('evaluations', 0);
+		if 'random' not in island:
+			numpy.random.seed(island['seed']);
+			self.initPopulation();
+			return None;
+		numpy.random.set_state(island['random']);
+		self.eggWeights = island['weights'];
+		self.eggSteepness = island['steepness'];
+		self.eggBoltzmannTemps = island['boltzmannTemps'];
+		self.eggIndices = island['indices'];
+		self.eggRecovery = island['recovery'];
+		self.setBestParams(island['best']);
+		return None;
+
+	# PRIVATE
+	def getCheckpointSettings(self) -> str:
+		"""
+		The settings a checkpoint can only be resumed with, including the data and the target
+		frequencies searched. The number of generations and of processes may change between runs
+
+		@param void
+		@return string
+		"""
+		settings = (self.checkpointDataHash, EvaluationStore.hashArray(self.similarityMeasure.targetFrequencies),
+			type(self.similarityMeasure).__name__, self.populationSize, self.scaleParam, self.elimination,
+			self.nIslands, self.migrationInterval, self.migrationSize, self.topology, self.continuousBoltzmann,
+			numpy.asarray(self.ensembleSizes).tolist(), numpy.asarray(self.backrubTemps).tolist(), numpy.asarray(self.boltzmannTemps).tolist(),
+			numpy.asarray(self.steepnessRange).tolist(), numpy.asarray(self.weightMins).tolist(), numpy.asarray(self.weightMaxs).tolist(),
+			self.searchEnsemble, self.searchBackrub, self.searchBoltzmann, self.searchSteepness, numpy.asarray(self.searchWeights).tolist());
+		return repr(settings);
+
+	# PRIVATE
+	def checkpointDue(self, generation:int, stopped:bool) -> bool:
+		"""
+		Whether to write a checkpoint now. The last generation of a search is always checkpointed
+
+		@param generation	int, number of generations done
+		@param stopped		bool, did a stopping rule end the search?
+		@return bool
+		"""
+		if self.checkpointPath is None:
+			return False;
+		if stopped or generation >= self.maxIterations:
+			return True;
+		if self.checkpointGenerations is not None and generation - self.lastCheckpoint[0] >= self.checkpointGenerations:
+			return True;
+		return self.checkpointInterval is not None and datetime.now() - self.lastCheckpoint[1] >= self.checkpointInterval;
+
+	# PRIVATE
+	def writeCheckpoint(self, generation:int, stopped:bool, population:{} = None, islands:[{}] = None) -> None:
+		"""
+		Saves the state of the search to the checkpoint file, see setCheckpoints()
+
+		@param generation	int, number of generations done
+		@param stopped		bool, did a stopping rule end the search?
+		@param population	Map<string, object>, state of the population from getIslandState(), without islands
+		@param islands		Map<string, object>[] island states after migration, with islands
+		@return void
+		"""
+		if self.evaluationCache is not None:
+			self.evaluationCache.flush();
+		checkpoint = {};
+		checkpoint['settings'] = self.getCheckpointSettings();
+		checkpoint['generation'] = generation;
+		checkpoint['stopped'] = stopped;
+		checkpoint['stopReason'] = self.stopReason if stopped else '';
+		checkpoint['trace'] = list(self.trace);
+		checkpoint['evaluations'] = self.nEvaluations;
+		checkpoint['lastImprovement'] = self.lastImprovement;
+		checkpoint['improvementReference'] = self.improvementReference;
+		checkpoint['seconds'] = (datetime.now() - self.searchStart).total_seconds();
+		checkpoint['best'] = self.getBestParameters();
+		checkpoint['best']['frequencies'] = self.bestFrequencies;
+		checkpoint['random'] = numpy.random.get_state();
+		checkpoint['population'] = population;
+		checkpoint['islands'] = islands;
+		ParsedDataCache.writeAtomic(self.checkpointPath, lambda outfile : pickle.dump(checkpoint, outfile, protocol = pickle.HIGHEST_PROTOCOL));
+		self.lastCheckpoint = (generation, datetime.now());
+		return None;
+
+	# PRIVATE
+	def readCheckpoint(self) -> {}:
+		"""
+		Loads the checkpoint file, if there is one
+
+		@param void
+		@return Map<string, object> state saved by writeCheckpoint(), or None if there is nothing to resume from.
+				Raises ValueError if the checkpoint was written by a search with other settings
+		"""
+		if self.checkpointPath is None or not os.path.exists(self.checkpointPath):
+			return None;
+		with open(self.checkpointPath, 'rb') as infile:
+			checkpoint = pickle.load(infile);
+		if checkpoint['settings'] != self.getCheckpointSettings():
+			raise ValueError("Checkpoint " + self.checkpointPath + " was written by a search with other settings or data, remove it to start afresh");
+		return checkpoint;
+
+	# PRIVATE
+	def restoreCheckpoint(self, checkpoint:{}) -> None:
+		"""
+		Takes the trace, the stopping rule counters, the best parameters and the random state of a
+		checkpoint. The population is restored by the caller
+
+		@param checkpoint	Map<string, object> from readCheckpoint()
+		@return void
+		"""
+		self.searchStart = datetime.now() - timedelta(seconds = checkpoint['seconds']);
+		self.trace = list(checkpoint['trace']);
+		if checkpoint['stopped']:
+			self.stopReason = checkpoint['stopReason'];
+		self.nEvaluations = checkpoint['evaluations'];
+		self.lastImprovement = checkpoint['lastImprovement'];
+		self.improvementReference = checkpoint['improvementReference'];
+		self.setBestParams(checkpoint['best']);
+		numpy.random.set_state(checkpoint['random']);
+		return None;
+
+	# PRIVATE
+	def replaceEggs(self, mask:numpy.array, indices:numpy.array, boltzmannTemps:numpy.array, weights:numpy.array, steepness:numpy.array, recovery:numpy.array, rows:numpy.array = None) -> None:
+		"""
+		Overwrites the eggs picked by a mask with new ones
+
+		@param mask				bool[egg], which eggs of the population to replace
+		@param indices			int[new egg][3] of discrete parameter indices
+		@param boltzmannTemps	float[new egg]
+		@param weights			float[new egg][macrostate]
+		@param steepness		float[new egg]
+		@param recovery			float[new egg]
+		@param rows				int[new egg], optional, the egg each new egg is for. By default there is one new egg per egg
+		@return void
+		"""
+		picked = mask if rows is None else mask[rows];		# which new eggs are kept
+		targets = numpy.flatnonzero(mask) if rows is None else rows[picked];
+		self.eggIndices[targets] = indices[picked];
+		self.eggBoltzmannTemps[targets] = boltzmannTemps[picked];
+		self.eggWeights[targets] = weights[picked];
+		self.eggSteepness[targets] = steepness[picked];
+		self.eggRecovery[targets] = recovery[picked];
+		return None;
+
+	# STATIC
+	def getElite(recovery:numpy.array, k:int) -> numpy.array:
+		"""
+		The best eggs of a population. NaN matches count as the worst
+
+		@param recovery		float[egg] of the similarities of the eggs, e.g. eggRecovery
+		@param k			int, number of eggs
+		@return int[k] of egg indices, best first
+		"""
+		recovery = numpy.nan_to_num(recovery, nan = -numpy.inf);
+		k = min(k, recovery.size);
+		elite = numpy.argpartition(-recovery, k - 1)[:k];
+		return elite[numpy.argsort(-recovery[elite], kind = 'stable')];
 
 	def nextLevyStep(self) -> float:
 		"""
@@ -166,34 +788,43 @@ class CuckooSearch(SearchAlgorithm):
 		@param void
 		@return float
 		"""
+		return float(self.nextLevySteps(1)[0]);
+
+	def nextLevySteps(self, steps) -> numpy.array:
+		"""
+		Generates an array of Levy steps
+
+		@param steps		int or int[] shape of array
+		@return float[]		an array of independent Levy steps
+		"""
 		# generate a random Levy by transforming from a rand uniform
 		# see https://en.wikipedia.org/wiki/L%C3%A9vy_distribution#Random_sample_generation
-		r1 = numpy.random.rand();
+		r1 = numpy.random.rand(*numpy.atleast_1d(steps));
 		randLevy = self.scaleParam * numpy.power(scipy.stats.norm.ppf(1.0 - r1 / 2.0), -2); # ppf is the inverse normal cdf
 		# random direction
-		r2 = numpy.sign((numpy.random.rand() - 0.5));
+		r2 = numpy.sign(numpy.random.rand(*numpy.atleast_1d(steps)) - 0.5);
 		return randLevy * r2 * 0.01; # Cuckoo search authors says to use 1/100 of the scale length
 
-	def nextLevySteps(self, steps:int) -> numpy.array:
-		"""
-		Generates an array of Levy steps
+	def recordBestParams(self) -> None:
+		self.bestBackrubTemp = self.bestModel.getBackrubTemp();
+		self.bestBoltzmannTemp = self.bestModel.getBoltzmannTemp();
+		self.bestEnsembleSize = self.bestModel.getEnsembleSize();
+		self.bestSteepness = self.bestModel.getSteepness();
+		self.bestWeights = self.bestModel.getWeights();
+		self.bestFrequencies = self.bestModel.getFrequencies();
+		self.bestMatchVal = self.bestModel.recovery;
 
-		@param steps		size of array
-		@return float[]		an array of independent Levy steps
+	def getBestModel(self):
 		"""
-		out = numpy.zeros(steps);
-		for i in range(steps):
-			out[i] = self.nextLevyStep();
-		return out;
+		The candidate model of the best egg found by the last search
 
-	def recordBestParams(self) -> None:
-		self.bestBackrubTemp = self.population[0].getBackrubTemp();
-		self.bestBoltzmannTemp = self.population[0].getBoltzmannTemp();
-		self.bestEnsembleSize = self.population[0].getEnsembleSize();
-		self.bestSteepness = self.population[0].getSteepness();
-		self.bestWeights = self.population[0].getWeights();
-		self.bestFrequencies = self.population[0].getFrequencies();
-		self.bestMatchVal = self.population[0].recovery;
+		@param void
+		@return ModelView
+		"""
+		return self.bestModel;
 
 	def __str__(self, **kwargs):
-		return "Cuckoo search, scale: {:.4f}, elimination: {:.4f}, population: {:d}, generations: {:d}".format(self.scaleParam, self.elimination, self.populationSize, self.maxIterations);
\ No newline at end of file
+		out = "Cuckoo search, scale: {:.4f}, elimination: {:.4f}, population: {:d}, generations: {:d}".format(self.scaleParam, self.elimination, self.populationSize, self.maxIterations);
+		if self.nIslands > 1:
+			out += ", islands: {:d}, {:s} migration of {:d} eggs every {:d} generations".format(self.nIslands, self.topology, self.migrationSize, self.migrationInterval);
+		return out;
\ No newline at end of file
@@ -0,0 +1,160 @@
+import numpy
+import itertools
+import string
+
+RESIDUES = 'ACDEFGHIKLMNPQRSTVWY';		# order of the residues in energy arrays, profiles and frequencies, same as the RESIDUES enum of model
+
+# one letter code (as a byte) -> index in RESIDUES
+residueIndex = numpy.full(256, -1, dtype = int);
+for i in range(len(RESIDUES)):
+	residueIndex[ord(RESIDUES[i])] = i;
+
+# str.translate tables that split "{'W':-1.5, 'F':0.25, }" into its keys "WF" and its values " -1.5  0.25  "
+# energies are written with %f or str(float), which never use upper case letters
+keysOnly = {c : None for c in range(128) if chr(c) not in string.ascii_uppercase};
+valuesOnly = {ord(c) : None for c in string.ascii_uppercase + "{}':"};
+valuesOnly[ord(',')] = ' ';
+
+def parseEnergyDicts(dicts:"string[]", out:numpy.array = None) -> numpy.array:
+	"""
+	Parses dict literals of residue energies, e.g. "{'W':-1.5, 'F':0.25, ...}" as written by
+	StateDataTools, into an array in residue order without evaluating them one by one.
+	The keys and the values of all the dicts are each pulled out in one pass over the joined text.
+	Every dict must hold each of the 20 residues exactly once, in any order
+
+	@param dicts		string[] of dict literals
+	@param out			double[entry][residue], optional, preallocated array to parse into
+	@return double[entry][residue] of energies
+	"""
+	n = len(dicts);
+	if out is None:
+		out = numpy.empty([n, 20], dtype = numpy.float64);
+
+	text = ' '.join(dicts);		# dicts may not end in a separator, e.g. "...'Y':-1.7}
+	keys = residueIndex[numpy.frombuffer(text.translate(keysOnly).encode('ascii'), dtype = numpy.uint8)];
+	values = numpy.fromstring(text.translate(valuesOnly), sep = ' ');
+	if keys.size != 20 * n or values.size != 20 * n:
+		raise ValueError("Expected 20 residue energies in each of {:d} entries, found {:d} residues and {:d} energies".format(n, keys.size, values.size));
+	rows = numpy.repeat(numpy.arange(n), 20);
+	if numpy.any(keys < 0) or numpy.any(numpy.bincount(rows * 20 + keys, minlength = 20 * n) != 1):
+		raise ValueError("Every entry must have an energy for each of the 20 residues exactly once");
+
+	out[rows, keys] = values;
+	return out;
+
+def readEnergyTable(source:str, nFields:int, chunkSize:int = 65536, skipHeader:bool = True, rowFilter = None):
+	"""
+	Streams a tab-delimited energy file, as written by StateDataTools, in chunks of lines.
+	Each line has nFields identifier fields followed by a dict literal of residue energies.
+	Blank lines are skipped, and so are the lines rowFilter rejects, before their energies are parsed.
+	Only one chunk is held at a time, so files larger than memory can be read
+
+	@param source		string, path of the file
+	@param nFields		int, number of fields before the energies, 5 for macrostate and 4 for microstate data
+	@param chunkSize	int, number of lines per chunk
+	@param skipHeader	bool, skip the first line?
+	@param rowFilter	function(string[field][entry]) -> bool[entry], optional, which lines of a chunk to keep,
+							given their identifier fields. All lines are kept by default
+	@return generator of (string[field][entry] identifier fields, double[entry][residue] energies), one per chunk
+	"""
+	with open(source, 'r') as infile:
+		if skipHeader:
+			infile.readline();
+		while True:
+			lines = list(itertools.islice(infile, chunkSize));
+			if len(lines) == 0:
+				break;
+			fields, energies = parseEnergyLines(lines, nFields, rowFilter, source);
+			if fields is not None:
+				yield fields, energies;
+
+def parseEnergyLines(lines:"string[]", nFields:int, rowFilter = None, source:str = "the input") -> ("string[][]", numpy.array):
+	"""
+	Parses lines of a tab-delimited energy file, see readEnergyTable()
+
+	@param lines		string[] of lines
+	@param nFields		int, number of fields before the energies
+	@param rowFilter	function(string[field][entry]) -> bool[entry], optional, which lines to keep
+	@param source		string, name of the file the lines are from, for error messages
+	@return string[field][entry] identifier fields and double[entry][residue] energies,
+			or None, None if no line is kept
+	"""
+	entries = [line.split('\t', nFields) for line in lines if not line.isspace()];
+	if len(entries) == 0:
+		return None, None;
+	columns = list(zip(*entries));
+	if len(columns) != nFields + 1:
+		raise ValueError("Expected {:d} tab-delimited fields on every line of {:s}".format(nFields + 1, source));
+	if rowFilter is not None:
+		keep = numpy.asarray(rowFilter(columns[:nFields]), dtype = bool);
+		if not numpy.any(keep):
+			return None, None;
+		if not numpy.all(keep):
+			columns = [tuple(itertools.compress(column, keep)) for column in columns];
+	return columns[:nFields], parseEnergyDicts(columns[nFields]);
+
+def microstateFilter(positions:numpy.array, macrostates:"string[]"):
+	"""
+	Row filter for readEnergyTable() that keeps the microstates of some positions and macrostates
+
+	@param positions	int[] of the position numbers to keep
+	@param macrostates	string[] of the macrostate names to keep
+	@return function(string[field][entry]) -> bool[entry]
+	"""
+	names = numpy.array(macrostates);
+
+	def isWanted(fields):
+		return numpy.isin(numpy.array(fields[2], dtype = int), positions) & numpy.isin(numpy.array(fields[0]), names);
+	return isWanted;
+
+def splitMicrostateChunks(chunks, macrostates:"string[]"):
+	"""
+	Splits chunks of microstate rows into blocks of rows that share a backrub temperature
+
+	@param chunks		iterable of (string[field][entry], double[entry][residue]) as returned by readEnergyTable(),
+							holding only the macrostates given
+	@param macrostates	string[] of the macrostate names, in the order their indices are returned
+	@return generator of (string backrub temperature, int[] macrostate indices, int[] positions, double[][residue] energies),
+			in reading order
+	"""
+	order = numpy.argsort(numpy.array(macrostates));
+	names = numpy.array(macrostates)[order];
+	for fields, energies in chunks:
+		macrostateChunk = order[numpy.searchsorted(names, numpy.array(fields[0]))];
+		positionChunk = numpy.array(fields[2], dtype = int);
+		backrubTs, firstRows, rowBackrubTs = numpy.unique(numpy.array(fields[1]), return_index = True, return_inverse = True);
+		for i in numpy.argsort(firstRows):
+			rows = numpy.flatnonzero(rowBackrubTs == i);
+			yield str(backrubTs[i]), macrostateChunk[rows], positionChunk[rows], energies[rows];
+
+def readMicrostateBlocks(source:str, positions:numpy.array, macrostates:"string[]", chunkSize:int = 65536):
+	"""
+	Streams the microstates of a microstate energy file, keeping only the given positions and macrostates,
+	in blocks of rows that share a backrub temperature. Rows are dropped before their energies are parsed
+
+	@param source		string, path of the file
+	@param positions	int[] of the position numbers to keep
+	@param macrostates	string[] of the macrostate names to keep, in the order their indices are returned
+	@param chunkSize	int, number of lines read at once
+	@return generator of (string backrub temperature, int[] macrostate indices, int[] positions, double[][residue] energies),
+			in reading order
+	"""
+	return splitMicrostateChunks(readEnergyTable(source, 4, chunkSize, rowFilter = microstateFilter(positions, macrostates)), macrostates);
+
+def readMicrostateShard(source:str, positions:numpy.array, macrostates:"string[]", chunkSize:int = 65536, dtype:type = numpy.float64) -> list:
+	"""
+	Reads a whole microstate energy file, one shard of a data set, and merges its blocks per backrub temperature.
+	Meant to be run in a worker process, so it only takes and returns picklable values
+
+	@param source		string, path of the file
+	@param positions	int[] of the position numbers to keep
+	@param macrostates	string[] of the macrostate names to keep, in the order their indices are returned
+	@param chunkSize	int, number of lines read at once
+	@param dtype		numpy dtype to return the energies in
+	@return (string backrub temperature, int[] macrostate indices, int[] positions, double[][residue] energies)[],
+			one per backrub temperature in the order they first appear, rows in reading order
+	"""
+	blocks = {};
+	for backrubT, macrostateBlock, positionBlock, energies in readMicrostateBlocks(source, positions, macrostates, chunkSize):
+		blocks.setdefault(backrubT, []).append((macrostateBlock, positionBlock, energies.astype(dtype, copy = False)));
+	return [(backrubT, numpy.concatenate([b[0] for b in parts]), numpy.concatenate([b[1] for b in parts]), numpy.concatenate([b[2] for b in parts])) for backrubT, parts in blocks.items()];
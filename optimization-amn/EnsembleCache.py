@@ -0,0 +1,186 @@
+from BoltzmannTable import BoltzmannTable
+from collections import OrderedDict
+import numpy
+
+class EnsembleCache:
+	"""
+	A least-recently-used cache of picked microstate ensembles and their Boltzmann averaged
+	macrostate energies, shared by all the models of a search. Picking and averaging only
+	depend on the discrete parameters and the seed the microstates are picked with, so eggs
+	that share (backrubTemp, ensembleSize, seed) share the picked ensemble, and eggs that also
+	share boltzmannTemp share the averaged energies and only pay for the fitness calculation.
+
+	When searching a continuous range of Boltzmann temperatures, exact temperatures rarely repeat.
+	Given a temperature range, the cache instead keeps a BoltzmannTable per picked ensemble and
+	averages by interpolating in it.
+
+	A cache should only be used with one set of models, i.e. the models of one Optimizer,
+	since entries are only told apart by their parameters.
+	Cached arrays are read-only as they are referenced by many models at once.
+	"""
+
+	maxBytes = 0;						# memory cap on the arrays held by the cache
+	nBytes = 0;							# memory currently held
+	entries = OrderedDict();			# Map<key, (value, bytes)> in least to most recently used order
+	boltzmannRange = None;				# float[] {lowest, highest} temperature to tabulate, None to not use tables
+	tableTolerance = 0.0;				# float, interpolation error allowed in the tables
+
+	# counters used to size the cache
+	selectionHits = 0;
+	selectionMisses = 0;
+	averageHits = 0;
+	averageMisses = 0;
+	tableHits = 0;
+	tableMisses = 0;
+	evictions = 0;
+
+	def __init__(self, maxBytes:int = 256 * 1024 * 1024, boltzmannRange:"float[]" = None, tableTolerance:float = 1e-3):
+		"""
+		Default constructor
+
+		@param maxBytes			int, memory cap in bytes on the cached arrays, default 256 MB
+		@param boltzmannRange	float[] of length 2, optional: {lowest, highest} positive Boltzmann temperature
+									to tabulate. Leave as None to average every temperature exactly
+		@param tableTolerance	float, interpolation error allowed in the tables, in energy units
+		"""
+		self.maxBytes = maxBytes;
+		self.boltzmannRange = boltzmannRange;
+		self.tableTolerance = tableTolerance;
+		self.nBytes = 0;
+		self.entries = OrderedDict();
+		self.selectionHits = 0;
+		self.selectionMisses = 0;
+		self.averageHits = 0;
+		self.averageMisses = 0;
+		self.tableHits = 0;
+		self.tableMisses = 0;
+		self.evictions = 0;
+
+	def averageMicrostates(self, model:"Model") -> None:
+		"""
+		Fills in the picked microstates and averaged macrostate energies of a model, from
+		the cache where possible. The model must have an ensembleSeed
+
+		@param model		Model to fill in
+		@return void
+		"""
+		useTable = self.boltzmannRange is not None and model.boltzmannTemp not in (0.0, -1.0);
+		if not useTable:
+			averageKey = ('average', model.backrubTemp, model.ensembleSize, model.ensembleSeed, model.boltzmannTemp, model.useAltAveragingMethod);
+			averaged = self.lookup(averageKey);
+			if averaged is not None:
+				self.averageHits += 1;
+				model.macrostateResidueEnergies = averaged;
+				return None;
+			self.averageMisses += 1;
+		else:
+			tableKey = ('table', model.backrubTemp, model.ensembleSize, model.ensembleSeed, model.useAltAveragingMethod);
+			table = self.lookup(tableKey);
+			if table is not None:
+				self.tableHits += 1;
+				model.macrostateResidueEnergies = table.getAveragedEnergies(model.boltzmannTemp);
+				return None;
+			self.tableMisses += 1;
+
+		if not model.areMicrostatesPicked:
+			selectionKey = ('selection', model.backrubTemp, model.ensembleSize, model.ensembleSeed);
+			selection = self.lookup(selectionKey);
+			if selection is not None:
+				self.selectionHits += 1;
+				model.microstatesUsed, model.selectedMicrostateEnergies = selection;
+				model.areMicrostatesPicked = True;
+			else:
+				self.selectionMisses += 1;
+				model.pickMicrostates(numpy.random.RandomState(model.ensembleSeed));
+				model.microstatesUsed.flags.writeable = False;
+				model.selectedMicrostateEnergies.flags.writeable = False;
+				self.insert(selectionKey, (model.microstatesUsed, model.selectedMicrostateEnergies), model.microstatesUsed.nbytes + model.selectedMicrostateEnergies.nbytes);
+
+		if not useTable:
+			model.macrostateResidueEnergies = model.calcAveragedEnergies();
+			model.macrostateResidueEnergies.flags.writeable = False;
+			self.insert(averageKey, model.macrostateResidueEnergies, model.macrostateResidueEnergies.nbytes);
+		else:
+			table = BoltzmannTable(model.selectedMicrostateEnergies, self.boltzmannRange, model.useAltAveragingMethod, self.tableTolerance);
+			for a in (table.values, table.minEnergies, table.meanEnergies):
+				a.flags.writeable = False;
+			self.insert(tableKey, table, table.getNBytes());
+			model.macrostateResidueEnergies = table.getAveragedEnergies(model.boltzmannTemp);
+		return None;
+
+	# PRIVATE
+	def lookup(self, key:tuple):
+		"""
+		Gets an entry from the cache and marks it as the most recently used
+
+		@param key		tuple of the parameters the entry is for
+		@return the stored value, or None if it is not in the cache
+		"""
+		if key not in self.entries:
+			return None;
+		self.entries.move_to_end(key);
+		return self.entries[key][0];
+
+	# PRIVATE
+	def insert(self, key:tuple, value, size:int) -> None:
+		"""
+		Adds an entry to the cache, evicting the least recently used entries to stay under the memory cap.
+		Entries bigger than the whole cap are not stored
+
+		@param key			tuple of the parameters the entry is for
+		@param value		the read-only arrays or table to store
+		@param size			int, bytes held by value
+		@return void
+		"""
+		if size > self.maxBytes:
+			return None;
+
+		while self.nBytes + size > self.maxBytes:
+			oldKey, (oldValue, oldSize) = self.entries.popitem(last = False);
+			self.nBytes -= oldSize;
+			self.evictions += 1;
+		self.entries[key] = (value, size);
+		self.nBytes += size;
+		return None;
+
+	def clear(self) -> None:
+		"""
+		Empties the cache. Counters are kept
+
+		@param void
+		@return void
+		"""
+		self.entries.clear();
+		self.nBytes = 0;
+
+	def getStats(self) -> {}:
+		"""
+		Returns the cache counters.
+		Keys:
+			'selectionHits'
+			'selectionMisses'
+			'averageHits'
+			'averageMisses'
+			'tableHits'
+			'tableMisses'
+			'evictions'
+			'entries'
+			'bytes'
+
+		@param void
+		@return Map<string, int>
+		"""
+		stats = {};
+		stats['selectionHits'] = self.selectionHits;
+		stats['selectionMisses'] = self.selectionMisses;
+		stats['averageHits'] = self.averageHits;
+		stats['averageMisses'] = self.averageMisses;
+		stats['tableHits'] = self.tableHits;
+		stats['tableMisses'] = self.tableMisses;
+		stats['evictions'] = self.evictions;
+		stats['entries'] = len(self.entries);
+		stats['bytes'] = self.nBytes;
+		return stats;
+
+	def __str__(self, **kwargs):
+		return "Ensemble cache, {:d} entries, {:.1f} of {:.1f} MB, average hits/misses: {:d}/{:d}, table hits/misses: {:d}/{:d}, selection hits/misses: {:d}/{:d}, evictions: {:d}".format(len(self.entries), self.nBytes / 1048576, self.maxBytes / 1048576, self.averageHits, self.averageMisses, self.tableHits, self.tableMisses, self.selectionHits, self.selectionMisses, self.evictions);
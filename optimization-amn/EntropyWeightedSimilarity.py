@@ -47,9 +47,9 @@ class EntropyWeightedSimilarity(SimilarityMeasure):
 		self.totalWeights = numpy.sum(self.weights);
 
 	def getSimilarityMeasure(self, expFrequencies):
+		expFrequencies = expFrequencies / numpy.sum(expFrequencies, axis = 1, keepdims = True);
 		out = 0;		# composite similarity score
 		for i in range(self.nPositions):
-			expFrequencies[i] = expFrequencies[i] / numpy.sum(expFrequencies[i]);
 			out += self.weights[i] * self.similarityMeasures[i].getSimilarityMeasure(expFrequencies[i]);
 		return out / self.totalWeights;
 
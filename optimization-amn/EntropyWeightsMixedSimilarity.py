@@ -55,10 +55,10 @@ class EntropyWeightsMixedSimilarity(SimilarityMeasure):
 			self.similarityMeasures2.append(newSM2);
 
 	def getSimilarityMeasure(self, expFrequencies):
+		expFrequencies = expFrequencies / numpy.sum(expFrequencies, axis = 1, keepdims = True);
 		out = 0;		# composite similarity score
 		for i in range(self.nPositions):
 			s = 0;		# similarity at this position
-			expFrequencies[i] = numpy.divide(expFrequencies[i], numpy.sum(expFrequencies[i]));
 			s += self.entropies[i] * self.similarityMeasures1[i].getSimilarityMeasure(expFrequencies[i]);
 			s += (1 - self.entropies[i]) * self.similarityMeasures2[i].getSimilarityMeasure(expFrequencies[i]);
 			out += s;
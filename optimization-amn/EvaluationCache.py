@@ -0,0 +1,130 @@
+from collections import OrderedDict
+import numpy
+
+class EvaluationCache:
+	"""
+	A least-recently-used memo of the match and frequencies of candidates, so a search does not
+	evaluate the same parameters again. Discrete parameters are keyed by their exact values, and
+	continuous ones are rounded to a multiple of the tolerance, so candidates that only differ by
+	less than the tolerance share the entry of the first of them to be evaluated.
+	Clipping at the bounds and weights that are not searched make such repeats common.
+
+	With microstate data, a repeated candidate gets the match of the ensemble picked for the first
+	one instead of a new pick.
+
+	A cache should only be used with one search and one similarity measure, since entries are only
+	told apart by their parameters. Cached frequencies are read-only.
+	"""
+
+	maxEntries = 0;						# cap on the number of cached candidates
+	tolerance = 0.0;					# continuous parameters are rounded to multiples of this, 0 to key on exact values
+	entries = OrderedDict();			# Map<key, (match, frequencies)> in least to most recently used order
+	hits = 0;
+	misses = 0;
+	evictions = 0;
+
+	def __init__(self, maxEntries:int = 4096, tolerance:float = 1e-6):
+		"""
+		Default constructor
+
+		@param maxEntries		int, number of candidates to keep
+		@param tolerance		float, resolution of the continuous parameters in the keys, 0 to key on exact values
+		"""
+		if tolerance < 0:
+			raise ValueError("Tolerance cannot be negative");
+		self.maxEntries = maxEntries;
+		self.tolerance = tolerance;
+		self.entries = OrderedDict();
+		self.hits = 0;
+		self.misses = 0;
+		self.evictions = 0;
+
+	def getKey(self, discrete:"number[]", continuous:"float[]") -> tuple:
+		"""
+		The key of a candidate
+
+		@param discrete			number[] of the discrete parameters, e.g. ensemble size and backrub temperature
+		@param continuous		float[] of the continuous parameters, e.g. Boltzmann temperature, steepness and weights
+		@return tuple
+		"""
+		continuous = numpy.asarray(continuous, dtype = numpy.float64);
+		if self.tolerance > 0:
+			continuous = numpy.round(continuous / self.tolerance).astype(numpy.int64);
+		return tuple([float(v) for v in discrete]) + tuple(continuous.tolist());
+
+	def lookup(self, key:tuple) -> (float, numpy.array):
+		"""
+		Gets the match and frequencies of a candidate and marks it as the most recently used
+
+		@param key		tuple from getKey()
+		@return float match and float[position][residue] of read-only frequencies, or None if the candidate is not cached
+		"""
+		if key not in self.entries:
+			self.misses += 1;
+			return None;
+		self.hits += 1;
+		self.entries.move_to_end(key);
+		return self.entries[key];
+
+	def insert(self, key:tuple, match:float, frequencies:numpy.array) -> None:
+		"""
+		Adds a candidate, evicting the least recently used one if the cache is full
+
+		@param key				tuple from getKey()
+		@param match			float, similarity of the candidate to the target
+		@param frequencies		float[position][residue] of the candidate's frequencies
+		@return void
+		"""
+		if self.maxEntries <= 0:
+			return None;
+		if key not in self.entries and len(self.entries) >= self.maxEntries:
+			self.entries.popitem(last = False);
+			self.evictions += 1;
+		if frequencies.flags.writeable:
+			frequencies = numpy.array(frequencies);
+			frequencies.flags.writeable = False;
+		self.entries[key] = (match, frequencies);
+		return None;
+
+	def flush(self) -> None:
+		"""
+		Writes out what was added since the last flush. Nothing to write for a cache in memory,
+		see EvaluationStore
+
+		@param void
+		@return void
+		"""
+		return None;
+
+	def clear(self) -> None:
+		"""
+		Empties the cache. Counters are kept
+
+		@param void
+		@return void
+		"""
+		self.entries.clear();
+
+	def getStats(self) -> {}:
+		"""
+		Returns the cache counters.
+		Keys:
+			'hits'
+			'misses'
+			'evictions'
+			'entries'
+			'hitRate'		fraction of lookups that were hits
+
+		@param void
+		@return Map<string, number>
+		"""
+		stats = {};
+		stats['hits'] = self.hits;
+		stats['misses'] = self.misses;
+		stats['evictions'] = self.evictions;
+		stats['entries'] = len(self.entries);
+		stats['hitRate'] = self.hits / max(self.hits + self.misses, 1);
+		return stats;
+
+	def __str__(self, **kwargs):
+		return "Evaluation cache, {:d} of {:d} entries, tolerance {:g}, hits/misses: {:d}/{:d}".format(len(self.entries), self.maxEntries, self.tolerance, self.hits, self.misses);
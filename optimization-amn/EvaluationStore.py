@@ -0,0 +1,177 @@
+from EvaluationCache import EvaluationCache
+import sqlite3
+import hashlib
+import numpy
+
+class EvaluationStore(EvaluationCache):
+	"""
+	An EvaluationCache that also keeps the evaluated candidates in a SQLite file, so that searches in
+	later runs and other processes reuse them. Entries are filed under a context made of a hash of
+	the data read, a hash of the target frequencies, the similarity measure and the tolerance, so one
+	file can hold the candidates of many problems and never mixes them up.
+
+	Lookups go to the in-memory cache first, then to the file. New candidates are written in batches,
+	call flush() to write the last ones; searches do at the end of every run. SQLite locks the file
+	on writes, so jobs on one machine can share a store. Network file systems often do not lock
+	reliably, keep stores on local disk.
+	"""
+
+	path = '';					# path of the SQLite file
+	context = '';				# hex digest the entries of this problem are filed under
+	batchSize = 256;			# number of new candidates written at once
+	pending = [];				# (context, key, match, frequencies)[] not written yet
+	connection = None;			# sqlite3.Connection, opened on first use and in every process
+	storeHits = 0;				# lookups found in the file but not in memory
+	writes = 0;					# candidates written to the file
+
+	def __init__(self, path:str, dataHash:str, targetHash:str, measureName:str, tolerance:float = 1e-6, maxEntries:int = 4096, batchSize:int = 256):
+		"""
+		Default constructor
+
+		@param path				string, path of the SQLite file, created if it does not exist
+		@param dataHash			string, hash of the data read, e.g. Optimizer.getDataHash()
+		@param targetHash		string, hash of the target frequencies, e.g. EvaluationStore.hashArray()
+		@param measureName		string, name of the similarity measure
+		@param tolerance		float, resolution of the continuous parameters in the keys, see EvaluationCache
+		@param maxEntries		int, number of candidates also kept in memory
+		@param batchSize		int, number of new candidates written at once
+		"""
+		super().__init__(maxEntries, tolerance);
+		self.path = path;
+		self.context = hashlib.sha1(repr((dataHash, targetHash, measureName, float(tolerance))).encode('utf-8')).hexdigest();
+		self.batchSize = batchSize;
+		self.pending = [];
+		self.connection = None;
+		self.storeHits = 0;
+		self.writes = 0;
+
+	# STATIC
+	def hashArray(a:numpy.array) -> str:
+		"""
+		SHA-1 of the values of an array, e.g. of target frequencies
+
+		@param a		numpy.array
+		@return string of the hex digest
+		"""
+		a = numpy.ascontiguousarray(a, dtype = numpy.float64);
+		return hashlib.sha1(repr(a.shape).encode('utf-8') + a.tobytes()).hexdigest();
+
+	# PRIVATE
+	def getConnection(self) -> sqlite3.Connection:
+		"""
+		The connection to the file, opened and set up on first use
+
+		@param void
+		@return sqlite3.Connection
+		"""
+		if self.connection is None:
+			self.connection = sqlite3.connect(self.path, timeout = 60);
+			self.connection.execute("CREATE TABLE IF NOT EXISTS evaluations (context TEXT NOT NULL, params TEXT NOT NULL, match REAL, frequencies BLOB NOT NULL, PRIMARY KEY (context, params))");
+			self.connection.commit();
+		return self.connection;
+
+	def lookup(self, key:tuple) -> (float, numpy.array):
+		"""
+		Gets the match and frequencies of a candidate, from memory or else from the file
+
+		@param key		tuple from getKey()
+		@return float match and float[position][residue] of read-only frequencies, or None if the candidate was never stored
+		"""
+		if key in self.entries:
+			self.hits += 1;
+			self.entries.move_to_end(key);
+			return self.entries[key];
+
+		row = self.getConnection().execute("SELECT match, frequencies FROM evaluations WHERE context = ? AND params = ?", (self.context, repr(key))).fetchone();
+		if row is None:
+			self.misses += 1;
+			return None;
+		self.hits += 1;
+		self.storeHits += 1;
+		match = row[0] if row[0] is not None else numpy.nan;		# SQLite keeps NaN as NULL
+		frequencies = numpy.frombuffer(row[1], dtype = numpy.float64).reshape(-1, 20);
+		super().insert(key, match, frequencies);
+		return match, frequencies;
+
+	def insert(self, key:tuple, match:float, frequencies:numpy.array) -> None:
+		"""
+		Adds a candidate to memory, and to the file with the next batch
+
+		@param key				tuple from getKey()
+		@param match			float, similarity of the candidate to the target
+		@param frequencies		float[position][residue] of the candidate's frequencies
+		@return void
+		"""
+		super().insert(key, match, frequencies);
+		self.pending.append((self.context, repr(key), float(match), numpy.asarray(frequencies, dtype = numpy.float64).tobytes()));
+		if len(self.pending) >= self.batchSize:
+			self.flush();
+		return None;
+
+	def flush(self) -> None:
+		"""
+		Writes the candidates added since the last write. Candidates already stored, e.g. by another
+		process, are kept as they are
+
+		@param void
+		@return void
+		"""
+		if len(self.pending) == 0:
+			return None;
+		connection = self.getConnection();
+		with connection:
+			connection.executemany("INSERT OR IGNORE INTO evaluations VALUES (?, ?, ?, ?)", self.pending);
+		self.writes += len(self.pending);
+		self.pending = [];
+		return None;
+
+	def close(self) -> None:
+		"""
+		Writes what is pending and closes the file. It is opened again if the store is used after
+
+		@param void
+		@return void
+		"""
+		self.flush();
+		if self.connection is not None:
+			self.connection.close();
+			self.connection = None;
+		return None;
+
+	def countStored(self) -> int:
+		"""
+		Number of candidates of this problem in the file
+
+		@param void
+		@return int
+		"""
+		self.flush();
+		return self.getConnection().execute("SELECT COUNT(*) FROM evaluations WHERE context = ?", (self.context,)).fetchone()[0];
+
+	def getStats(self) -> {}:
+		"""
+		Returns the store counters.
+		Keys, besides those of EvaluationCache.getStats():
+			'storeHits'		hits found in the file and not in memory
+			'writes'		candidates written to the file
+
+		@param void
+		@return Map<string, number>
+		"""
+		stats = super().getStats();
+		stats['storeHits'] = self.storeHits;
+		stats['writes'] = self.writes;
+		return stats;
+
+	# connections cannot be pickled, a store sent to a worker process opens its own
+	def __getstate__(self):
+		state = dict(self.__dict__);
+		state['connection'] = None;
+		state['pending'] = [];
+		return state;
+
+	def __setstate__(self, state):
+		self.__dict__.update(state);
+
+	def __str__(self, **kwargs):
+		return "Evaluation store {:s}, {:d} of {:d} entries in memory, tolerance {:g}, hits/misses: {:d}/{:d}, {:d} hits from the file".format(self.path, len(self.entries), self.maxEntries, self.tolerance, self.hits, self.misses, self.storeHits);
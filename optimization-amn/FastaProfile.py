@@ -0,0 +1,202 @@
+from EnergyTableParser import RESIDUES
+import numpy
+
+NOT_COUNTED = 20;						# code of gaps, padding and anything that is not one of the 20 residues
+
+# byte -> residue code, lower case (unaligned) and non-standard letters are not counted, same as gaps
+residueCodes = numpy.full(256, NOT_COUNTED, dtype = numpy.intp);
+for i in range(len(RESIDUES)):
+	residueCodes[ord(RESIDUES[i])] = i;
+
+def readFastaRecords(source:str, batchSize:int = 1024):
+	"""
+	Streams the sequences of a FASTA file in batches of records, so only one batch is held at a time.
+	Sequences may span several lines
+
+	@param source		string, path of the FASTA file
+	@param batchSize	int, number of records per batch
+	@return generator of string[] of up to batchSize sequences
+	"""
+	batch = [];
+	pieces = None;		# lines of the record being read, None until the first header
+	with open(source, 'r', encoding = 'utf-8') as infile:
+		for line in infile:
+			if line[0] == '>':
+				if pieces is not None:
+					batch.append(''.join(pieces));
+					if len(batch) == batchSize:
+						yield batch;
+						batch = [];
+				pieces = [];
+			elif pieces is not None:
+				pieces.append(line.strip());
+	if pieces is not None:
+		batch.append(''.join(pieces));
+	if len(batch) > 0:
+		yield batch;
+
+def encodeSequences(sequences:"string[]", nColumns:int) -> numpy.array:
+	"""
+	Encodes aligned sequences as a matrix of bytes. Sequences are cut or padded with gaps to nColumns
+
+	@param sequences	string[] of aligned sequences
+	@param nColumns		int, alignment length
+	@return uint8[sequence][column]
+	"""
+	padded = ''.join([s[:nColumns].ljust(nColumns, '-') for s in sequences]);
+	# non-ASCII letters become '?', one byte each, so the rows stay aligned
+	return numpy.frombuffer(padded.encode('ascii', 'replace'), dtype = numpy.uint8).reshape(len(sequences), nColumns);
+
+def encodeAlignment(source:str, batchSize:int = 1024) -> numpy.array:
+	"""
+	Reads a whole FASTA alignment as residue codes. The alignment length is that of the first record
+
+	@param source		string, path of the FASTA alignment
+	@param batchSize	int, number of records encoded at once
+	@return uint8[sequence][column] of residue codes, NOT_COUNTED for gaps and non-standard letters
+	"""
+	blocks = [];
+	nColumns = 0;
+	for batch in readFastaRecords(source, batchSize):
+		if len(blocks) == 0:
+			nColumns = len(batch[0]);
+		blocks.append(residueCodes[encodeSequences(batch, nColumns)].astype(numpy.uint8));
+	if len(blocks) == 0:
+		raise ValueError("No sequences in " + source);
+	return numpy.concatenate(blocks);
+
+def henikoffWeights(codes:numpy.array, tileSize:int = 4096) -> numpy.array:
+	"""
+	Henikoff position-based sequence weights. At each column, a sequence gets 1 / (r * n) for its
+	residue, where r is the number of different residues in the column and n the number of sequences
+	sharing that residue, and its weight is the sum over columns. Gaps do not contribute.
+	Weights are normalized to sum to 1
+
+	@param codes		uint8[sequence][column] of residue codes, see encodeAlignment()
+	@param tileSize		int, number of sequences processed at once
+	@return float[sequence] of weights
+	"""
+	nSequences, nColumns = codes.shape;
+	offsets = numpy.arange(nColumns) * (NOT_COUNTED + 1);
+	counts = numpy.zeros(nColumns * (NOT_COUNTED + 1), dtype = numpy.int64);
+	for i in range(0, nSequences, tileSize):
+		counts += numpy.bincount((codes[i:i + tileSize] + offsets).ravel(), minlength = counts.size);
+	counts = counts.reshape(nColumns, NOT_COUNTED + 1);
+	counts[:, NOT_COUNTED] = 0;		# gaps do not count
+
+	nTypes = numpy.count_nonzero(counts, axis = 1, keepdims = True);
+	contributions = numpy.zeros(counts.shape, dtype = numpy.float64);
+	numpy.divide(1.0, nTypes * counts, out = contributions, where = counts > 0);
+	contributions = contributions.ravel();
+
+	weights = numpy.zeros(nSequences, dtype = numpy.float64);
+	for i in range(0, nSequences, tileSize):
+		weights[i:i + tileSize] = numpy.sum(contributions[codes[i:i + tileSize] + offsets], axis = 1);
+	return weights / numpy.sum(weights);
+
+def oneHot(codes:numpy.array) -> numpy.array:
+	"""
+	One-hot encodes a tile of sequences so that the dot product of two rows is the number of
+	columns at which both sequences have the same residue. Gaps are all zeros
+
+	@param codes		uint8[sequence][column] of residue codes
+	@return float32[sequence][column * residue]
+	"""
+	nSequences, nColumns = codes.shape;
+	out = numpy.zeros([nSequences, nColumns * NOT_COUNTED], dtype = numpy.float32);
+	sequences, columns = numpy.nonzero(codes != NOT_COUNTED);
+	out[sequences, columns * NOT_COUNTED + codes[sequences, columns]] = 1.0;
+	return out;
+
+def identityWeights(codes:numpy.array, threshold:float = 0.8, tileSize:int = 512) -> numpy.array:
+	"""
+	Percent identity clustering weights: 1 over the number of sequences, itself included, that are at
+	least threshold identical to a sequence. Identity is the fraction of identical residues over the
+	columns where both sequences have a residue, so shared gaps do not make sequences look alike.
+	Pairwise identities are counted one tile of sequence pairs at a time as products of one-hot
+	encodings, so only tileSize x tileSize of the pairwise matrices exists at once. The encodings of all
+	tiles are kept, 80 bytes per residue of the alignment
+
+	@param codes		uint8[sequence][column] of residue codes, see encodeAlignment()
+	@param threshold	float on (0, 1], identity at which two sequences count as redundant
+	@param tileSize		int, number of sequences per tile
+	@return float[sequence] of weights, summing to the effective number of sequences
+	"""
+	nSequences = codes.shape[0];
+	nNeighbours = numpy.zeros(nSequences, dtype = numpy.int64);
+	# every tile is encoded once and paired with all the tiles after it
+	starts = range(0, nSequences, tileSize);
+	encoded = [oneHot(codes[i:i + tileSize]) for i in starts];
+	aligned = [(codes[i:i + tileSize] != NOT_COUNTED).astype(numpy.float32) for i in starts];
+	for a in range(len(starts)):
+		i = starts[a];
+		for b in range(a, len(starts)):
+			# only tiles on and above the diagonal, the matrices are symmetric
+			j = starts[b];
+			overlaps = numpy.dot(aligned[a], aligned[b].T);
+			isNeighbour = (numpy.dot(encoded[a], encoded[b].T) >= threshold * overlaps) & (overlaps > 0);
+			nNeighbours[i:i + tileSize] += numpy.count_nonzero(isNeighbour, axis = 1);
+			if j != i:
+				nNeighbours[j:j + tileSize] += numpy.count_nonzero(isNeighbour, axis = 0);
+	return 1.0 / numpy.maximum(nNeighbours, 1);		# all-gap sequences are not even their own neighbour
+
+def buildWeightedProfile(source:str, columns:numpy.array = None, weighting:str = 'henikoff', identityThreshold:float = 0.8, tileSize:int = 4096) -> (numpy.array, float):
+	"""
+	Sums sequence weights instead of counting sequences in each column of a FASTA alignment, so that
+	clusters of redundant sequences do not dominate the profile. Unlike buildProfile(), the whole
+	alignment is held in memory, one byte per residue
+
+	@param source				string, path of the FASTA alignment
+	@param columns				int[], optional, alignment columns to count, in the order they are wanted. All columns by default
+	@param weighting			string, 'henikoff' for position-based weights or 'identity' for percent identity clustering weights
+	@param identityThreshold	float, identity at which sequences are clustered together, only used with 'identity'
+	@param tileSize				int, number of sequences counted at once
+	@return float[position][residue] of weighted counts, float effective number of sequences
+	"""
+	codes = encodeAlignment(source);
+	if weighting == 'henikoff':
+		weights = henikoffWeights(codes) * codes.shape[0];		# scaled to average 1
+	elif weighting == 'identity':
+		weights = identityWeights(codes, identityThreshold);
+	else:
+		raise ValueError("Unknown sequence weighting " + str(weighting));
+
+	if columns is not None:
+		codes = codes[:, columns];
+	nPositions = codes.shape[1];
+	offsets = numpy.arange(nPositions) * (NOT_COUNTED + 1);
+	counts = numpy.zeros(nPositions * (NOT_COUNTED + 1), dtype = numpy.float64);
+	for i in range(0, codes.shape[0], tileSize):
+		tile = codes[i:i + tileSize];
+		counts += numpy.bincount((tile + offsets).ravel(), weights = numpy.repeat(weights[i:i + tileSize], nPositions), minlength = counts.size);
+	return counts.reshape(nPositions, NOT_COUNTED + 1)[:, :NOT_COUNTED], float(numpy.sum(weights));
+
+def buildProfile(source:str, columns:numpy.array = None, batchSize:int = 1024) -> (numpy.array, int):
+	"""
+	Counts the residues in each column of a FASTA alignment, streaming it a batch of records at a time.
+	The alignment length is that of the first record. Gaps, lower case and non-standard letters are not counted
+
+	@param source		string, path of the FASTA alignment
+	@param columns		int[], optional, alignment columns to count, in the order they are wanted. All columns by default
+	@param batchSize	int, number of records encoded and counted at once, bounds the memory used
+	@return int[position][residue] of counts, int number of sequences read
+	"""
+	counts = None;
+	nColumns = 0;
+	nSequences = 0;
+	for batch in readFastaRecords(source, batchSize):
+		if counts is None:
+			nColumns = len(batch[0]);
+			nPositions = nColumns if columns is None else len(columns);
+			counts = numpy.zeros([nPositions, NOT_COUNTED + 1], dtype = numpy.int64);
+			offsets = numpy.arange(nPositions) * (NOT_COUNTED + 1);		# each position counts in its own bins
+
+		codes = encodeSequences(batch, nColumns);
+		if columns is not None:
+			codes = codes[:, columns];
+		counts += numpy.bincount((residueCodes[codes] + offsets).ravel(), minlength = counts.size).reshape(counts.shape);
+		nSequences += len(batch);
+
+	if counts is None:
+		raise ValueError("No sequences in " + source);
+	return counts[:, :NOT_COUNTED], nSequences;
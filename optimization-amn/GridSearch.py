@@ -1,18 +1,373 @@
 from SearchAlgorithm import SearchAlgorithm
 from SimilarityMeasure import SimilarityMeasure
+from ModelView import ModelView
+from SigmoidCache import SigmoidCache
+from model import calcSigmoids, weightedProduct, fitnessesToFrequencies
+from datetime import *
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import copy
+import os
 import numpy
 
+gridTemplate = None;		# GridSearch the chunks of this process are scanned with, see initGridWorker()
+
+def initGridWorker(template:"GridSearch") -> None:
+	"""
+	Keeps the search that grid chunks are scanned with in this process, so the data models are only
+	sent once to each worker process instead of with every chunk
+
+	@param template		GridSearch with the bounds, models and similarity measure of the search
+	@return void
+	"""
+	global gridTemplate;
+	gridTemplate = template;
+	return None;
+
+def scanGridChunk(start:int, end:int) -> (numpy.array, numpy.array):
+	"""
+	Scans a chunk of the grid. Picklable, so it can run in a worker process
+
+	@param start	int, flat index of the first grid point
+	@param end		int, flat index past the last grid point
+	@return float[] of the matches and int[] of the flat indices of the best points of the chunk
+	"""
+	return gridTemplate.scanChunk(start, end);
+
 class GridSearch(SearchAlgorithm):
 	"""
-	Grid search over hyperparameter space
+	Grid search over hyperparameter space. Every combination of the searched discrete parameters,
+	of steepnesses steepnessIncrement apart and of weights weightIncrement apart is tried, so it is
+	slow but finds the best point of the grid for sure, e.g. as a reference for the stochastic searches.
+
+	Grid points are numbered in the order of the axes of getGridAxes(), the weights last, and are
+	scanned in chunks of consecutive points, so a chunk mostly shares one data model and
+	steepness and its frequencies are calculated in one batch. Chunks are spread over a process
+	pool, and only the best topK points are kept.
+
+	The Boltzmann temperatures tried are those of the bounds, also for microstate data. Microstate
+	ensembles are picked once per combination of discrete parameters, with a seed drawn from the
+	global numpy random state, so results do not depend on the number of processes.
 	"""
 
 	steepnessIncrement = 0;				# finess of search grid for steepness
 	weightIncrement = 0;				# finess of search grid for weights
+	chunkSize = 4096;					# number of grid points evaluated at once, bounds the memory used
+	nProcesses = None;					# number of worker processes, None for one per core
+	topK = 16;							# number of best grid points kept
+	topResults = [];					# (float match, int flat index)[] of the best grid points, best first
+	gridAxes = [];						# number[][] values of each axis of the grid, see getGridAxes()
+	ensembleSeed = 0;					# seed the microstate ensembles are picked with, drawn on every search
+	cachedCombination = None;			# (int, int, int) indices of the discrete parameters of cachedEnergies
+	cachedEnergies = None;				# double[position][residue energy][macrostate] of averaged energies
+	usesEvaluationCache = True;
 
-	def __init__(self, similarityMeasure, models):
-		super().__init__(similarityMeasure, models);
+	def __init__(self, models, similarityMeasure:SimilarityMeasure, steepnessIncrement:float, weightIncrement:float, chunkSize:int = 4096, topK:int = 16, nProcesses:int = None):
+		"""
+		Default constructor
+
+		@param models				a Map<hyperParams, models>, or a ModelLattice of them
+		@param similarityMeasure	a SimiliartyMeasure object
+		@param steepnessIncrement	float, distance between the steepnesses tried
+		@param weightIncrement		float, distance between the weights tried
+		@param chunkSize			int, number of grid points evaluated at once
+		@param topK					int, number of best grid points kept, see getTopParameters()
+		@param nProcesses			int, optional, number of worker processes. By default one per core.
+										With 1, the grid is scanned in this process
+		"""
+		super().__init__(models, similarityMeasure, False);
+		if steepnessIncrement <= 0 or weightIncrement <= 0:
+			raise ValueError("Grid increments must be positive");
+		self.steepnessIncrement = steepnessIncrement;
+		self.weightIncrement = weightIncrement;
+		self.chunkSize = chunkSize;
+		self.topK = topK;
+		self.nProcesses = nProcesses;
+		self.topResults = [];
+		self.gridAxes = [];
+		self.cachedCombination = None;
+		self.cachedEnergies = None;
+		self.sigmoidCache = SigmoidCache();		# every steepness of the grid is tried with many weights
+
+	def getGridAxes(self) -> [numpy.array]:
+		"""
+		The values tried for each parameter. Parameters that are not searched only take their first value
+
+		@param void
+		@return number[][] of ensemble sizes, backrub temperatures, Boltzmann temperatures, steepnesses
+				then one axis of weights per macrostate
+		"""
+		axes = [];
+		axes.append(self.ensembleSizes if self.searchEnsemble else self.ensembleSizes[:1]);
+		axes.append(self.backrubTemps if self.searchBackrub else self.backrubTemps[:1]);
+		axes.append(self.boltzmannTemps if self.searchBoltzmann else self.boltzmannTemps[:1]);
+		if self.searchSteepness:
+			axes.append(GridSearch.gridRange(self.steepnessRange[0], self.steepnessRange[1], self.steepnessIncrement));
+		else:
+			axes.append(numpy.array([self.steepnessRange[0]], dtype = numpy.float64));
+		for i in range(self.weightMins.size):
+			if self.searchWeights[i]:
+				axes.append(GridSearch.gridRange(self.weightMins[i], self.weightMaxs[i], self.weightIncrement));
+			else:
+				axes.append(numpy.array([self.weightMins[i]], dtype = numpy.float64));
+		return [numpy.asarray(axis) for axis in axes];
+
+	# STATIC
+	def gridRange(low:float, high:float, increment:float) -> numpy.array:
+		"""
+		Values from low to high, increment apart. high is included if it is on the grid, up to rounding
+
+		@param low			float, first value
+		@param high			float, last value
+		@param increment	float, distance between values
+		@return float[]
+		"""
+		return low + increment * numpy.arange(int(numpy.floor((high - low) / increment + 1e-9)) + 1);
+
+	def getGridShape(self) -> (int,):
+		"""
+		The number of values on each axis of the grid, see getGridAxes()
+
+		@param void
+		@return int[]
+		"""
+		return tuple([axis.size for axis in self.gridAxes]);
 
 	def iterate(self):
-		# TODO: implement this
-		pass;
\ No newline at end of file
+		start = datetime.now();	# track runtime
+		self.gridAxes = self.getGridAxes();
+		self.ensembleSeed = numpy.random.randint(0, 2**31 - 1);
+		self.cachedCombination = None;
+		self.cachedEnergies = None;
+		shape = self.getGridShape();
+		nPoints = int(numpy.prod(shape, dtype = numpy.int64));
+		chunks = [(i, min(i + self.chunkSize, nPoints)) for i in range(0, nPoints, self.chunkSize)];
+
+		# a little progress bar to make the wait bearable
+		if not self.suppressOutputs:
+			updateStep = int(numpy.ceil(len(chunks) / 70));		# 70-char width outputs
+			print("going through {:d} grid points in {:d} chunks".format(nPoints, len(chunks)));
+			print('_' * int(numpy.ceil(len(chunks) / updateStep)));
+
+		nProcesses = self.nProcesses if self.nProcesses is not None else (os.cpu_count() or 1);
+		pool = None;
+		if nProcesses > 1 and len(chunks) > 1:
+			template = copy.copy(self);		# what the workers scan the chunks with
+			template.suppressOutputs = True;
+			pool = ProcessPoolExecutor(max_workers = nProcesses, initializer = initGridWorker, initargs = (template,));
+			results = pool.map(scanGridChunk, [c[0] for c in chunks], [c[1] for c in chunks]);
+		else:
+			results = (self.scanChunk(c[0], c[1]) for c in chunks);
+
+		# a min heap of the best points, the worst of them on top. Ties go to the first point
+		heap = [];
+		try:
+			for i, (matches, indices) in enumerate(results):
+				for match, index in zip(numpy.nan_to_num(matches, nan = -numpy.inf).tolist(), indices.tolist()):
+					if len(heap) < self.topK:
+						heapq.heappush(heap, (match, -index));
+					elif (match, -index) > heap[0]:
+						heapq.heapreplace(heap, (match, -index));
+				if not self.suppressOutputs:
+					if int(numpy.mod(i, updateStep)) == 0:
+						print(">", end='');
+		finally:
+			if pool is not None:
+				pool.shutdown();
+		if not self.suppressOutputs:
+			print();
+
+		self.topResults = [(match, -negIndex) for match, negIndex in sorted(heap, reverse = True)];
+		self.recordBestParams();
+		self.elapsedTime = datetime.now() - start;
+
+	# PRIVATE
+	def scanChunk(self, start:int, end:int) -> (numpy.array, numpy.array):
+		"""
+		Calculates the matches of a chunk of consecutive grid points, a run of points sharing their
+		discrete parameters and steepness at a time, and picks the best of them
+
+		@param start	int, flat index of the first grid point
+		@param end		int, flat index past the last grid point
+		@return float[] of the matches and int[] of the flat indices of up to topK best points, NaN for
+				points whose frequencies are undefined (e.g. all weights 0)
+		"""
+		shape = self.getGridShape();
+		points = numpy.unravel_index(numpy.arange(start, end), shape);
+		weights = numpy.stack([self.gridAxes[4 + i][points[4 + i]] for i in range(len(shape) - 4)], axis = 1);
+		runs = numpy.ravel_multi_index(points[:4], shape[:4]);
+		runStarts = numpy.concatenate([[0], numpy.flatnonzero(numpy.diff(runs)) + 1, [end - start]]);
+
+		matches = numpy.empty(end - start, dtype = numpy.float64);
+		for a, b in zip(runStarts[:-1], runStarts[1:]):
+			energies = self.getCombinationEnergies(points[0][a], points[1][a], points[2][a]);
+			steepness = self.gridAxes[3][points[3][a]];
+			if self.evaluationCache is None:
+				matches[a:b] = self.scoreWeights(energies, steepness, weights[a:b])[0];
+			else:
+				matches[a:b] = self.scoreWeightsCached([self.gridAxes[i][points[i][a]] for i in range(3)], energies, steepness, weights[a:b]);
+		if self.evaluationCache is not None:
+			self.evaluationCache.flush();		# worker processes may not be around to flush later
+
+		k = min(self.topK, matches.size);
+		best = numpy.argpartition(-numpy.nan_to_num(matches, nan = -numpy.inf), k - 1)[:k];
+		return matches[best], best + start;
+
+	# PRIVATE
+	def scoreWeights(self, energies:numpy.array, steepness:float, weights:numpy.array) -> (numpy.array, numpy.array):
+		"""
+		Matches of a batch of weights with one set of energies and steepness
+
+		@param energies		double[position][residue energy][macrostate] of averaged energies
+		@param steepness	float, steepness
+		@param weights		float[candidate][macrostate] of weights
+		@return float[candidate] of matches, NaN where the frequencies are undefined (e.g. all weights 0),
+				and float[candidate][position][residue] of frequencies
+		"""
+		frequencies = self.calcFrequencies(energies, steepness, weights);
+		matches = numpy.asarray(self.similarityMeasure.getSimilarityMeasures(frequencies), dtype = numpy.float64);
+		matches[~numpy.all(numpy.isfinite(frequencies), axis = (1, 2))] = numpy.nan;
+		return matches, frequencies;
+
+	# PRIVATE
+	def scoreWeightsCached(self, discrete:"number[]", energies:numpy.array, steepness:float, weights:numpy.array) -> numpy.array:
+		"""
+		Matches of a batch of weights like scoreWeights(), taking those of the points already in the
+		evaluation cache from it and adding the others
+
+		@param discrete		number[] of the ensemble size, backrub temperature and Boltzmann temperature of the points
+		@param energies		double[position][residue energy][macrostate] of averaged energies
+		@param steepness	float, steepness
+		@param weights		float[candidate][macrostate] of weights
+		@return float[candidate] of matches
+		"""
+		keys = [self.getCacheKey(discrete, steepness, w) for w in weights];
+		cached = [self.evaluationCache.lookup(key) for key in keys];
+		missing = numpy.array([entry is None for entry in cached], dtype = bool);
+		matches = numpy.array([numpy.nan if entry is None else entry[0] for entry in cached], dtype = numpy.float64);
+		if numpy.any(missing):
+			newMatches, frequencies = self.scoreWeights(energies, steepness, weights[missing]);
+			matches[missing] = newMatches;
+			for j, i in enumerate(numpy.flatnonzero(missing)):
+				self.evaluationCache.insert(keys[i], newMatches[j], frequencies[j]);
+		return matches;
+
+	# PRIVATE
+	def getCacheKey(self, discrete:"number[]", steepness:float, weights:numpy.array) -> tuple:
+		"""
+		The evaluation cache key of a grid point. With microstate data the ensemble seed is part of it,
+		as the matches depend on the ensembles picked with it
+
+		@param discrete		number[] of the ensemble size, backrub temperature and Boltzmann temperature of the point
+		@param steepness	float, steepness
+		@param weights		float[macrostate] of weights
+		@return tuple
+		"""
+		fixed = list(discrete[:2]);
+		if self.getModelLattice().useMicrostateData:
+			fixed.append(self.ensembleSeed);
+		return self.evaluationCache.getKey(fixed, numpy.concatenate([[discrete[2], steepness], weights]));
+
+	# PRIVATE
+	def calcFrequencies(self, energies:numpy.array, steepness:float, weights:numpy.array) -> numpy.array:
+		"""
+		Frequencies of a batch of weights with one set of energies and steepness
+
+		@param energies		double[position][residue energy][macrostate] of averaged energies
+		@param steepness	float, steepness
+		@param weights		float[candidate][macrostate] of weights
+		@return float[candidate][position][residue] of frequencies
+		"""
+		if self.sigmoidCache is not None:
+			sigmoids = self.sigmoidCache.getSigmoids(energies, steepness);
+		else:
+			sigmoids = calcSigmoids(energies, numpy.array([steepness]))[0];
+		with numpy.errstate(divide = 'ignore', invalid = 'ignore'):		# all weights 0 has no frequencies
+			return fitnessesToFrequencies(weightedProduct(sigmoids, weights.astype(sigmoids.dtype)[:, numpy.newaxis, numpy.newaxis, :]));
+
+	# PRIVATE
+	def getCombinationEnergies(self, ensembleIndex:int, backrubIndex:int, boltzmannIndex:int) -> numpy.array:
+		"""
+		Averaged energies of a combination of discrete parameters. Microstate ensembles are picked
+		with a seed of their own for each combination, and the last energies are kept as the
+		following points mostly share them
+
+		@param ensembleIndex	int, index of the ensemble size on its axis
+		@param backrubIndex		int, index of the backrub temperature on its axis
+		@param boltzmannIndex	int, index of the Boltzmann temperature on its axis
+		@return double[position][residue energy][macrostate]
+		"""
+		combination = (int(ensembleIndex), int(backrubIndex), int(boltzmannIndex));
+		if combination == self.cachedCombination:
+			return self.cachedEnergies;
+
+		ensembleSize = self.gridAxes[0][combination[0]];
+		backrubTemp = self.gridAxes[1][combination[1]];
+		boltzmannTemp = self.gridAxes[2][combination[2]];
+		template = self.getModelByParams(backrubTemp, ensembleSize, boltzmannTemp);
+		if template.useMicrostateData:
+			view = ModelView(template, ensembleSize, backrubTemp, boltzmannTemp, self.weightMins, self.steepnessRange[0]);
+			view.pickMicrostates(numpy.random.RandomState([self.ensembleSeed] + list(combination)));
+			energies = view.calcAveragedEnergies();
+		else:
+			energies = template.macrostateResidueEnergies;
+		self.cachedCombination = combination;
+		self.cachedEnergies = energies;
+		return energies;
+
+	def getGridPoint(self, index:int) -> {}:
+		"""
+		The parameters of a grid point, keys as in getBestParameters()
+
+		@param index	int, flat index of the grid point
+		@return Map<string, object>
+		"""
+		point = numpy.unravel_index(index, self.getGridShape());
+		params = {};
+		params['ensembleSize'] = self.gridAxes[0][point[0]];
+		params['backrubTemp'] = self.gridAxes[1][point[1]];
+		params['boltzmannTemp'] = self.gridAxes[2][point[2]];
+		params['steepness'] = self.gridAxes[3][point[3]];
+		params['weights'] = numpy.array([self.gridAxes[4 + i][point[4 + i]] for i in range(len(point) - 4)]);
+		return params;
+
+	def getTopParameters(self) -> [{}]:
+		"""
+		The best points of the last search, best first
+
+		@param void
+		@return Map<string, object>[], keys as in getBestParameters()
+		"""
+		top = [];
+		for match, index in self.topResults:
+			params = self.getGridPoint(index);
+			params['match'] = match;
+			top.append(params);
+		return top;
+
+	# PRIVATE
+	def recordBestParams(self) -> None:
+		if len(self.topResults) == 0:
+			return None;
+		match, index = self.topResults[0];
+		params = self.getGridPoint(index);
+		self.bestEnsembleSize = params['ensembleSize'];
+		self.bestBackrubTemp = params['backrubTemp'];
+		self.bestBoltzmannTemp = params['boltzmannTemp'];
+		self.bestSteepness = params['steepness'];
+		self.bestWeights = params['weights'];
+		# the frequencies the match was calculated from, from the evaluation cache if it is there
+		cached = None;
+		if self.evaluationCache is not None:
+			cached = self.evaluationCache.lookup(self.getCacheKey([params['ensembleSize'], params['backrubTemp'], params['boltzmannTemp']], self.bestSteepness, self.bestWeights));
+		if cached is not None:
+			self.bestFrequencies = cached[1];
+		else:
+			point = numpy.unravel_index(index, self.getGridShape());
+			energies = self.getCombinationEnergies(point[0], point[1], point[2]);
+			self.bestFrequencies = self.calcFrequencies(energies, self.bestSteepness, self.bestWeights[numpy.newaxis])[0];
+		self.bestMatchVal = match;
+		return None;
+
+	def __str__(self, **kwargs):
+		return "Grid search, steepness increment: {:.4f}, weight increment: {:.4f}, chunks of {:d} points".format(self.steepnessIncrement, self.weightIncrement, self.chunkSize);
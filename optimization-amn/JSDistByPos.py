@@ -24,10 +24,10 @@ class JSDistByPos(SimilarityMeasure):
 			self.targetFrequencies[i] = numpy.divide(self.targetFrequencies[i], numpy.sum(self.targetFrequencies[i]));
 
 	def getSimilarityMeasure(self, expFrequencies):
+		expFrequencies = expFrequencies / numpy.sum(expFrequencies, axis = 1, keepdims = True);
 		sum = 0;
 		h = lambda x : -1 * numpy.multiply(x, numpy.log2(x));	
 		for i in range(self.nPositions):
-			expFrequencies[i] = numpy.divide(expFrequencies[i], numpy.sum(expFrequencies[i]));
 			JSDiv = numpy.nan_to_num(h(self.targetFrequencies[i]) + h(expFrequencies[i]) - h(self.targetFrequencies[i] + expFrequencies[i]));
 			JSDiv = 0.5 * float(numpy.sum(JSDiv));
 			if JSDiv < 0 or JSDiv > 1:
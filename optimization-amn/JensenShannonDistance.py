@@ -16,7 +16,7 @@ class JensenShannonDistance(SimilarityMeasure):
 	def __init__(self, targetFrequencies = None):
 		super().__init__(targetFrequencies);
 		# JSD is technically for probability distributions, so everything nees to sum to 1
-		if self.targetFrequencies != None:
+		if self.targetFrequencies is not None:
 			self.targetFrequencies = self.targetFrequencies / numpy.sum(self.targetFrequencies);
 
 	def setTargetFreqs(self, targetFrequencies):
@@ -25,18 +25,18 @@ class JensenShannonDistance(SimilarityMeasure):
 
 	def getSimilarityMeasure(self, expFrequencies):
 		expFrequencies = expFrequencies / numpy.sum(expFrequencies);
+		precision = numpy.finfo(expFrequencies.dtype);
 
 		# kernalized implementation - there's a paper on this somewhere
-		h = lambda x : -1 * numpy.multiply(x, numpy.log2(x));	# in base 2 JS div is on range [0, 1]
+		# logs are taken of at least the smallest normal number so that 0 * log(0) comes out as 0, float32 frequencies underflow to 0 much sooner
+		h = lambda x : -1 * numpy.multiply(x, numpy.log2(numpy.maximum(x, precision.tiny)));	# in base 2 JS div is on range [0, 1]
 		JSDiv = numpy.nan_to_num(h(self.targetFrequencies) + h(expFrequencies) - h(self.targetFrequencies + expFrequencies));
 		JSDiv = 0.5 * float(numpy.sum(JSDiv)); # technically JSDiv is 1 - sum(things), but we're flipping the directions
-		if float(JSDiv) < 0 or float(JSDiv) > 1:
-			n = h(self.targetFrequencies) + h(expFrequencies) - h(self.targetFrequencies + expFrequencies);
-			n = numpy.nan_to_num(n);
-			print(n);
-			print(numpy.sum(n));
-			print(JSDiv);
-			exit(1);
+		# rounding can leave the sum just outside [0, 1], by more in float32
+		tolerance = precision.eps * expFrequencies.size;
+		if float(JSDiv) < -tolerance or float(JSDiv) > 1 + tolerance:
+			raise ValueError("Jensen-Shannon divergence {:g} is outside [0, 1]".format(JSDiv));
+		JSDiv = min(max(JSDiv, 0.0), 1.0);
 
 		#avgFreq = numpy.divide(numpy.add(expFrequencies, self.targetFrequencies), 2.0);
 		#expFreqKLDiv = numpy.multiply(expFrequencies, numpy.divide(numpy.log(numpy.divide(expFrequencies, avgFreq)), numpy.log(20)));
@@ -50,6 +50,25 @@ class JensenShannonDistance(SimilarityMeasure):
 		# the sqrt of JS divergence is JS distance
 		return numpy.sqrt(JSDiv);
 	
+	def getSimilarityMeasures(self, expFrequencies):
+		# same as getSimilarityMeasure(), summed over each candidate's positions and residues
+		expFrequencies = expFrequencies / numpy.sum(expFrequencies, axis = (1, 2), keepdims = True);
+		precision = numpy.finfo(expFrequencies.dtype);
+		h = lambda x : -1 * numpy.multiply(x, numpy.log2(numpy.maximum(x, precision.tiny)));
+		JSDiv = numpy.nan_to_num(h(self.targetFrequencies) + h(expFrequencies) - h(self.targetFrequencies + expFrequencies));
+		JSDiv = 0.5 * numpy.sum(JSDiv, axis = (1, 2), dtype = numpy.float64);
+		return numpy.sqrt(numpy.clip(JSDiv, 0.0, 1.0));
+
+	def getSimilarityGradient(self, expFrequencies):
+		total = numpy.sum(expFrequencies);
+		normFrequencies = numpy.maximum(expFrequencies / total, self.NOT_ZERO_BUT_CLOSE_ENOUGH);	# log is undefined at 0
+		h = lambda x : -1 * numpy.multiply(x, numpy.log2(x));
+		JSDiv = 0.5 * float(numpy.sum(numpy.nan_to_num(h(self.targetFrequencies) + h(normFrequencies) - h(self.targetFrequencies + normFrequencies))));
+		# d(JSDiv)/d(normalized freq), then through the normalization and the sqrt
+		grad = 0.5 * numpy.log2((self.targetFrequencies + normFrequencies) / normFrequencies);
+		grad = (grad - numpy.sum(grad * normFrequencies)) / total;
+		return grad / (2.0 * max(numpy.sqrt(JSDiv), self.NOT_ZERO_BUT_CLOSE_ENOUGH));
+
 	def clone(self) -> SimilarityMeasure:
 		return JensenShannonDistance(self.targetFrequencies);
 	
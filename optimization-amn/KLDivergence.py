@@ -13,13 +13,23 @@ class KLDivergence(SimilarityMeasure):
 	def getSimilarityMeasure(self, expFrequencies):
 		# normalize
 		expFrequencies = numpy.divide(expFrequencies, numpy.sum(expFrequencies));
+		# keep the ratio below finite where frequencies underflow to 0, which happens much sooner in float32
+		expFrequencies = numpy.maximum(expFrequencies, numpy.finfo(expFrequencies.dtype).tiny);
 		similarity = numpy.nan_to_num(numpy.log10(numpy.divide(self.targetFrequencies, expFrequencies))); # log base 2 since information but it really doesn't matter since it's just essentially scaling
 		similarity = numpy.multiply(similarity, self.targetFrequencies);
 		similarity = numpy.nan_to_num(similarity);
-		similarity = numpy.sum(similarity);
+		similarity = max(numpy.sum(similarity), 0.0);	# rounding can leave a slightly negative divergence
 		# K-L divergence is on range of [0, +inf), use exp(-KLD) to translate it to [0, 1]
 		similarity = numpy.exp(-1 * similarity);
 		return similarity;
 
+	def getSimilarityGradient(self, expFrequencies):
+		total = numpy.sum(expFrequencies);
+		normFrequencies = numpy.maximum(expFrequencies / total, numpy.finfo(expFrequencies.dtype).tiny);
+		similarity = self.getSimilarityMeasure(expFrequencies);
+		# d(KLD)/d(normalized freq) = -t / (e ln 10), similarity = exp(-KLD)
+		grad = numpy.nan_to_num(similarity * self.targetFrequencies / (normFrequencies * numpy.log(10)));
+		return (grad - numpy.sum(grad * normFrequencies)) / total;
+
 	def __str__(self, **kwargs):
 		return "Kullback-Leibler Divergence"
\ No newline at end of file
@@ -0,0 +1,216 @@
+from collections import OrderedDict
+
+class LazyModelLoader:
+	"""
+	Loads the data models of a tab-delimited energy file one combination of discrete parameters at a time,
+	when a search first asks for it, instead of reading them all up front. A first scan of the file
+	records the byte ranges of the lines of each combination without parsing any energies, and loading
+	a model only reads and parses its own ranges. Lines of positions outside the model are not recorded,
+	so a combination that only has such lines is not in the file as far as the searches are concerned.
+
+	Loaded models are kept in least recently used order. With a memory budget, the coldest models are
+	evicted once the loaded ones take more than the budget, and are simply loaded again when they are
+	next asked for. Candidates made from an evicted model keep it alive until they are discarded.
+	"""
+
+	source = '';				# path of the data file
+	useMicrostateData = False;	# are the models of microstate data?
+	buildModel = None;			# function(key, generator of string[] chunks of lines) -> Model
+	memoryBudget = None;		# int, bytes the loaded models may take, None for no limit
+	ranges = {};				# Map<key, int[][2]> {start, end} byte ranges of the lines of each combination
+	positions = set();			# int position numbers of the recorded lines
+	firstPosition = None;		# int position number of the first line
+	minPosition = None;			# int lowest position number recorded, the first position of the file if None
+	nPositions = None;			# int number of positions recorded from minPosition on, all of them if None
+	loaded = OrderedDict();		# Map<key, Model> loaded models, least recently used first
+	loadedBytes = 0;			# bytes taken by the loaded models
+	hits = 0;
+	loads = 0;
+	evictions = 0;
+
+	def __init__(self, source:str, keyFields:"int[]", positionField:int, keyOf, buildModel, useMicrostateData:bool, memoryBudget:int = None, skipHeader:bool = True, minPosition:int = None, nPositions:int = None):
+		"""
+		Default constructor, scans the file
+
+		@param source				string, path of the data file
+		@param keyFields			int[], indices of the tab-delimited fields that hold the discrete parameters
+		@param positionField		int, index of the field that holds the position number
+		@param keyOf				function(string[]) -> (backrub temperature, ensemble size, Boltzmann temperature),
+										the parameter combination of a line from its key fields
+		@param buildModel			function(key, generator of string[] chunks of lines) -> Model, makes the model of a combination from its lines
+		@param useMicrostateData	bool, are the models of microstate data?
+		@param memoryBudget			int, optional, bytes the loaded models may take. No limit by default
+		@param skipHeader			bool, skip the first line?
+		@param minPosition			int, optional, lowest position number of the model. The position of the first line by default
+		@param nPositions			int, optional, number of positions of the model. Lines of positions from minPosition + nPositions
+										on are not recorded. All positions by default
+		"""
+		self.source = source;
+		self.minPosition = minPosition;
+		self.nPositions = nPositions;
+		self.useMicrostateData = useMicrostateData;
+		self.buildModel = buildModel;
+		self.memoryBudget = memoryBudget;
+		self.loaded = OrderedDict();
+		self.loadedBytes = 0;
+		self.hits = 0;
+		self.loads = 0;
+		self.evictions = 0;
+		self.scan(keyFields, positionField, keyOf, skipHeader);
+
+	# PRIVATE
+	def scan(self, keyFields:"int[]", positionField:int, keyOf, skipHeader:bool) -> None:
+		"""
+		Records the byte ranges of the lines of each combination within the positions of the model, and
+		those positions. Consecutive lines of a combination are merged into one range
+
+		@param keyFields		int[], indices of the fields that hold the discrete parameters
+		@param positionField	int, index of the field that holds the position number
+		@param keyOf			function(string[]) -> key
+		@param skipHeader		bool, skip the first line?
+		@return void
+		"""
+		self.ranges = {};
+		self.positions = set();
+		self.firstPosition = None;
+		nSplits = max(max(keyFields), positionField) + 1;
+		keys = {};		# raw key fields -> key, there are few distinct ones
+		with open(self.source, 'rb') as infile:
+			offset = len(infile.readline()) if skipHeader else 0;
+			for line in infile:
+				end = offset + len(line);
+				fields = line.split(b'\t', nSplits) if not line.isspace() else None;
+				position = int(fields[positionField]) if fields is not None else None;
+				if self.firstPosition is None:
+					self.firstPosition = position;
+				if position is not None and self.isInModel(position):
+					rawKey = tuple([fields[i] for i in keyFields]);
+					if rawKey not in keys:
+						keys[rawKey] = keyOf([f.decode('utf-8') for f in rawKey]);
+					ranges = self.ranges.setdefault(keys[rawKey], []);
+					if len(ranges) > 0 and ranges[-1][1] == offset:
+						ranges[-1][1] = end;
+					else:
+						ranges.append([offset, end]);
+					self.positions.add(position);
+				offset = end;
+		if len(self.ranges) == 0:
+			raise ValueError("No data within the positions read in " + self.source);
+		return None;
+
+	# PRIVATE
+	def isInModel(self, position:int) -> bool:
+		"""
+		Is a position within [minPosition, minPosition + nPositions)? The first position of the file
+		stands in for minPosition when there is none
+
+		@param position		int, position number
+		@return bool
+		"""
+		low = self.minPosition if self.minPosition is not None else self.firstPosition;
+		if position < low:
+			return False;
+		return self.nPositions is None or position < low + self.nPositions;
+
+	def getKeys(self) -> list:
+		"""
+		The parameter combinations in the file, in the order they first appear
+
+		@param void
+		@return (backrub temperature, ensemble size, Boltzmann temperature)[]
+		"""
+		return list(self.ranges.keys());
+
+	# PRIVATE
+	def readLines(self, key, blockSize:int = 1 << 24):
+		"""
+		Reads the lines of a combination, a block of bytes at a time
+
+		@param key			a key from getKeys()
+		@param blockSize	int, bytes read at once
+		@return generator of string[] of lines
+		"""
+		with open(self.source, 'rb') as infile:
+			for start, end in self.ranges[key]:
+				infile.seek(start);
+				remainder = b'';
+				while start < end:
+					data = infile.read(min(blockSize, end - start));
+					if len(data) == 0:
+						raise ValueError(self.source + " is shorter than when it was scanned");
+					start += len(data);
+					block = remainder + data;
+					cut = block.rfind(b'\n') + 1 if start < end else len(block);		# the last block ends on a line end
+					remainder = block[cut:];
+					yield block[:cut].decode('utf-8').splitlines(keepends = True);
+
+	def load(self, key):
+		"""
+		The model of a combination, loaded from the file if it is not loaded already
+
+		@param key		a key from getKeys()
+		@return Model
+		"""
+		if key in self.loaded:
+			self.hits += 1;
+			self.loaded.move_to_end(key);
+			return self.loaded[key];
+
+		m = self.buildModel(key, self.readLines(key));
+		self.loads += 1;
+		self.loaded[key] = m;
+		self.loadedBytes += LazyModelLoader.getModelBytes(m);
+		self.evict();
+		return m;
+
+	# PRIVATE
+	def evict(self) -> None:
+		"""
+		Drops the least recently used models until the loaded ones fit the memory budget.
+		The most recently used model is always kept
+
+		@param void
+		@return void
+		"""
+		if self.memoryBudget is None:
+			return None;
+		while self.loadedBytes > self.memoryBudget and len(self.loaded) > 1:
+			key, m = self.loaded.popitem(last = False);
+			self.loadedBytes -= LazyModelLoader.getModelBytes(m);
+			self.evictions += 1;
+		return None;
+
+	# STATIC
+	def getModelBytes(m) -> int:
+		"""
+		Memory taken by the energies of a model
+
+		@param m		Model
+		@return int bytes
+		"""
+		size = m.macrostateResidueEnergies.nbytes;
+		if m.useMicrostateData:
+			size += m.microstateResidueEnergies.nbytes;
+		return size;
+
+	def getStats(self) -> {}:
+		"""
+		Returns the loader counters.
+		Keys:
+			'hits'
+			'loads'
+			'evictions'
+			'loadedBytes'
+
+		@param void
+		@return Map<string, int>
+		"""
+		stats = {};
+		stats['hits'] = self.hits;
+		stats['loads'] = self.loads;
+		stats['evictions'] = self.evictions;
+		stats['loadedBytes'] = self.loadedBytes;
+		return stats;
+
+	def __str__(self, **kwargs):
+		return "Lazy model loader of {:s}, {:d}/{:d} combinations loaded, loads/hits/evictions: {:d}/{:d}/{:d}".format(self.source, len(self.loaded), len(self.ranges), self.loads, self.hits, self.evictions);
@@ -0,0 +1,215 @@
+from model import Model
+import numpy
+
+isEmpty = numpy.frompyfunc(lambda m : m is None, 1, 1);		# elementwise "is None", Model overloads == to compare matches
+
+class ModelLattice:
+	"""
+	The data models indexed by their discrete hyperparameters. Each hyperparameter is an axis holding its
+	sorted distinct values, and the models sit in an N-dimensional array at the indices of their values,
+	so once values are turned into indices a lookup is plain integer indexing and the models of a whole
+	population are gathered in one fancy-indexing operation.
+
+	Values are matched as numbers, not as strings, so 0.9, '0.9' and '0.90' all land
+	on the same index. Microstate data models are only keyed by backrub temperature, their
+	ensemble size and Boltzmann temperature are chosen freely; those axes are then None and ignored.
+
+	With a LazyModelLoader, the grid holds the parameter combinations of the data file instead of the
+	models, and models are loaded through the loader when they are looked up.
+	"""
+
+	AXES = ('backrubTemp', 'ensembleSize', 'boltzmannTemp');	# order of the axes of the grid
+	AXIS_TYPES = (numpy.float64, numpy.int64, numpy.float64);	# type of the values of each axis
+
+	axes = [];					# number[][] sorted distinct values of each hyperparameter, None for axes the models are not keyed by
+	valueToIndex = [];			# Map<float, int>[] index of each value, per axis
+	grid = numpy.array(0);		# Model[backrubTemp][ensembleSize][boltzmannTemp], None where there is no model
+	useMicrostateData = False;	# are the models of microstate data?
+	loader = None;				# LazyModelLoader the models are loaded through, None when the grid holds the models
+
+	def __init__(self, models, loader:"LazyModelLoader" = None):
+		"""
+		Default constructor
+
+		@param models		Model[] or Map<string, Model> of the data models, e.g. Optimizer.models. Ignored with a loader
+		@param loader		LazyModelLoader, optional, to load the models from on demand instead
+		"""
+		self.loader = loader;
+		if loader is not None:
+			keys = loader.getKeys();
+			models = keys;
+			self.useMicrostateData = loader.useMicrostateData;
+		else:
+			if isinstance(models, dict):
+				models = list(models.values());
+			models = list(models);
+			if len(models) == 0:
+				raise ValueError("No models to build a lattice from, read some data first");
+			self.useMicrostateData = models[0].useMicrostateData;
+			if any([m.useMicrostateData != self.useMicrostateData for m in models]):
+				raise ValueError("Cannot mix models of macrostate and microstate data");
+			keys = [ModelLattice.getKey(m) for m in models];
+
+		self.axes = [];
+		self.valueToIndex = [];
+		for i in range(len(ModelLattice.AXES)):
+			if self.useMicrostateData and i > 0:
+				self.axes.append(None);
+				self.valueToIndex.append(None);
+				continue;
+			values = numpy.unique(numpy.array([key[i] for key in keys], dtype = ModelLattice.AXIS_TYPES[i]));
+			self.axes.append(values);
+			self.valueToIndex.append({float(values[j]) : j for j in range(values.size)});
+
+		self.grid = numpy.full([len(v) if v is not None else 1 for v in self.axes], None, dtype = object);
+		for m, key in zip(models, keys):
+			indices = self.getIndices(*key);
+			if self.grid[indices] is not None:
+				raise ValueError("Two models with the same parameters " + str(key));
+			self.grid[indices] = m;
+
+	# STATIC
+	def getKey(m:Model) -> (float, int, float):
+		"""
+		The discrete hyperparameters of a data model, in the order of the axes
+
+		@param m		Model
+		@return float backrub temperature, int ensemble size, float Boltzmann temperature
+		"""
+		return (m.backrubTemp, m.ensembleSize, m.boltzmannTemp);
+
+	def getIndex(self, axis:int, value) -> int:
+		"""
+		Index of a value on an axis
+
+		@param axis		int, 0 for backrub temperature, 1 for ensemble size, 2 for Boltzmann temperature
+		@param value	number or string of a number, ignored if the models are not keyed by this axis
+		@return int
+		"""
+		if self.axes[axis] is None:
+			return 0;
+		try:
+			return self.valueToIndex[axis][float(value)];
+		except (KeyError, TypeError, ValueError):
+			raise KeyError("No model with {:s} {:s}, there are {:s}".format(ModelLattice.AXES[axis], str(value), str(self.axes[axis].tolist())));
+
+	def getIndices(self, backrubTemp, ensembleSize, boltzmannTemp) -> (int, int, int):
+		"""
+		Indices of a combination of hyperparameters
+
+		@param backrubTemp		float, backrub temperature
+		@param ensembleSize		int, ensemble size, ignored for microstate data
+		@param boltzmannTemp	float, Boltzmann temperature, ignored for microstate data
+		@return int, int, int
+		"""
+		return (self.getIndex(0, backrubTemp), self.getIndex(1, ensembleSize), self.getIndex(2, boltzmannTemp));
+
+	def getIndicesOf(self, axis:int, values:"float[]") -> numpy.array:
+		"""
+		Indices of many values on an axis at once
+
+		@param axis		int, 0 for backrub temperature, 1 for ensemble size, 2 for Boltzmann temperature
+		@param values	float[] of values that are all on the axis
+		@return int[] of indices
+		"""
+		if self.axes[axis] is None:
+			return numpy.zeros(numpy.shape(values), dtype = int);
+		values = numpy.asarray(values, dtype = numpy.float64);
+		indices = numpy.minimum(numpy.searchsorted(self.axes[axis], values), self.axes[axis].size - 1);
+		if not numpy.all(self.axes[axis][indices] == values):
+			missing = values[self.axes[axis][indices] != values];
+			raise KeyError("No model with {:s} {:s}, there are {:s}".format(ModelLattice.AXES[axis], str(missing.tolist()), str(self.axes[axis].tolist())));
+		return indices;
+
+	def get(self, backrubIndex:int, ensembleIndex:int, boltzmannIndex:int) -> Model:
+		"""
+		The model at some indices
+
+		@param backrubIndex		int, index of the backrub temperature
+		@param ensembleIndex	int, index of the ensemble size, 0 for microstate data
+		@param boltzmannIndex	int, index of the Boltzmann temperature, 0 for microstate data
+		@return Model, or None if there is no model with those parameters
+		"""
+		return self.resolve(self.grid[backrubIndex, ensembleIndex, boltzmannIndex]);
+
+	# PRIVATE
+	def resolve(self, cell):
+		"""
+		The model of a grid cell, loading it if the grid holds combinations
+
+		@param cell		a grid cell
+		@return Model, or None for an empty cell
+		"""
+		if self.loader is None or cell is None:
+			return cell;
+		return self.loader.load(cell);
+
+	def getByParams(self, backrubTemp, ensembleSize, boltzmannTemp) -> Model:
+		"""
+		The model with some hyperparameters
+
+		@param backrubTemp		float, backrub temperature
+		@param ensembleSize		int, ensemble size, ignored for microstate data
+		@param boltzmannTemp	float, Boltzmann temperature, ignored for microstate data
+		@return Model
+		"""
+		m = self.resolve(self.grid[self.getIndices(backrubTemp, ensembleSize, boltzmannTemp)]);
+		if m is None:
+			raise KeyError("No model with backrub temperature {:s}, ensemble size {:s} and Boltzmann temperature {:s}".format(str(backrubTemp), str(ensembleSize), str(boltzmannTemp)));
+		return m;
+
+	def gather(self, backrubIndices:numpy.array, ensembleIndices:numpy.array, boltzmannIndices:numpy.array) -> numpy.array:
+		"""
+		The models at many indices at once, e.g. of a whole population
+
+		@param backrubIndices		int[] of backrub temperature indices
+		@param ensembleIndices		int[] of ensemble size indices, zeros for microstate data
+		@param boltzmannIndices		int[] of Boltzmann temperature indices, zeros for microstate data
+		@return Model[] as an object array, None where there is no model
+		"""
+		models = self.grid[backrubIndices, ensembleIndices, boltzmannIndices];
+		if self.loader is not None:
+			models = numpy.frompyfunc(self.resolve, 1, 1)(models);
+		return models;
+
+	def validate(self, backrubTemps:"float[]", ensembleSizes:"int[]", boltzmannTemps:"float[]") -> None:
+		"""
+		Checks that there is a model for every combination of some hyperparameter values, e.g. of a search grid
+
+		@param backrubTemps		float[] of backrub temperatures
+		@param ensembleSizes	int[] of ensemble sizes, ignored for microstate data
+		@param boltzmannTemps	float[] of Boltzmann temperatures, ignored for microstate data
+		@return void, raises ValueError if a combination has no model
+		"""
+		values = [numpy.ravel(backrubTemps), numpy.ravel(ensembleSizes), numpy.ravel(boltzmannTemps)];
+		indices = [];
+		for i in range(len(values)):
+			if self.axes[i] is None:
+				indices.append(numpy.zeros(1, dtype = int));
+				values[i] = numpy.array(['any']);
+				continue;
+			try:
+				indices.append(self.getIndicesOf(i, values[i]));
+			except KeyError as e:
+				raise ValueError("The search grid does not match the data read: " + str(e.args[0]));
+		missing = numpy.argwhere(isEmpty(self.grid[numpy.ix_(*indices)]).astype(bool));
+		if missing.shape[0] > 0:
+			b, e, z = missing[0];
+			raise ValueError("The search grid does not match the data read: no model with backrub temperature {:s}, ensemble size {:s} and Boltzmann temperature {:s}, {:d} combinations missing".format(
+				str(values[0][b]), str(values[1][e]), str(values[2][z]), missing.shape[0]));
+		return None;
+
+	def getModels(self) -> [Model]:
+		"""
+		All the models, in grid order. Loads them all when they are loaded on demand
+
+		@param void
+		@return Model[]
+		"""
+		return [self.resolve(m) for m in self.grid.ravel() if m is not None];
+
+	def __len__(self):
+		return int(numpy.count_nonzero(~isEmpty(self.grid).astype(bool)));
+
+	def __str__(self, **kwargs):
+		return "Model lattice, " + ", ".join(["{:s}: {:s}".format(ModelLattice.AXES[i], str(self.axes[i].tolist()) if self.axes[i] is not None else "any") for i in range(len(ModelLattice.AXES))]);
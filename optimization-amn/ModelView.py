@@ -0,0 +1,153 @@
+from model import Model, calcFitnesses, fitnessesToFrequencies
+from BoltzmannTable import boltzmannAverage
+from SigmoidCache import SigmoidCache
+import numpy
+
+class ModelView:
+	"""
+	A lightweight candidate Model used by the searches. It only holds its hyperparameters and
+	a reference to the data Model it was made from, and shares that model's energies instead
+	of allocating its own. Frequencies are calculated once on first request.
+
+	Weights and frequencies are returned as read-only arrays without copying, so copy them
+	before modifying. The getters match those of Model. Comparisons order candidates by recovery,
+	including >, which Model.__gt__ inverts; it is deliberately not inverted here.
+	"""
+	__slots__ = ('template', 'ensembleSize', 'backrubTemp', 'boltzmannTemp', 'weights', 'steepness', 'ensembleSeed', 'ensembleCache', 'sigmoidCache', 'macrostatesUsed', 'recovery',
+				'areMicrostatesPicked', 'microstatesUsed', 'selectedMicrostateEnergies', 'macrostateResidueEnergies', 'fitnesses', 'frequencies');
+
+	def __init__(self, template:Model, ensembleSize:int, backrubTemp:float, boltzmannTemp:float, weights:numpy.array, steepness:float, ensembleSeed:int = None, ensembleCache:"EnsembleCache" = None, sigmoidCache:SigmoidCache = None):
+		"""
+		Default constructor
+
+		@param template			the data Model holding the energies, it is not modified
+		@param ensembleSize		int, ensemble size
+		@param backrubTemp		float, backrub temperature
+		@param boltzmannTemp	float, Boltzmann averaging temperature
+		@param weights			float[], weights of the macrostates
+		@param steepness		float, steepness
+		@param ensembleSeed		int, optional, seed to pick microstates with. Only used with ensembleCache
+		@param ensembleCache	EnsembleCache, optional, cache of picked ensembles and averaged energies shared between models
+		@param sigmoidCache		SigmoidCache, optional, cache of the weight independent part of the fitness shared between models
+		"""
+		self.template = template;
+		self.ensembleSize = ensembleSize;
+		self.backrubTemp = backrubTemp;
+		self.boltzmannTemp = boltzmannTemp;
+		self.weights = numpy.array(weights, dtype = numpy.float64);
+		self.weights.flags.writeable = False;
+		self.steepness = steepness;
+		self.ensembleSeed = ensembleSeed;
+		self.ensembleCache = ensembleCache;
+		self.sigmoidCache = sigmoidCache;
+		self.macrostatesUsed = template.macrostatesUsed;
+		self.recovery = -1.0;
+		self.areMicrostatesPicked = False;
+		self.microstatesUsed = None;
+		self.selectedMicrostateEnergies = None;
+		self.fitnesses = None;
+		self.frequencies = None;
+		if template.useMicrostateData:
+			self.macrostateResidueEnergies = None;		# averaged on demand
+		else:
+			self.macrostateResidueEnergies = template.macrostateResidueEnergies;
+
+	@property
+	def useAltAveragingMethod(self) -> bool:
+		return self.template.useAltAveragingMethod;
+
+	# PRIVATE
+	def pickMicrostates(self, rng) -> None:
+		"""
+		Randomly picks the microstates used in the ensemble of each position and macrostate
+
+		@param rng		numpy.random or a numpy.random.RandomState to draw the picks from
+		@return void
+		"""
+		self.microstatesUsed, self.selectedMicrostateEnergies = self.template.selectMicrostates(self.ensembleSize, rng);
+		self.areMicrostatesPicked = True;
+		return None;
+
+	# PRIVATE
+	def calcAveragedEnergies(self) -> numpy.array:
+		"""
+		Boltzmann averages the picked microstates at this view's Boltzmann temperature
+
+		@param void
+		@return double[position][residue energy][macrostate]
+		"""
+		return boltzmannAverage(self.selectedMicrostateEnergies, self.boltzmannTemp, self.useAltAveragingMethod);
+
+	# PRIVATE
+	def averageMicrostates(self) -> None:
+		"""
+		Picks an ensemble and Boltzmann averages it, through the ensemble cache if there is one.
+		The picked energies are dropped afterwards, only the averaged energies are kept
+
+		@param void
+		@return void
+		"""
+		if self.ensembleCache is not None and self.ensembleSeed is not None:
+			self.ensembleCache.averageMicrostates(self);
+		else:
+			if not self.areMicrostatesPicked:
+				self.pickMicrostates(numpy.random);
+			self.macrostateResidueEnergies = self.calcAveragedEnergies();
+		self.selectedMicrostateEnergies = None;
+		return None;
+
+	def getFrequencies(self) -> numpy.array:
+		"""
+		Self-explanatory name. Returns a read-only array, copy it before modifying
+
+		@return float[][]
+		"""
+		if self.frequencies is None:
+			if self.macrostateResidueEnergies is None:
+				self.averageMicrostates();
+			if self.sigmoidCache is not None:
+				self.fitnesses = self.sigmoidCache.getFitnesses(self.macrostateResidueEnergies, self.steepness, self.weights);
+			else:
+				self.fitnesses = calcFitnesses(self.macrostateResidueEnergies, self.weights[numpy.newaxis], numpy.array([self.steepness]))[0];
+			self.frequencies = fitnessesToFrequencies(self.fitnesses);
+			self.frequencies.flags.writeable = False;
+		return self.frequencies;
+
+	def getEnsembleSize(self) -> int:
+		return self.ensembleSize;
+
+	def getBackrubTemp(self) -> float:
+		return self.backrubTemp;
+
+	def getBoltzmannTemp(self) -> float:
+		return self.boltzmannTemp;
+
+	def getWeights(self) -> numpy.array:
+		"""
+		Self-explanatory name. Returns a read-only array, copy it before modifying
+
+		@return float[]
+		"""
+		return self.weights;
+
+	def getSteepness(self) -> float:
+		return self.steepness;
+
+	# comparison operators based on similarity measure
+	def __eq__(self, other):
+		return self.recovery == other.recovery;
+
+	def __ne__(self, other):
+		return self.recovery != other.recovery;
+
+	def __le__(self, other):
+		return self.recovery <= other.recovery;
+
+	def __lt__(self, other):
+		return self.recovery < other.recovery;
+
+	def __ge__(self, other):
+		return self.recovery >= other.recovery;
+
+	def __gt__(self, other):
+		return self.recovery > other.recovery;		# not inverted like Model.__gt__
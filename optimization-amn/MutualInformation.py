@@ -24,8 +24,7 @@ class MutualInformation(SimilarityMeasure):
 		return MutualInformation(self.targetFrequencies);
 
 	def getSimilarityMeasure(self, expFrequencies):
-		for i in range(self.nPositions):
-			expFrequencies[i] = numpy.divide(expFrequencies[i], numpy.sum(expFrequencies[i]));
+		expFrequencies = expFrequencies / numpy.sum(expFrequencies, axis = 1, keepdims = True);
 		return
 
 	def __str__(self, **kwargs):
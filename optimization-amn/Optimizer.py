@@ -1,11 +1,23 @@
 from model import Model
 from SearchAlgorithm import SearchAlgorithm
+from ModelLattice import ModelLattice
 from SimilarityMeasure import SimilarityMeasure
+from ParsedDataCache import ParsedDataCache
+from EvaluationStore import EvaluationStore
+from EnergyTableParser import readEnergyTable, parseEnergyLines, readMicrostateBlocks, readMicrostateShard, microstateFilter, splitMicrostateChunks
+from LazyModelLoader import LazyModelLoader
+from FastaProfile import buildProfile, buildWeightedProfile
+from ProfileWriter import writePseudoSequences, writeProfileNPY, writeProfileJSON, writeProfilePSSM
 from io import *
 from enumeration import enum
 from copy import *
+from concurrent.futures import ProcessPoolExecutor
 import numpy
-import ast
+import itertools
+import functools
+import glob
+import hashlib
+import os
 import datetime
 import warnings
 
@@ -32,14 +44,21 @@ class Optimizer(object):
     nMacrostates = 0                              # number of macrostates
     continuousBoltzmann = False                   # are we using a continuous set of boltzmann temps
     targetFreqsRead = False
+    dtype = numpy.float64                         # precision the energies, frequencies and similarities are stored and calculated in
+    parsedDataCache = None                        # ParsedDataCache of data files already parsed, None to parse every read
+    modelLattice = None                           # ModelLattice of the models, built on first lookup after a read
+    modelLoader = None                            # LazyModelLoader of the data when it is read lazily, None otherwise
+    dataRead = None                               # tuple of the files and settings of the last data read, see getDataHash()
 
-    def __init__(self, macrostates=None, continuousBoltzmann=False, contiguousPositions=True):
+    def __init__(self, macrostates=None, continuousBoltzmann=False, contiguousPositions=True, dtype=numpy.float64):
         """
         Default constructor.
 
         @param macrostates            enum of the macrostates to be considered
         @param continuousBoltzmann    bool, are microstate data provided
         @param contiguousPositions    bool, are the positions aligned to a contiguous set of positions in the target?
+        @param dtype                  numpy.float64, or numpy.float32 to halve the memory held by the energies
+                                          and the bandwidth of the fitness calculations, at the cost of precision
         """
 
         self.MACROSTATES = macrostates
@@ -58,6 +77,11 @@ class Optimizer(object):
         self.targetFrequencies = numpy.array(0)
         self.contiguousPositions = contiguousPositions
         self.targetFreqsRead = False
+        self.dtype = dtype
+        self.parsedDataCache = None
+        self.modelLattice = None
+        self.modelLoader = None
+        self.dataRead = None
         if not contiguousPositions:
             self.positionMap = {}
         else:
@@ -71,13 +95,16 @@ class Optimizer(object):
         @return Optimizer
         """
 
-        newOptimizer = Optimizer(existing.MACROSTATES)
+        newOptimizer = Optimizer(existing.MACROSTATES, dtype=existing.dtype)
         newOptimizer.minPosition = existing.minPosition
         newOptimizer.nPositions = existing.nPositions
         newOptimizer.targetFrequencies = numpy.array(existing.targetFrequencies)
         newOptimizer.models = dict(existing.models)
         #newOptimizer.similarityMeasure = existing.similarityMeasure;
         newOptimizer.optimizationAlgorithm = existing.optimizationAlgorithm
+        newOptimizer.parsedDataCache = existing.parsedDataCache
+        newOptimizer.modelLoader = existing.modelLoader
+        newOptimizer.dataRead = existing.dataRead
         newOptimizer.contiguousPositions = existing.contiguousPositions
         newOptimizer.targetFreqsRead = existing.targetFreqsRead
         if not existing.contiguousPositions:
@@ -86,241 +113,353 @@ class Optimizer(object):
         return newOptimizer
 
     # TODO: change the file return type to file read return
-    def readTargetFrequencies(self, source, posPicker=None):
+    def readTargetFrequencies(self, source, posPicker=None, weighting=None, identityThreshold=0.8):
         """
         Reads the target frequencies from a FASTA file. Call this before reading data
         Note: when optimizing against a set of positions that are not contiguous, this function
         *MUST* be called before calling a read*Data function. Doing otherwise will void all warranties
         and promises that calculations will be correct.
 
-        @param source            string pointing to the location of the input FASTAs
+        The alignment is streamed a batch of sequences at a time, so alignments of any size can be read.
+        Frequencies at each position are over the sequences with one of the 20 residues aligned there;
+        gaps, lower case and non-standard letters are not counted.
+        Sequences can be weighted so that redundant clusters of sequences do not dominate the frequencies,
+        in which case the whole alignment is held in memory, one byte per residue.
+
+        @param source                string pointing to the location of the input FASTAs
+        @param posPicker             string, optional, file of the alignment columns to keep, see positionReindexerFASTA()
+        @param weighting             string, optional, None to count every sequence equally, 'henikoff' for
+                                         position-based weights, 'identity' for percent identity clustering weights
+        @param identityThreshold     float, identity at which sequences are clustered together with 'identity' weighting
         @return array of the target frequencies
         """
-        # resToIndex is used to convert a one-letter AA code to an index, which is in alphabetical order
-        resToIndex = {'A':0, 'C':1, 'D':2, 'E':3, 'F':4, 'G':5, 'H':6, 'I':7, 'K':8, 'L':9, 'M':10, 'N':11, 'P':12, 'Q':13, 'R':14, 'S':15, 'T':16, 'V':17, 'W':18, 'Y':19}
-        infile = open(source, 'r', encoding='utf-8')
-
-        # figure out the number of positions
-        infile.readline() # skip the first line (>NULL)
-        entry = ""
-        thisLine = infile.readline()
-        while thisLine[0] != '>':
-            entry += thisLine
-            thisLine = infile.readline()
-        self.nPositions = len(entry) - 1
-        # case where the entries end with a dash
-        if entry[-2] == 0:
-            nPositions -= 1
-        # allocate space for a double[][]
-        self.targetFrequencies = numpy.zeros([self.nPositions, 20], dtype = float)
-
-        # read entries
-        # 2/17 note: this has been modified to be ok with files that have unaligned positions, i.e. '-' in sequence
-        infile.seek(0)    # go back to the start
-        nEntries = numpy.zeros([self.nPositions], dtype = int)
-        thisEntry = ""
-        for line in infile:
-            if line[0] == '>':        # line starts w/ '>', indicating start of a new entry
-                if thisEntry == "":    # no entry to process
-                    pass
-                else:                # add the residues in this entry to the counts
-                    for i in range(self.nPositions):
-                        #print(thisEntry[i], end='');
-                        if thisEntry[i] != '-':    # only when there is a residue aligned here
-                            try:
-                                self.targetFrequencies[i][resToIndex[thisEntry[i]]] += 1
-                                nEntries[i] += 1
-                            except KeyError:    # non-single residue code. skip
-                                continue
-                    thisEntry = ""    # then clear it to read the next entry
-                    #print();
-            else:                    # middle of an entry, append this line
-                thisEntry += line
-        # counts to frequencies
-        for i in range(self.nPositions):
-            for j in range(20):
-                self.targetFrequencies[i][j] /= nEntries[i]
-
-        infile.close()
-
         # 2/17 added parts to allow for removal of superfluous positions
+        # only the picked columns are counted, they are picked while reading
+        columns = None
         if posPicker != None:
             self.contiguousPositions = False
-            indices = self.positionReindexerFASTA(posPicker)
-            self.nPositions = len(indices)
-            freqs = numpy.zeros([self.nPositions, 20])
-            for i in range(len(indices)):
-                freqs[i] = self.targetFrequencies[indices[i]]
-            self.targetFrequencies = freqs
+            columns = self.positionReindexerFASTA(posPicker)
             ## make the re-mapping indexer
             #for i in range(self.nPositions):
             #    self.positionMap[indices[i]] = i;
 
+        if weighting is None:
+            counts, nSequences = buildProfile(source, columns)
+        else:
+            counts, nSequences = buildWeightedProfile(source, columns, weighting, identityThreshold)
+        self.nPositions = counts.shape[0]
+
+        # counts to frequencies
+        nEntries = numpy.sum(counts, axis = 1, keepdims = True)
+        self.targetFrequencies = numpy.asarray(counts / nEntries, dtype = self.dtype)
         self.targetFreqsRead = True
         return numpy.array(self.targetFrequencies)
 
     # read raw macrostate data
     # TODO: change the file return type to file read return
-    def readData(self, source):
+    def readData(self, source, lazy=False, memoryBudget=None):
         """
-        Reads in a tab-delimited file of ensembles encoding macrostate data
+        Reads in a tab-delimited file of ensembles encoding macrostate data.
+        Lazily, the file is only scanned for where the lines of each combination of parameters are,
+        and a model is read when it is first looked up, see LazyModelLoader. Lazy models are not kept
+        in self.models, hand getModelLattice() to the search instead
 
         @param source    a string pointing to the location of the tab-delimited file
+        @param lazy        bool, read each model only when it is first looked up?
+        @param memoryBudget    int, optional, bytes lazily read models may take before the least recently used are dropped
         @return void
         """
         if not self.targetFreqsRead:
             warnings.warn("Hey, call the read target freqs functions first!", UserWarning)
 
-        # used to convert the input dict to an array
-        indexToRes = {0:'A', 1:'C', 2:'D', 3:'E', 4:'F', 5:'G', 6:'H', 7:'I', 8:'K', 9:'L', 10:'M', 11:'N', 12:'P', 13:'Q', 14:'R', 15:'S', 16:'T', 17:'V', 18:'W', 19:'Y'}
-
         # convert strings to manipulate-able values
         self.models.clear()
+        self.modelLattice = None
+        self.modelLoader = None
+        self.dataRead = ('macrostate', (source,), self.nPositions, tuple(sorted(self.macStateToIndex.items())), numpy.dtype(self.dtype).str)
+
+        if lazy:
+            self.modelLoader = LazyModelLoader(source, [1, 2, 3], 4, lambda fields: Optimizer.parseMacrostateParams(*fields), functools.partial(self.buildMacrostateModel, source=source), False, memoryBudget, nPositions=self.nPositions)
+            self.minPosition = self.modelLoader.firstPosition
+            return None
+
+        placeHolderWeights = numpy.array([0, 0, 0, 0])
+        placeHolderSteep = 1
+
+        # everything besides the file that changes what is read out of it
+        settings = ('macrostate', self.nPositions, tuple(sorted(self.macStateToIndex.items())), numpy.dtype(self.dtype).str)
+        if self.parsedDataCache is not None:
+            energies, index = self.parsedDataCache.load(source, settings)
+            if energies is not None:
+                self.minPosition = int(index['minPosition'])
+                for i in range(index['backrubTemps'].size):
+                    backrubT = float(index['backrubTemps'][i])
+                    ensembleS = int(index['ensembleSizes'][i])
+                    boltzmanT = float(index['boltzmannTemps'][i])
+                    model = Model(self.MACROSTATES, ensembleS, backrubT, boltzmanT, placeHolderWeights, placeHolderSteep, self.nPositions, self.minPosition, dtype=self.dtype)
+                    model.macrostateResidueEnergies = energies[i]
+                    self.models[Optimizer.calcParamsID(backrubT, ensembleS, boltzmanT)] = model
+                return None
 
-        infile = open(source, 'r')
-        isFirstLine = True
         isFirstEntry = True
         self.minPosition = 65535        # used for offsetting indices in Macrostate
 
+        # the first line is skipped since it's just column headers, the rest is parsed a chunk of lines at a time
+        for fields, energyChunk in readEnergyTable(source, 5):
+            # record minposition - assumes that the first entry is at first position
+            # TODO: fix this to actually find minimum position
+            if isFirstEntry:
+                self.minPosition = int(fields[4][0])
+                isFirstEntry = False
+            self.addMacrostateRows(fields, energyChunk, self.models)
+
+        if self.parsedDataCache is not None and len(self.models) > 0:
+            models = list(self.models.values())
+            index = {}
+            index['minPosition'] = self.minPosition
+            index['backrubTemps'] = numpy.array([m.backrubTemp for m in models], dtype = numpy.float64)
+            index['ensembleSizes'] = numpy.array([m.ensembleSize for m in models], dtype = int)
+            index['boltzmannTemps'] = numpy.array([m.boltzmannTemp for m in models], dtype = numpy.float64)
+            self.parsedDataCache.save(source, settings, numpy.stack([m.macrostateResidueEnergies for m in models]), index)
+        return None
+
+    def addMacrostateRows(self, fields, energyChunk, models):
+        """
+        Adds parsed lines of macrostate data to the models of their parameters, making the models as needed.
+        Lines of positions outside [minPosition, minPosition + nPositions) are skipped
+
+        @param fields        string[field][entry] of the identifier fields
+        @param energyChunk    double[entry][residue] of the energies
+        @param models        Map<string, Model> to add to
+        @return void
+        """
         placeHolderWeights = numpy.array([0, 0, 0, 0])
         placeHolderSteep = 1
-        for line in infile:
-            # ignore first line since they're just column headers
-            if isFirstLine:
-                isFirstLine = False
+        for j in range(energyChunk.shape[0]):
+            position = int(fields[4][j])
+            # skip superfluous positions
+            if position < self.minPosition or position >= self.minPosition + self.nPositions:
+                continue
+
+            macrostate = self.macStateToIndex[fields[0][j]]
+            backrubT, ensembleS, boltzmanT = Optimizer.parseMacrostateParams(fields[1][j], fields[2][j], fields[3][j])
+
+            # calc model ID from the strings because that's always unique
+            ID = Optimizer.calcParamsID(backrubT, ensembleS, boltzmanT)
+
+            # put this read into the internal small, colorful shells structure
+            if ID in models:
+                models[ID].addMacrostateData(macrostate, position, energyChunk[j])
             else:
-                entries = line.split('\t')        # entries: a list of strings
-                macrostate = entries[0]        # string
-                backrubT = entries[1]            # string
-                ensembleS = entries[2]            # string
-                boltzmanT = entries[3]            # string
-                position = entries[4]            # string
-                energies = ast.literal_eval(entries[5])        # ast.literal_eval converts a string to a dictionary
-
-                # now ints
-                macrostate = self.macStateToIndex[macrostate]
-                position = int(position)
-                ensembleS = int(ensembleS)
-
-                # record minposition - assumes that the first entry is at first position
-                # TODO: fix this to actually find minimum position
-                if isFirstEntry:
-                    self.minPosition = position
-                    isFirstEntry = False
-
-                # skip superfluous positions
-                if position < self.minPosition or position >= self.minPosition + self.nPositions:
-                    continue
-
-                # now doubles
-                backrubT = float(backrubT)
-                if boltzmanT == "min":    # account for the possible text values
-                    boltzmanT = 0.0
-                elif boltzmanT == "mean":
-                    boltzmanT = -1.0    # use -1 to represent inf - you can't really do math with numpy.inf
-                else:
-                    boltzmanT = float(boltzmanT)
-
-                # calc model ID from the strings because that's always unique
-                ID = Optimizer.calcParamsID(backrubT, ensembleS, boltzmanT)
-
-                # now an array
-                temp = numpy.zeros([20])
-                for i in range(20):
-                    temp[i] = energies[indexToRes[i]]
-                energies = temp
-
-                # put this read into the internal small, colorful shells structure
-                if ID in self.models:
-                    self.models[ID].addMacrostateData(macrostate, position, energies)
-                else:
-                    model = Model(self.MACROSTATES, ensembleS, backrubT, boltzmanT, placeHolderWeights, placeHolderSteep, self.nPositions, self.minPosition)
-                    model.addMacrostateData(macrostate, position, energies)
-                    self.models[ID] = model
-
-        infile.close()
+                model = Model(self.MACROSTATES, ensembleS, backrubT, boltzmanT, placeHolderWeights, placeHolderSteep, self.nPositions, self.minPosition, dtype=self.dtype)
+                model.addMacrostateData(macrostate, position, energyChunk[j])
+                models[ID] = model
         return None
 
+    # STATIC
+    def parseMacrostateParams(backrubT, ensembleS, boltzmanT):
+        """
+        Converts the parameter fields of a line of macrostate data
+
+        @param backrubT        string of the backrub temperature
+        @param ensembleS        string of the ensemble size
+        @param boltzmanT        string of the Boltzmann temperature, or min or mean
+        @return float backrub temperature, int ensemble size, float Boltzmann temperature
+        """
+        if boltzmanT == "min":    # account for the possible text values
+            boltzmanT = 0.0
+        elif boltzmanT == "mean":
+            boltzmanT = -1.0    # use -1 to represent inf - you can't really do math with numpy.inf
+        else:
+            boltzmanT = float(boltzmanT)
+        return float(backrubT), int(ensembleS), boltzmanT
+
+    def buildMacrostateModel(self, key, chunks, source):
+        """
+        Makes the model of one combination of parameters from its lines, for lazy reads
+
+        @param key            (float, int, float) backrub temperature, ensemble size and Boltzmann temperature
+        @param chunks        iterable of string[] of the lines of the combination
+        @param source        string of the file the lines are from
+        @return Model
+        """
+        models = {}
+        for lines in chunks:
+            fields, energyChunk = parseEnergyLines(lines, 5, source=source)
+            if fields is not None:
+                self.addMacrostateRows(fields, energyChunk, models)
+        if len(models) != 1:
+            raise ValueError("No data within the positions read for parameters " + str(key))
+        return list(models.values())[0]
+
     # read raw microstate data
-    def readMicrostateData(self, source:str, minPosition:int):
+    def readMicrostateData(self, source, minPosition:int, dtype=None, positions=None, chunkSize:int=65536, nProcesses:int=None, lazy=False, memoryBudget=None):
         """
         Reads in raw microstate data. Unlike readData(), this function does not assume anything
-        about the min position and it must be supplied manually
-
-        @param source        string of the input file
+        about the min position and it must be supplied manually.
+        The file is read a chunk of lines at a time, and lines of positions outside the model or of
+        macrostates that are not optimized are dropped before their energies are parsed, so only the
+        kept microstates are ever held in memory.
+        Data split in shards, e.g. one file per substate, is read in a pool of processes, one shard each,
+        and merged in the order of the shards, so the models are the same as reading the shards one after
+        the other. The parsed data cache is only used when there is a single file.
+        Lazily, a single file is only scanned for where the lines of each backrub temperature are, and a
+        model is read when it is first looked up, see readData()
+
+        @param source        string of the input file or of a glob pattern of shards, or string[] of shards
         @param minPosition    int of the lowest position number
+        @param dtype        numpy dtype to store the microstate energies in, numpy.float32 halves the memory used.
+                                Defaults to the precision of this optimizer
+        @param positions    int[], optional, position numbers to read, which must run from minPosition on without gaps
+                                as the model has no microstates for the others. The model and the target frequencies are
+                                cut to them. By default, all the positions of the target frequencies
+        @param chunkSize    int, number of lines read and parsed at once, bounds the memory used while reading
+        @param nProcesses    int, optional, number of processes reading shards. By default one per shard, up to one per core
+        @param lazy        bool, read each model only when it is first looked up?
+        @param memoryBudget    int, optional, bytes lazily read models may take before the least recently used are dropped
         @return void
         """
 
         if not self.targetFreqsRead:
             warnings.warn("Hey, call the read target freqs functions first!", UserWarning)
+        if dtype is None:
+            dtype = self.dtype
 
         self.models.clear()
+        self.modelLattice = None
+        self.modelLoader = None
         self.minPosition = minPosition
         maxPos = 0
-
-        indexToRes = {0:'A', 1:'C', 2:'D', 3:'E', 4:'F', 5:'G', 6:'H', 7:'I', 8:'K', 9:'L', 10:'M', 11:'N', 12:'P', 13:'Q', 14:'R', 15:'S', 16:'T', 17:'V', 18:'W', 19:'Y'}
-
-        infile = open(source, 'r')
+        wanted = numpy.arange(self.minPosition, self.minPosition + self.nPositions)
+        if positions is not None:
+            wanted = numpy.intersect1d(wanted, numpy.asarray(positions, dtype=int))
+            # the model spans minPosition up to the last position read, or all the positions if they are not trimmed
+            last = int(wanted[-1]) if self.contiguousPositions and wanted.size > 0 else self.minPosition + self.nPositions - 1
+            holes = numpy.setdiff1d(numpy.arange(self.minPosition, last + 1), wanted)
+            if wanted.size == 0 or holes.size > 0:
+                raise ValueError("Positions {:s} of the model are not read, positions must run from {:d} on without gaps".format(str(holes.tolist()), self.minPosition))
+            self.nPositions = last - self.minPosition + 1
+            self.targetFrequencies = self.targetFrequencies[:self.nPositions]
+        macrostateNames = sorted(self.macStateToIndex, key=lambda name: self.macStateToIndex[name])
+        sources = Optimizer.findShards(source)
+        self.dataRead = ('microstate', tuple(sources), self.nPositions, minPosition, tuple(wanted.tolist()), tuple(sorted(self.macStateToIndex.items())), numpy.dtype(dtype).str, numpy.dtype(self.dtype).str)
 
         placeHolderWeights = None
         placeHolderSteep = 0
         placeHolderBoltzmannT = 0
         placeHolderEnsemble = 0
 
-        n = 0
-        isFirstLine = True
-        #line = infile.readline()
-        #while true:
-        for line in infile:
-            # ignore first line since they're just column headers
-            if isFirstLine:
-                isFirstLine = False
-            else:
-                n += 1
-                entries = line.split('\t')
-                # print(entries)
-                macrostate = entries[0]
-                backrubT = entries[1]
-                position = int(entries[2])
-                #backbone = entries[3]
-                energies = ast.literal_eval(entries[4])
-
-                # skip superfluous positions
-                if position < self.minPosition or position >= self.minPosition + self.nPositions:
-                    print('skipping %d' % position)
-                    continue
-
-                # convert from string to useful data types
-                backrubT = float(backrubT)
-                macrostate = self.macStateToIndex[macrostate]
-                position = int(position)
-                temp = numpy.zeros([20])
-                for i in range(20):
-                    temp[i] = energies[indexToRes[i]]
-                energies = temp
-
-                if position > maxPos:
-                    maxPos = position
-                    print(maxPos)
+        if lazy:
+            if len(sources) != 1:
+                raise ValueError("Only a single file can be read lazily, not shards")
+            build = functools.partial(self.buildMicrostateModel, source=sources[0], nPositions=self.nPositions, positions=wanted, macrostateNames=macrostateNames, dtype=dtype)
+            self.modelLoader = LazyModelLoader(sources[0], [1], 2, lambda fields: (float(fields[0]), None, None), build, True, memoryBudget, minPosition=minPosition, nPositions=self.nPositions)
+            if self.contiguousPositions:
+                read = numpy.intersect1d(numpy.array(sorted(self.modelLoader.positions), dtype=int), wanted)
+                self.nPositions = (int(read[-1]) if read.size > 0 else 0) - minPosition + 1
+            return None
+
+        # everything besides the file that changes what is read out of it
+        positionMap = tuple(sorted(self.positionMap.items())) if self.positionMap is not None else None
+        settings = ('microstate', self.nPositions, minPosition, tuple(wanted.tolist()), positionMap, tuple(sorted(self.macStateToIndex.items())), numpy.dtype(dtype).str, numpy.dtype(self.dtype).str)
+        useCache = self.parsedDataCache is not None and len(sources) == 1
+        if useCache:
+            source = sources[0]
+            energies, index = self.parsedDataCache.load(source, settings)
+            if energies is not None:
+                rowStarts = numpy.cumsum(index['nRowsByModel']) - index['nRowsByModel']
+                for i in range(index['backrubTemps'].size):
+                    backrubT = float(index['backrubTemps'][i])
+                    model = Model(self.MACROSTATES, placeHolderEnsemble, backrubT, placeHolderBoltzmannT, placeHolderWeights, placeHolderSteep, self.nPositions, self.minPosition, True, self.positionMap, microstateDtype=dtype, dtype=self.dtype)
+                    model.setPackedMicrostateData(energies[rowStarts[i]:rowStarts[i] + index['nRowsByModel'][i]], index['microstateCounts'][i])
+                    self.models[Optimizer.calcParamsID(backrubT, None, None)] = model
+                self.nPositions = int(index['nPositions'])
+                return None
+
+        if nProcesses is None:
+            nProcesses = min(len(sources), os.cpu_count() or 1)
+        pool = None
+        if nProcesses <= 1 or len(sources) == 1:
+            # one shard after the other, streamed a chunk at a time
+            shards = [readMicrostateBlocks(shard, wanted, macrostateNames, chunkSize) for shard in sources]
+        else:
+            # every shard parsed whole in a worker, results are taken in the order of the shards
+            pool = ProcessPoolExecutor(max_workers=nProcesses)
+            shards = pool.map(readMicrostateShard, sources, itertools.repeat(wanted), itertools.repeat(macrostateNames), itertools.repeat(chunkSize), itertools.repeat(dtype))
 
+        try:
+            for backrubT, macrostates, positionBlock, energies in itertools.chain.from_iterable(shards):
+                backrubT = float(backrubT)
+                maxPos = max(maxPos, int(positionBlock.max()))
                 ID = Optimizer.calcParamsID(backrubT, None, None)
-                if ID in self.models:
-                    self.models[ID].addMicrostateData(macrostate, position, energies)
-                else:
-                    model = Model(self.MACROSTATES, placeHolderEnsemble, backrubT, placeHolderBoltzmannT, placeHolderWeights, placeHolderSteep, self.nPositions, self.minPosition, True, self.positionMap)
-                    model.addMicrostateData(macrostate, position, energies)
-                    self.models[ID] = model
+                if ID not in self.models:
+                    self.models[ID] = Model(self.MACROSTATES, placeHolderEnsemble, backrubT, placeHolderBoltzmannT, placeHolderWeights, placeHolderSteep, self.nPositions, self.minPosition, True, self.positionMap, microstateDtype=dtype, dtype=self.dtype)
+                self.models[ID].addMicrostateDataBlock(macrostates, positionBlock, energies)
+        finally:
+            if pool is not None:
+                pool.shutdown()
 
-            #line = infile.readline()
-            #if not line: # EOF
-            #    break
+        # lay the microstates out in contiguous blocks now that everything is read
+        for ID in self.models:
+            self.models[ID].packMicrostateData()
 
         if self.contiguousPositions:
             self.nPositions = maxPos - minPosition + 1
-        infile.close()
+
+        for ID in self.models:
+            empty = numpy.flatnonzero(numpy.any(self.models[ID].microstateCounts[:self.nPositions] == 0, axis=1))
+            if empty.size > 0:
+                warnings.warn("No microstates read for some macrostates at {:d} positions of the model with backrub temperature {:s}".format(empty.size, str(self.models[ID].backrubTemp)), UserWarning)
+
+        if useCache and len(self.models) > 0:
+            models = list(self.models.values())
+            index = {}
+            index['nPositions'] = self.nPositions
+            index['backrubTemps'] = numpy.array([m.backrubTemp for m in models], dtype = numpy.float64)
+            index['nRowsByModel'] = numpy.array([m.microstateResidueEnergies.shape[0] for m in models], dtype = int)
+            index['microstateCounts'] = numpy.stack([m.microstateCounts for m in models])
+            self.parsedDataCache.save(source, settings, numpy.concatenate([m.microstateResidueEnergies for m in models]), index)
         return None
 
+    def buildMicrostateModel(self, key, chunks, source, nPositions, positions, macrostateNames, dtype):
+        """
+        Makes the model of one backrub temperature from its lines, for lazy reads
+
+        @param key            (float, None, None) backrub temperature
+        @param chunks        iterable of string[] of the lines of the backrub temperature
+        @param source        string of the file the lines are from
+        @param nPositions    int, number of positions of the model
+        @param positions    int[] of the position numbers to read
+        @param macrostateNames    string[] of the macrostates to read, in index order
+        @param dtype        numpy dtype to store the microstate energies in
+        @return Model
+        """
+        isWanted = microstateFilter(positions, macrostateNames)
+        parsed = (parseEnergyLines(lines, 4, isWanted, source) for lines in chunks)
+        model = Model(self.MACROSTATES, 0, key[0], 0, None, 0, nPositions, self.minPosition, True, self.positionMap, microstateDtype=dtype, dtype=self.dtype)
+        for backrubT, macrostates, positionBlock, energies in splitMicrostateChunks((p for p in parsed if p[0] is not None), macrostateNames):
+            model.addMicrostateDataBlock(macrostates, positionBlock, energies)
+        model.packMicrostateData()
+        return model
+
+    # STATIC
+    def findShards(source):
+        """
+        Lists the files of a data set given as a file, a glob pattern or a list of files
+
+        @param source        string of a file or a glob pattern, or string[] of files
+        @return string[] of the files, glob matches sorted by name, lists in the order given
+        """
+        if isinstance(source, str):
+            if os.path.exists(source):
+                return [source]
+            sources = sorted(glob.glob(source))
+        else:
+            sources = list(source)
+        if len(sources) == 0:
+            raise FileNotFoundError("No data files match " + str(source))
+        return sources
+
     def positionReindexer(data:str):
         """
         Used to offset arbitrary positions to start with 0. Used when converting files.
@@ -367,7 +506,8 @@ class Optimizer(object):
     # TODO: change the return type to file write return val
     def writeFrequenciesToFASTA(self, frequencies:numpy.array, outFileName:str, precision:int=3):
         """
-        Writes the 2D residue frequencies to a FASTA file
+        Writes the 2D residue frequencies to a FASTA file, as 10**precision pseudo-sequences whose
+        residue counts are the frequencies. Lossy, see writeFrequenciesToNPY() for full precision
 
         @param frequencies        double[positio][residue] of relative frequencies
         @param outfile            string of output filename
@@ -378,26 +518,70 @@ class Optimizer(object):
             outFileName += ".fasta";
 
         try:
-            outfile = open(outFileName, 'w');
-        except FileExistsError:
-            print("Output file already exists\n");
+            writePseudoSequences(frequencies, outFileName, precision)
+        except OSError as e:
+            print("Could not write " + outFileName + ": " + str(e) + "\n");
             return 1
-        nEntries = numpy.power(10, precision);
-        numbers = numpy.round(frequencies * nEntries);
-        residueToWrite = numpy.zeros([self.nPositions], dtype = int);
-        #print(numbers);
-        residues = "ACDEFGHIKLMNPQRSTVWY";
-        for i in range(nEntries):
-            outfile.write("> Null\n");
-            for j in range(self.nPositions):
-                while numbers[j][residueToWrite[j]] == 0 and residueToWrite[j] < 19:
-                    residueToWrite[j] += 1;
-                numbers[j][residueToWrite[j]] -= 1;
-                outfile.write(residues[residueToWrite[j]]);
-            outfile.writelines("\n");
-        outfile.close();
         return 0;
 
+    def writeFrequenciesToNPY(self, frequencies:numpy.array, outFileName:str):
+        """
+        Writes the 2D residue frequencies to a binary .npy file, at full precision.
+        Read back with numpy.load()
+
+        @param frequencies        double[position][residue] of relative frequencies
+        @param outFileName        string of output filename
+        @return void
+        """
+        if outFileName.split('.')[-1] != 'npy':
+            outFileName += ".npy"
+        writeProfileNPY(frequencies, outFileName)
+
+    def writeFrequenciesToJSON(self, frequencies:numpy.array, outFileName:str, withParams:bool=True):
+        """
+        Writes the 2D residue frequencies to a JSON file, at full precision, along with the
+        residue order and the position numbers
+
+        @param frequencies        double[position][residue] of relative frequencies
+        @param outFileName        string of output filename
+        @param withParams         bool, also record the best parameters found?
+        @return void
+        """
+        if outFileName.split('.')[-1] != 'json':
+            outFileName += ".json"
+        extra = {}
+        if withParams:
+            bestVals = self.getBestParameters()
+            extra['params'] = {key: numpy.asarray(value).tolist() for key, value in bestVals.items()}
+        writeProfileJSON(frequencies, self.getPositionNumbers(), outFileName, **extra)
+
+    def writeFrequenciesToPSSM(self, frequencies:numpy.array, outFileName:str):
+        """
+        Writes the 2D residue frequencies to a position-specific frequency matrix text file, at full precision.
+        One row per position, one column per residue
+
+        @param frequencies        double[position][residue] of relative frequencies
+        @param outFileName        string of output filename
+        @return void
+        """
+        if outFileName.split('.')[-1] != 'pssm':
+            outFileName += ".pssm"
+        writeProfilePSSM(frequencies, self.getPositionNumbers(), outFileName)
+
+    def getPositionNumbers(self):
+        """
+        The position number of each row of the frequencies
+
+        @param void
+        @return int[nPositions]
+        """
+        if self.positionMap:
+            numbers = numpy.zeros(self.nPositions, dtype=int)
+            for position, index in self.positionMap.items():
+                numbers[index] = position
+            return numbers
+        return numpy.arange(self.nPositions) + self.minPosition
+
     def writeBestParamsToText(self, out:str):
         """
         Writes the best parameters found to a human-readable text file.
@@ -427,8 +611,41 @@ class Optimizer(object):
         outfile.write("Algorithm: {:s}\n".format(self.optimizationAlgorithm.__str__()));
         outfile.write("Similarity measure: {:s}\n".format(self.optimizationAlgorithm.similarityMeasure.__str__()));
         outfile.write("Elapsed time: {:s}\n".format(str(self.optimizationAlgorithm.elapsedTime)));
+        if self.optimizationAlgorithm.stopReason:
+            outfile.write("Stopped: {:s}\n".format(self.optimizationAlgorithm.stopReason));
         outfile.close();
 
+    def getTrace(self):
+        """
+        Returns the progress of the last search, one entry per recorded generation.
+        Keys:
+            'generation'
+            'best'
+            'mean'
+            'evaluations'
+            'seconds'
+
+        @param void
+        @return Map<string, number[]>
+        """
+        return self.optimizationAlgorithm.getTrace();
+
+    def writeTrace(self, outFileName:str):
+        """
+        Writes the progress of the last search to a tab-delimited file, one line per recorded generation.
+        Overwrites without warning.
+
+        @param outFileName        string of output filename
+        @return void
+        """
+        if outFileName.split('.')[-1] != 'tsv':
+            outFileName += ".tsv"
+        trace = self.getTrace()
+        with open(outFileName, 'w') as outfile:
+            outfile.write("generation\tbest\tmean\tevaluations\tseconds\n")
+            for i in range(trace['generation'].size):
+                outfile.write("{:d}\t{:.17g}\t{:.17g}\t{:d}\t{:.3f}\n".format(trace['generation'][i], trace['best'][i], trace['mean'][i], trace['evaluations'][i], trace['seconds'][i]))
+
     # generate a unique reproducible key for a combination of hyperparameters
     # hash or plaintext string?
     # STATIC
@@ -460,7 +677,57 @@ class Optimizer(object):
         @param param3            Boltzmann averaging temperature
         @return Model with specified params
         """
-        return self.models[Optimizer.calcParamsID(param1, param2, param3)];
+        return self.getModelLattice().getByParams(param1, param2, param3);
+
+    def getModelLattice(self):
+        """
+        The models read in, indexed by their discrete parameters
+
+        @param void
+        @return ModelLattice
+        """
+        if self.modelLattice is None:
+            self.modelLattice = ModelLattice(self.models, self.modelLoader)
+        return self.modelLattice
+
+    def useParsedDataCache(self, cache:ParsedDataCache):
+        """
+        Sets the cache of parsed data files used by readData() and readMicrostateData(). Set it
+        before reading data
+
+        @param cache        ParsedDataCache to use, or None to parse the data files on every read
+        @return void
+        """
+        self.parsedDataCache = cache
+
+    def getDataHash(self):
+        """
+        A hash of the content of the data files last read and of the settings they were read with,
+        that tells apart data that would give different matches for the same parameters
+
+        @param void
+        @return string of the hex digest
+        """
+        if self.dataRead is None:
+            raise ValueError("No data read yet")
+        contents = tuple([ParsedDataCache.hashFile(source) for source in self.dataRead[1]])
+        return hashlib.sha1(repr((self.dataRead[0], contents) + self.dataRead[2:]).encode('utf-8')).hexdigest()
+
+    def openEvaluationStore(self, path:str, tolerance:float=1e-6, maxEntries:int=4096):
+        """
+        Opens a persistent store of evaluated candidates for the data read, the target frequencies and
+        the similarity measure of the current search algorithm, and has the algorithm use it.
+        Use the same store file across runs on the same data to reuse earlier evaluations
+
+        @param path            string, path of the SQLite file
+        @param tolerance       float, resolution of the continuous parameters, see EvaluationCache
+        @param maxEntries      int, number of candidates also kept in memory
+        @return EvaluationStore
+        """
+        measure = self.optimizationAlgorithm.similarityMeasure
+        store = EvaluationStore(path, self.getDataHash(), EvaluationStore.hashArray(measure.targetFrequencies), type(measure).__name__ + ': ' + str(measure), tolerance, maxEntries)
+        self.optimizationAlgorithm.useEvaluationCache(store)
+        return store
 
     def useAlgorithm(self, algorithm:SearchAlgorithm):
         """
@@ -470,6 +737,9 @@ class Optimizer(object):
         @return void
         """
         self.optimizationAlgorithm = algorithm;
+        if self.modelLoader is not None:
+            # lazily read models are not in self.models, the search looks them up through the loader
+            algorithm.modelLattice = self.getModelLattice();
 
     def optimize(self):
         """
@@ -478,6 +748,10 @@ class Optimizer(object):
         @param void
         @return void
         """
+        if self.modelLoader is not None or self.optimizationAlgorithm.models is self.models:
+            # the lattice of the data read last, a search reused after another read would keep the old one
+            self.optimizationAlgorithm.modelLattice = self.getModelLattice();
+        self.optimizationAlgorithm.validateParamBounds();
         self.optimizationAlgorithm.iterate();
 
     def verifyFoundParams(self, ensembleSize, backrubT, boltzmannT, steepness, weights):
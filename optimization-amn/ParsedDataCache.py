@@ -0,0 +1,157 @@
+import numpy
+import hashlib
+import os
+import warnings
+
+class ParsedDataCache:
+	"""
+	A cache of parsed energy data files, kept as binary sidecar files. Parsing the tab-delimited data
+	calls ast.literal_eval on every line, so the first read of a file saves the parsed energies to an
+	.npy file and everything else (counts, the model parameter lattice) to an .npz index, and later reads
+	of the same file with the same read settings load those instead. The energies are memory-mapped
+	read-only, so jobs reading the same file on one node share the page cache instead of each holding
+	a private copy.
+
+	Sidecars are named after the source's absolute path and the read settings, and are only used
+	while the source's size, modification time and content hash match the ones recorded with them.
+	They are written to a temporary name and then renamed, so concurrent jobs never see half a file.
+	"""
+
+	cacheDir = None;		# directory to keep the sidecars in, None to keep them next to their source
+	verifyHash = True;		# also compare content hashes on load, and not only size and modification time
+	hits = 0;
+	misses = 0;
+
+	def __init__(self, cacheDir:str = None, verifyHash:bool = True):
+		"""
+		Default constructor
+
+		@param cacheDir		string, optional, directory to keep the sidecars in. By default they are kept next to their source
+		@param verifyHash	bool, hash the source on every load? Costs one pass over the raw file, which is
+								still much cheaper than parsing it
+		"""
+		self.cacheDir = cacheDir;
+		self.verifyHash = verifyHash;
+		self.hits = 0;
+		self.misses = 0;
+
+	# PRIVATE
+	def getPaths(self, source:str, settings:tuple) -> (str, str):
+		"""
+		Where the sidecars of a source read with a set of settings are kept
+
+		@param source		string, path of the raw data file
+		@param settings		tuple of everything besides the file that changes what is parsed out of it
+		@return string path of the energies .npy, string path of the index .npz
+		"""
+		source = os.path.abspath(source);
+		digest = hashlib.sha1(repr((source, settings)).encode('utf-8')).hexdigest()[:16];
+		directory = self.cacheDir if self.cacheDir is not None else os.path.dirname(source);
+		base = os.path.join(directory, os.path.basename(source) + '.' + digest);
+		return base + '.npy', base + '.npz';
+
+	# STATIC
+	def hashFile(source:str) -> str:
+		"""
+		SHA-1 of a file's content
+
+		@param source		string, path of the file
+		@return string of the hex digest
+		"""
+		digest = hashlib.sha1();
+		with open(source, 'rb') as infile:
+			for block in iter(lambda : infile.read(1 << 20), b''):
+				digest.update(block);
+		return digest.hexdigest();
+
+	def load(self, source:str, settings:tuple) -> (numpy.array, {}):
+		"""
+		Loads the parsed data of a source, if it is cached and still up to date
+
+		@param source		string, path of the raw data file
+		@param settings		tuple of everything besides the file that changes what is parsed out of it
+		@return numpy.array of the energies memory-mapped read-only and Map<string, numpy.array> of the index,
+				or None, None if there is no up to date sidecar
+		"""
+		energiesPath, indexPath = self.getPaths(source, settings);
+		try:
+			with numpy.load(indexPath) as index:
+				index = dict(index);
+			stat = os.stat(source);
+			if int(index['size']) != stat.st_size or int(index['mtime']) != stat.st_mtime_ns:
+				raise ValueError("stale");
+			if self.verifyHash and str(index['hash']) != ParsedDataCache.hashFile(source):
+				raise ValueError("stale");
+			energies = numpy.load(energiesPath, mmap_mode = 'r');
+			if energies.shape[0] != int(index['nRows']):		# energies from a different write than the index
+				raise ValueError("stale");
+		except (OSError, KeyError, ValueError):
+			self.misses += 1;
+			return None, None;
+
+		self.hits += 1;
+		return energies, index;
+
+	def save(self, source:str, settings:tuple, energies:numpy.array, index:{}) -> None:
+		"""
+		Saves the parsed data of a source. Failing to write, e.g. to a read-only directory, only warns
+
+		@param source		string, path of the raw data file
+		@param settings		tuple of everything besides the file that changes what is parsed out of it
+		@param energies		numpy.array of the parsed energies, rows are indexed by the index
+		@param index		Map<string, numpy.array> of everything else needed to rebuild the models
+		@return void
+		"""
+		energiesPath, indexPath = self.getPaths(source, settings);
+		stat = os.stat(source);
+		index = dict(index);
+		index['path'] = os.path.abspath(source);
+		index['size'] = stat.st_size;
+		index['mtime'] = stat.st_mtime_ns;
+		index['hash'] = ParsedDataCache.hashFile(source);
+		index['nRows'] = energies.shape[0];
+
+		try:
+			# energies first, the index only appears once they are complete
+			ParsedDataCache.writeAtomic(energiesPath, lambda outfile : numpy.save(outfile, energies));
+			ParsedDataCache.writeAtomic(indexPath, lambda outfile : numpy.savez(outfile, **index));
+		except OSError as e:
+			warnings.warn("Could not write the parsed data cache of " + source + ": " + str(e), UserWarning);
+		return None;
+
+	# STATIC
+	def writeAtomic(path:str, write) -> None:
+		"""
+		Writes a file under a temporary name then renames it into place
+
+		@param path		string, final path of the file
+		@param write	function(file) that writes the content
+		@return void
+		"""
+		tempPath = path + '.' + str(os.getpid()) + '.tmp';
+		try:
+			with open(tempPath, 'wb') as outfile:
+				write(outfile);
+			os.replace(tempPath, path);
+		finally:
+			if os.path.exists(tempPath):
+				os.remove(tempPath);
+		return None;
+
+	def getStats(self) -> {}:
+		"""
+		Returns the cache counters.
+		Keys:
+			'hits'
+			'misses'
+
+		@param void
+		@return Map<string, int>
+		"""
+		stats = {};
+		stats['hits'] = self.hits;
+		stats['misses'] = self.misses;
+		return stats;
+
+	def __str__(self, **kwargs):
+		return "Parsed data cache in {:s}, hits/misses: {:d}/{:d}".format(self.cacheDir if self.cacheDir is not None else "the source directories", self.hits, self.misses);
@@ -0,0 +1,97 @@
+from EnergyTableParser import RESIDUES
+import numpy
+import json
+
+def pseudoSequences(frequencies:numpy.array, precision:int = 3) -> numpy.array:
+	"""
+	Encodes a profile as 10**precision pseudo-sequences whose residue counts at each position are the
+	frequencies rounded to that precision. Sequence i gets, at each position, the residue whose
+	cumulative count first exceeds i, so residues fill the sequences in order. When the rounded counts
+	of a position add up to less than 10**precision, the remaining sequences get the last residue (Y),
+	and when they add up to more, the extra counts of the last residues are dropped
+
+	@param frequencies	double[position][residue] of relative frequencies
+	@param precision	int, number of places behind the decimal point
+	@return uint8[sequence][position] of ASCII residue letters
+	"""
+	nEntries = 10 ** precision;
+	cumulative = numpy.cumsum(numpy.round(frequencies * nEntries), axis = 1);
+	nPositions = cumulative.shape[0];
+	# the residue of sequence i at a position is the number of cumulative counts <= i. Offsetting each
+	# position past the values of the previous one makes all positions one sorted array, searched at once
+	spacing = max(cumulative.max(initial = 0), nEntries) + 1;
+	offsets = numpy.arange(nPositions) * spacing;
+	queries = numpy.arange(nEntries)[:, None] + offsets;
+	codes = numpy.searchsorted((cumulative + offsets[:, None]).ravel(), queries.ravel(), side = 'right').reshape(nEntries, nPositions);
+	codes -= numpy.arange(nPositions) * len(RESIDUES);
+	numpy.minimum(codes, len(RESIDUES) - 1, out = codes);
+	return numpy.frombuffer(RESIDUES.encode('ascii'), dtype = numpy.uint8)[codes];
+
+def writePseudoSequences(frequencies:numpy.array, outFileName:str, precision:int = 3) -> None:
+	"""
+	Writes a profile as pseudo-sequences to a FASTA file, see pseudoSequences()
+
+	@param frequencies	double[position][residue] of relative frequencies
+	@param outFileName	string of output filename
+	@param precision	int, number of places behind the decimal point
+	@return void
+	"""
+	letters = pseudoSequences(frequencies, precision);
+	# each record is the header then the sequence then a newline, built as one block of bytes
+	header = numpy.frombuffer(b"> Null\n", dtype = numpy.uint8);
+	records = numpy.empty([letters.shape[0], header.size + letters.shape[1] + 1], dtype = numpy.uint8);
+	records[:, :header.size] = header;
+	records[:, header.size:-1] = letters;
+	records[:, -1] = ord('\n');
+	with open(outFileName, 'wb') as outfile:
+		outfile.write(records.tobytes());
+	return None;
+
+def writeProfileNPY(frequencies:numpy.array, outFileName:str) -> None:
+	"""
+	Writes a profile as a binary .npy array, at full precision
+
+	@param frequencies	double[position][residue] of relative frequencies
+	@param outFileName	string of output filename
+	@return void
+	"""
+	numpy.save(outFileName, numpy.asarray(frequencies));
+	return None;
+
+def writeProfileJSON(frequencies:numpy.array, positions:"int[]", outFileName:str, **extra) -> None:
+	"""
+	Writes a profile as JSON: the residue order, the position numbers and a list of frequencies per position.
+	Floats are written with repr(), which reads back to the same value
+
+	@param frequencies	double[position][residue] of relative frequencies
+	@param positions	int[] of the position number of each row
+	@param outFileName	string of output filename
+	@param extra		anything else to record alongside, e.g. the parameters the profile was found with
+	@return void
+	"""
+	profile = dict(extra);
+	profile['residues'] = RESIDUES;
+	profile['positions'] = [int(p) for p in positions];
+	profile['frequencies'] = numpy.asarray(frequencies, dtype = numpy.float64).tolist();
+	with open(outFileName, 'w') as outfile:
+		json.dump(profile, outfile);
+	return None;
+
+def writeProfilePSSM(frequencies:numpy.array, positions:"int[]", outFileName:str) -> None:
+	"""
+	Writes a profile as a position-specific frequency matrix in text: a header row of residues, then one
+	whitespace-delimited row per position, starting with its number. Floats are written with 17
+	significant digits, which reads back to the same double
+
+	@param frequencies	double[position][residue] of relative frequencies
+	@param positions	int[] of the position number of each row
+	@param outFileName	string of output filename
+	@return void
+	"""
+	frequencies = numpy.asarray(frequencies, dtype = numpy.float64);
+	lines = ["pos\t" + '\t'.join(RESIDUES) + "\n"];
+	for i in range(frequencies.shape[0]):
+		lines.append(str(int(positions[i])) + '\t' + '\t'.join(["{:.17g}".format(f) for f in frequencies[i]]) + "\n");
+	with open(outFileName, 'w') as outfile:
+		outfile.writelines(lines);
+	return None;
@@ -0,0 +1,176 @@
+from SearchAlgorithm import SearchAlgorithm
+from SimilarityMeasure import SimilarityMeasure
+from ModelView import ModelView
+from model import calcFrequencyJacobians
+from BoltzmannTable import boltzmannAverage, boltzmannAverageDerivative
+from datetime import *
+import numpy
+import scipy.optimize
+
+class QuasiNewtonSearch(SearchAlgorithm):
+	"""
+	Multi-start bounded quasi-Newton search (L-BFGS-B) on the continuous parameters.
+	Each start draws the discrete parameters (ensemble size, backrub temperature and, when it is not
+	searched on a continuous range, the Boltzmann temperature) and a picked ensemble at random,
+	then follows the analytic gradient of the similarity measure in the weights, the steepness
+	and the continuous Boltzmann temperature.
+	The similarity measure must implement getSimilarityGradient()
+	"""
+
+	nStarts = 16;				# number of random starting points
+	nEvaluations = 0;			# number of objective and gradient evaluations used by the last search
+	minBoltzmannTemp = 0.01;	# lower bound on continuous Boltzmann temperatures, the min endpoint (0) is not differentiable
+
+	def __init__(self, models, similarityMeasure:SimilarityMeasure, continuousBoltzmann:bool, nStarts:int = 16):
+		"""
+		Default constructor
+
+		@param models				a Map<hyperParams, models>
+		@param similarityMeasure	a SimilarityMeasure object that implements getSimilarityGradient()
+		@param continuousBoltzmann	bool, whether the Boltzmann temperature is searched on a continuous range
+		@param nStarts				int, number of random starting points. maxIterations caps the iterations of each start
+		"""
+		super().__init__(models, similarityMeasure, continuousBoltzmann);
+		self.nStarts = nStarts;
+		self.nEvaluations = 0;
+
+	# PRIVATE
+	def getBounds(self) -> [(float, float)]:
+		"""
+		Bounds on the searched continuous parameters, in the order they are packed:
+		searched weights, then steepness, then Boltzmann temperature
+
+		@param void
+		@return (float, float)[] of {lower bound, upper bound}
+		"""
+		bounds = [(self.weightMins[i], self.weightMaxs[i]) for i in range(self.weightMins.size) if self.searchWeights[i]];
+		if self.searchSteepness:
+			bounds.append((self.steepnessRange[0], self.steepnessRange[1]));
+		if self.continuousBoltzmann and self.searchBoltzmann:
+			bounds.append((max(self.boltzmannTemps[0], self.minBoltzmannTemp), self.boltzmannTemps[1]));
+		return bounds;
+
+	# PRIVATE
+	def unpackParams(self, x:numpy.array, boltzmannTemp:float) -> (numpy.array, float, float):
+		"""
+		Splits a vector of searched parameters back into weights, steepness and Boltzmann temperature.
+		Parameters that are not searched are set to their preset value
+
+		@param x				float[] of searched parameters, see getBounds()
+		@param boltzmannTemp	float, Boltzmann temperature to use when it is not in x
+		@return float[] weights, float steepness, float Boltzmann temperature
+		"""
+		searched = numpy.array(self.searchWeights, dtype = bool);
+		weights = numpy.array(self.weightMins, dtype = numpy.float64);
+		i = numpy.count_nonzero(searched);
+		weights[searched] = x[:i];
+		steepness = self.steepnessRange[0];
+		if self.searchSteepness:
+			steepness = x[i];
+			i += 1;
+		if self.continuousBoltzmann and self.searchBoltzmann:
+			boltzmannTemp = x[i];
+		return weights, steepness, boltzmannTemp;
+
+	# PRIVATE
+	def calcSimilarityAndGradient(self, x:numpy.array, template, selectedEnergies:numpy.array, boltzmannTemp:float) -> (float, numpy.array):
+		"""
+		Objective handed to the optimizer: minus the similarity and its gradient w.r.t. x
+
+		@param x					float[] of searched parameters, see getBounds()
+		@param template				Model holding the data
+		@param selectedEnergies		double[position][residue energy][macrostate][microstate] of the picked ensemble, None for macrostate data
+		@param boltzmannTemp		float, Boltzmann temperature to use when it is not in x
+		@return float, float[]
+		"""
+		self.nEvaluations += 1;
+		weights, steepness, boltzmannTemp = self.unpackParams(x, boltzmannTemp);
+		energies, energiesDerivative = self.calcEnergies(template, selectedEnergies, boltzmannTemp);
+		with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+			frequencies, dWeights, dSteepness, dBoltzmann = calcFrequencyJacobians(energies, weights, steepness, energiesDerivative);
+		if not numpy.all(numpy.isfinite(frequencies)):
+			# every fitness is 1 when all weights are 0, the odds are undefined there. Tell the line search to back off
+			return numpy.inf, numpy.zeros(x.size);
+
+		similarity = self.similarityMeasure.getSimilarityMeasure(frequencies);
+		dSimilarity = self.similarityMeasure.getSimilarityGradient(frequencies);
+		grad = list(numpy.einsum('pr,prm->m', dSimilarity, dWeights)[numpy.array(self.searchWeights, dtype = bool)]);
+		if self.searchSteepness:
+			grad.append(numpy.sum(dSimilarity * dSteepness));
+		if self.continuousBoltzmann and self.searchBoltzmann:
+			grad.append(numpy.sum(dSimilarity * dBoltzmann));
+		return -similarity, -numpy.array(grad, dtype = numpy.float64);
+
+	# PRIVATE
+	def calcEnergies(self, template, selectedEnergies:numpy.array, boltzmannTemp:float) -> (numpy.array, numpy.array):
+		"""
+		Averaged energies at a Boltzmann temperature and, when the temperature is searched, their derivative
+
+		@param template				Model holding the data
+		@param selectedEnergies		double[position][residue energy][macrostate][microstate] of the picked ensemble, None for macrostate data
+		@param boltzmannTemp		float, Boltzmann temperature
+		@return double[position][residue energy][macrostate] energies, and their derivative w.r.t. the temperature or None
+		"""
+		if selectedEnergies is None:
+			return template.macrostateResidueEnergies, None;
+		energies = boltzmannAverage(selectedEnergies, boltzmannTemp, template.useAltAveragingMethod);
+		energiesDerivative = None;
+		if self.continuousBoltzmann and self.searchBoltzmann:
+			energiesDerivative = boltzmannAverageDerivative(selectedEnergies, boltzmannTemp, template.useAltAveragingMethod);
+		return energies, energiesDerivative;
+
+	def iterate(self) -> None:
+		start = datetime.now();
+		self.bestMatchVal = 0;
+		self.nEvaluations = 0;
+		bounds = self.getBounds();
+		if not self.suppressOutputs:
+			print("going for {:d} starts".format(self.nStarts));
+
+		for i in range(self.nStarts):
+			# rand discrete params
+			ensembleSize = self.ensembleSizes[numpy.random.randint(0, self.ensembleSizes.size)] if self.searchEnsemble else self.ensembleSizes[0];
+			backrubTemp = self.backrubTemps[numpy.random.randint(0, self.backrubTemps.size)] if self.searchBackrub else self.backrubTemps[0];
+			if not self.continuousBoltzmann:
+				boltzmannTemp = self.boltzmannTemps[numpy.random.randint(0, self.boltzmannTemps.size)] if self.searchBoltzmann else self.boltzmannTemps[0];
+				template = self.getModelByParams(backrubTemp, ensembleSize, boltzmannTemp);
+			else:
+				boltzmannTemp = self.boltzmannTemps[0];
+				template = self.getModelByParams(backrubTemp, None, None);
+
+			selectedEnergies = None;
+			if template.useMicrostateData:
+				microstatesUsed, selectedEnergies = template.selectMicrostates(ensembleSize, numpy.random);
+
+			# rand continuous starting point within the bounds
+			x0 = numpy.array([numpy.random.uniform(low, high) for low, high in bounds]);
+			result = scipy.optimize.minimize(self.calcSimilarityAndGradient, x0, args = (template, selectedEnergies, boltzmannTemp), jac = True, method = 'L-BFGS-B', bounds = bounds, options = {'maxiter': self.maxIterations});
+			weights, steepness, boltzmannTemp = self.unpackParams(result.x, boltzmannTemp);
+
+			# keep the picked ensemble and its averaged energies so the result can be reproduced
+			m = ModelView(template, ensembleSize, backrubTemp, boltzmannTemp, weights, steepness, None, None, self.sigmoidCache);
+			m.macrostatesUsed = self.searchWeights;
+			if selectedEnergies is not None:
+				m.microstatesUsed = microstatesUsed;
+				m.areMicrostatesPicked = True;
+			m.macrostateResidueEnergies = self.calcEnergies(template, selectedEnergies, boltzmannTemp)[0];
+			m.recovery = self.similarityMeasure.getSimilarityMeasure(m.getFrequencies());
+			if m.recovery > self.bestMatchVal:
+				self.recordBestParams(m);
+			if not self.suppressOutputs:
+				print("start {:d}: {:.6f} after {:d} iterations".format(i, m.recovery, result.nit));
+
+		self.elapsedTime = datetime.now() - start;
+
+	# PRIVATE
+	def recordBestParams(self, m:ModelView) -> None:
+		self.bestBackrubTemp = m.getBackrubTemp();
+		self.bestBoltzmannTemp = m.getBoltzmannTemp();
+		self.bestEnsembleSize = m.getEnsembleSize();
+		self.bestSteepness = m.getSteepness();
+		self.bestWeights = m.getWeights();
+		self.bestFrequencies = m.getFrequencies();
+		self.bestMatchVal = m.recovery;
+
+	def __str__(self, **kwargs):
+		return "Quasi-Newton search (L-BFGS-B), starts: {:d}, iterations per start: {:d}, evaluations: {:d}".format(self.nStarts, self.maxIterations, self.nEvaluations);
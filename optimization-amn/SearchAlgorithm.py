@@ -1,5 +1,10 @@
 from SimilarityMeasure import SimilarityMeasure
+from EnsembleCache import EnsembleCache
+from SigmoidCache import SigmoidCache
+from EvaluationCache import EvaluationCache
 from model import Model
+from ModelLattice import ModelLattice
+from ModelView import ModelView
 from enumeration import enum
 from datetime import *
 import numpy
@@ -11,6 +16,7 @@ class SearchAlgorithm:
 	#optimizer = Optimizer();					# the optimizer with this this instance is associated
 	#similarityMeasure = SimilarityMeasure();	# a SimilarityMeasure object used to calculate the fitness of models
 	models = {};								# Map<hyperparams, models>
+	modelLattice = None;						# ModelLattice of the models, built on first lookup
 	maxIterations = 1024;						# hard cap on number of iterations before termination
 	
 	elapsedTime = datetime.now();	# how long the search took
@@ -46,22 +52,53 @@ class SearchAlgorithm:
 	# print things to console?
 	suppressOutputs = False;
 
+	# when to stop before maxIterations, see setStoppingRules()
+	patience = None;			# number of generations without improvement of the best match to stop after, None to never
+	tolerance = 0.0;			# relative gain of the best match that counts as an improvement
+	timeBudget = None;			# timedelta the search may run for, None for no limit
+	evaluationBudget = None;	# number of candidates the search may evaluate, None for no limit
+	nEvaluations = 0;			# number of candidates evaluated by the last search
+	stopReason = '';			# why the last search stopped
+	trace = [];					# (generation, best match, mean match, evaluations, seconds)[] of the last search
+	searchStart = None;			# datetime the last search started
+	lastImprovement = 0;		# generation of the last improvement of the best match
+	improvementReference = 0;	# best match at the last improvement
+
+	# sharing of picked microstate ensembles between models, see useEnsembleCache()
+	ensembleCache = None;
+	nEnsembleSeeds = 0;
+	sigmoidCache = None;		# reuse of the weight independent part of the fitness, see useSigmoidCache()
+	evaluationCache = None;		# memo of the matches of candidates, see useEvaluationCache()
+	usesEvaluationCache = False;	# does iterate() consult the evaluation cache? Searches that do set this
+
 	def __init__(self, models = None, similarityMeasure:SimilarityMeasure = None, continuousBoltzmann:bool = False):
 		"""
 		Default constructor
 
-		@param models				Map<string, model> of a set of Model objects holding the data read in
+		@param models				Map<string, model> of a set of Model objects holding the data read in, or a ModelLattice of them
 		@param similarityMeasure	the similarity measure to use
 		@param continuousBoltzmann	whether to the boltzmann averagin search is contiuous or discrete
 		"""
 		self.similarityMeasure = similarityMeasure;
 		self.models = models;
+		self.modelLattice = models if isinstance(models, ModelLattice) else None;
 		self.continuousBoltzmann = continuousBoltzmann;
 		self.searchEnsemble = True;
 		self.searchBackrub = True;
 		self.searchBoltzmann = True;
 		self.searchSteepness = True;
 		self.suppressOutputs = False;
+		self.ensembleCache = None;
+		self.nEnsembleSeeds = 0;
+		self.sigmoidCache = None;
+		self.evaluationCache = None;
+		self.patience = None;
+		self.tolerance = 0.0;
+		self.timeBudget = None;
+		self.evaluationBudget = None;
+		self.nEvaluations = 0;
+		self.stopReason = '';
+		self.trace = [];
 
 		#self.optimizer = optimizer;
 
@@ -100,6 +137,148 @@ class SearchAlgorithm:
 	def getContinuousBoltzmann(self) -> bool:
 		return self.continuousBoltzmann;
 
+	def useEnsembleCache(self, cache:EnsembleCache, nSeeds:int) -> None:
+		"""
+		Shares picked microstate ensembles and averaged energies between the models of this search.
+		Each new microstate model picks its ensemble with one of nSeeds seeds, so models with the same
+		discrete parameters and seed reuse each other's work. Fewer seeds mean more reuse but less
+		variety in the ensembles tried
+
+		@param cache		EnsembleCache to use, or None to go back to picking every ensemble privately
+		@param nSeeds		int, number of distinct seeds to pick ensembles with
+		@return void
+		"""
+		self.ensembleCache = cache;
+		self.nEnsembleSeeds = nSeeds;
+
+	def useSigmoidCache(self, cache:SigmoidCache) -> None:
+		"""
+		Sets the cache of sigmoid terms shared between the candidates of this search. It only pays
+		off when candidates share a steepness and energies, e.g. on a grid or when the steepness is not
+		searched, so no cache is used by default. Microstate candidates only share energies through an
+		ensemble cache
+
+		@param cache		SigmoidCache to use, or None to calculate every fitness in full
+		@return void
+		"""
+		self.sigmoidCache = cache;
+
+	def useEvaluationCache(self, cache:EvaluationCache) -> None:
+		"""
+		Sets a memo of the matches and frequencies of candidates, so that candidates repeating one
+		evaluated before are not evaluated again. Off by default. Searches running in worker processes
+		use a copy of the cache each, and its counters here only cover this process
+
+		@param cache		EvaluationCache to use, or None to evaluate every candidate
+		@return void, raises ValueError if this search does not consult a cache
+		"""
+		if cache is not None and not self.usesEvaluationCache:
+			raise ValueError(type(self).__name__ + " does not use an evaluation cache");
+		self.evaluationCache = cache;
+
+	def getCacheStats(self) -> {}:
+		"""
+		Returns the counters of the caches used by this search.
+		Keys, for the caches in use:
+			'evaluation'	see EvaluationCache.getStats()
+			'sigmoid'		see SigmoidCache.getStats()
+			'ensemble'		see EnsembleCache.getStats()
+
+		@param void
+		@return Map<string, Map<string, number>>
+		"""
+		stats = {};
+		if self.evaluationCache is not None:
+			stats['evaluation'] = self.evaluationCache.getStats();
+		if self.sigmoidCache is not None:
+			stats['sigmoid'] = self.sigmoidCache.getStats();
+		if self.ensembleCache is not None:
+			stats['ensemble'] = self.ensembleCache.getStats();
+		return stats;
+
+	def setStoppingRules(self, patience:int = None, tolerance:float = 0.0, timeBudget = None, evaluationBudget:int = None) -> None:
+		"""
+		Sets rules to stop the search before maxIterations, whichever is met first. Searches check them
+		once per generation, so a budget can be overrun by up to a generation
+
+		@param patience				int, optional, stop after this many generations without improvement of the best match
+		@param tolerance			float, relative gain of the best match that counts as an improvement, e.g. 1e-4
+		@param timeBudget			float seconds or timedelta, optional, wall-clock time the search may run for
+		@param evaluationBudget		int, optional, number of candidates the search may evaluate
+		@return void
+		"""
+		if patience is not None and patience < 1:
+			raise ValueError("Patience must be at least one generation, not {:d}".format(patience));
+		if tolerance < 0:
+			raise ValueError("Tolerance cannot be negative");
+		self.patience = patience;
+		self.tolerance = tolerance;
+		self.timeBudget = timedelta(seconds = timeBudget) if timeBudget is not None and not isinstance(timeBudget, timedelta) else timeBudget;
+		self.evaluationBudget = evaluationBudget;
+		return None;
+
+	# PRIVATE
+	def startTrace(self, start:datetime) -> None:
+		"""
+		Resets the trace and the stopping rule counters, at the start of a search
+
+		@param start	datetime the search started
+		@return void
+		"""
+		self.searchStart = start;
+		self.trace = [];
+		self.stopReason = "reached {:d} iterations".format(self.maxIterations);
+		self.lastImprovement = 0;
+		self.improvementReference = 0;
+		return None;
+
+	# PRIVATE
+	def recordGeneration(self, generation:int, meanMatch:float) -> bool:
+		"""
+		Adds a generation to the trace and checks the stopping rules
+
+		@param generation	int, number of generations done, 0 for the initial population
+		@param meanMatch	float, mean match of the population
+		@return bool, should the search stop?
+		"""
+		elapsed = datetime.now() - self.searchStart;
+		self.trace.append((generation, float(self.bestMatchVal), float(meanMatch), self.nEvaluations, elapsed.total_seconds()));
+		if len(self.trace) == 1 or self.bestMatchVal > self.improvementReference + self.tolerance * abs(self.improvementReference):
+			self.lastImprovement = generation;
+			self.improvementReference = self.bestMatchVal;
+
+		if self.patience is not None and generation - self.lastImprovement >= self.patience:
+			self.stopReason = "no improvement in {:d} generations".format(generation - self.lastImprovement);
+		elif self.timeBudget is not None and elapsed >= self.timeBudget:
+			self.stopReason = "ran out of time after {:s}".format(str(elapsed));
+		elif self.evaluationBudget is not None and self.nEvaluations >= self.evaluationBudget:
+			self.stopReason = "ran out of evaluations after {:d}".format(self.nEvaluations);
+		else:
+			return False;
+		return True;
+
+	def getTrace(self) -> {}:
+		"""
+		Returns the progress of the last search, one entry per recorded generation.
+		Keys:
+			'generation'
+			'best'			best match so far
+			'mean'			mean match of the population
+			'evaluations'	candidates evaluated so far
+			'seconds'		time since the search started
+
+		@param void
+		@return Map<string, number[]>
+		"""
+		columns = numpy.array(self.trace, dtype = numpy.float64).reshape(-1, 5);
+		trace = {};
+		trace['generation'] = columns[:, 0].astype(int);
+		trace['best'] = columns[:, 1];
+		trace['mean'] = columns[:, 2];
+		trace['evaluations'] = columns[:, 3].astype(int);
+		trace['seconds'] = columns[:, 4];
+		return trace;
+
 	def setParamBounds(self, ensembleSizes:"int[]", backrubTemps:"float[]", boltzmannTemps:"float[]", steepnessRange:"float[]", weightMins:"float[]", weightMaxs:"float[]") -> None:
 		"""
 		Sets the bounds on the parameter space to search through
@@ -177,9 +356,10 @@ class SearchAlgorithm:
 		"""
 		Check whether a new Boltzmann averaging temp is in the bounds
 		If it is out of bounds, trim to the bound
-		Should only be used when searching on a continuous range
+		Should only be used when searching on a continuous range.
+		Also takes an array of temps, and checks each of them
 
-		@param newBoltzmann		value to check against the bounds
+		@param newBoltzmann		value or float[] of values to check against the bounds
 		@return float	the input value if it's within bounds or a corrected value if not
 		"""
 		# validate that this function should be used
@@ -187,72 +367,115 @@ class SearchAlgorithm:
 			raise AssertionError("This search is not on a continuous range of Boltzmann averaging temps");
 			return None; # in the unlikely event that the call was in a try block, return a null to make sure that things still screw up down the line
 
-		elif not self.searchBoltzmann:
-			return self.boltzmannTemps[0];
-		elif newBoltzmann < -1:						# less than inf
-			return self.boltzmannTemps[1];
-		elif newBoltzmann == 0:						# force move away from 0
-			return self.boltzmannTemps[0];
-		elif newBoltzmann < self.boltzmannTemps[0]: # lower than lower bound set to 0 - min boltzmann
-			return 0;
-		elif newBoltzmann > self.boltzmannTemps[1]:	# higher than higher bound set to -1 - inf
-			return -1;
-		else:
-			return newBoltzmann;
+		newBoltzmann = numpy.asarray(newBoltzmann, dtype = numpy.float64);
+		if not self.searchBoltzmann:
+			return numpy.full(newBoltzmann.shape, self.boltzmannTemps[0])[()];
+		# first match wins, in this order
+		conditions = [newBoltzmann < -1,							# less than inf
+					newBoltzmann == 0,								# force move away from 0
+					newBoltzmann < self.boltzmannTemps[0],			# lower than lower bound set to 0 - min boltzmann
+					newBoltzmann > self.boltzmannTemps[1]];			# higher than higher bound set to -1 - inf
+		choices = [self.boltzmannTemps[1], self.boltzmannTemps[0], 0, -1];
+		return numpy.select(conditions, choices, newBoltzmann)[()];
 
 	def boundCheckSteepness(self, newSteep:float) -> float:
 		"""
 		Check whether a new steepness value is in the bounds
-		If it is out of bounds, trim to the bound
+		If it is out of bounds, trim to the bound.
+		Also takes an array of steepnesses, and checks each of them
 
-		@param newSteep		float, the value to check
+		@param newSteep		float or float[], the value to check
 		@return float		the corrected steepness value
 		"""
 		if not self.searchSteepness:	# check if we're searching steepness
-			return self.steepnessRange[0];
-		elif newSteep < self.steepnessRange[0]:
-			return self.steepnessRange[0];
-		elif newSteep > self.steepnessRange[1]:
-			return self.steepnessRange[1];
-		else:
-			return newSteep;
+			return numpy.full(numpy.shape(newSteep), self.steepnessRange[0])[()];
+		return numpy.clip(newSteep, self.steepnessRange[0], self.steepnessRange[1])[()];
 
 	def boundCheckWeights(self, newWeights:numpy.array) -> numpy.array:
 		"""
 		Check whether a new set of weights in the specified bounds.
-		Values out of bounds will be trimmed to the bound
+		Values out of bounds will be trimmed to the bound, and weights that are not searched
+		are set to their minimum. Also takes float[candidate][macrostate], and checks each row
 
 		@param newWeights:		float[], new weights to check
 		@return float[]			the checked set of weights
 		"""
-		newWeights = numpy.array(newWeights);	# useful for intellisense, otherwise the computer doesn't know type >.<
-		for i in range(newWeights.size):
-			if not self.searchWeights[i]:	# first check if this weight is to be searched
-				newWeights[i] = self.weightMins[i];
-			elif newWeights[i] < self.weightMins[i]:
-				newWeights[i] = self.weightMins[i];
-			elif newWeights[i] > self.weightMaxs[i]:
-				newWeights[i] = self.weightMaxs[i];
-			else:
-				pass;
-		return newWeights;
+		newWeights = numpy.clip(numpy.array(newWeights, dtype = numpy.float64), self.weightMins, self.weightMaxs);
+		return numpy.where(numpy.asarray(self.searchWeights, dtype = bool), newWeights, self.weightMins);
+
+	def constructModel(self, ensembleSize:int, backrubTemp:float, boltzmannTemp:float, weights:numpy.array, steepness:float) -> ModelView:
+		"""
+		Makes a new candidate with the given parameters as a light view on the matching data model,
+		see getTemplateModel()
+
+		@param ensembleSize		int, ensemble size
+		@param backrubTemp		float, backrub temperature
+		@param boltzmannTemp	float, boltzmann averaging temp
+		@param weights			float[], weights
+		@param steepness		float, steepness
+		@return ModelView
+		"""
+		template = self.getTemplateModel(ensembleSize, backrubTemp, boltzmannTemp);
+		ensembleSeed = None;
+		if self.ensembleCache is not None and template.useMicrostateData:
+			ensembleSeed = numpy.random.randint(0, self.nEnsembleSeeds);
+		return ModelView(template, ensembleSize, backrubTemp, boltzmannTemp, weights, steepness, ensembleSeed, self.ensembleCache, self.sigmoidCache);
+
+	def getTemplateModel(self, ensembleSize:int, backrubTemp:float, boltzmannTemp:float) -> Model:
+		"""
+		The data model candidates with the given parameters are made from. When searching a
+		continuous range of Boltzmann temperatures it is looked up by backrub temperature only
+
+		@param ensembleSize		int, ensemble size
+		@param backrubTemp		float, backrub temperature
+		@param boltzmannTemp	float, boltzmann averaging temp
+		@return Model, not to be modified
+		"""
+		if not self.continuousBoltzmann:
+			return self.getModelByParams(backrubTemp, ensembleSize, boltzmannTemp);
+		return self.getModelByParams(backrubTemp, None, None);
 
 	def getModelByParams(self, param1, param2, param3) -> Model:
 		"""
 		Gets a model by the specified pre-determined parameters.
 		Return object is a not deep copy that should not be modified
 
-		@param ensembleS		int, ensemble size
-		@param backrubT			float, backrub temperature
-		@param boltzmannT		float, boltzmann averaging temp
+		@param param1			float, backrub temperature
+		@param param2			int, ensemble size, ignored for microstate data
+		@param param3			float, boltzmann averaging temp, ignored for microstate data
 		@return Model with specified params
 		"""
-		# convert to string
-		param1 = str(param1);
-		param2 = str(param2);
-		param3 = str(param3);
+		return self.getModelLattice().getByParams(param1, param2, param3);
+
+	def getModelLattice(self) -> ModelLattice:
+		"""
+		The models of this search indexed by their discrete parameters
 
-		return self.models[param1 + " " + param2 + " " + param3];
+		@param void
+		@return ModelLattice
+		"""
+		if self.modelLattice is None:
+			self.modelLattice = ModelLattice(self.models);
+		return self.modelLattice;
+
+	def validateParamBounds(self) -> None:
+		"""
+		Checks up front that there is a model for every combination of the discrete parameters that
+		can be searched, so a bad grid fails before the search starts instead of in the middle of it
+
+		@param void
+		@return void, raises ValueError if a combination has no model
+		"""
+		ensembleSizes = self.ensembleSizes if self.searchEnsemble else self.ensembleSizes[:1];
+		backrubTemps = self.backrubTemps if self.searchBackrub else self.backrubTemps[:1];
+		boltzmannTemps = self.boltzmannTemps if self.searchBoltzmann else self.boltzmannTemps[:1];
+		if self.continuousBoltzmann:
+			boltzmannTemps = [];		# a range, the data is not keyed by it
+		lattice = self.getModelLattice();
+		if self.continuousBoltzmann and not lattice.useMicrostateData:
+			raise ValueError("Searching a continuous range of Boltzmann temperatures needs microstate data");
+		lattice.validate(backrubTemps, ensembleSizes, boltzmannTemps);
+		return None;
 
 	def getBestParameters(self) -> {}:
 		"""
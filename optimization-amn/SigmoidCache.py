@@ -0,0 +1,86 @@
+from model import calcSigmoids, weightedProduct
+from collections import OrderedDict
+import numpy
+
+class SigmoidCache:
+	"""
+	A least-recently-used cache of the sigmoid term of the fitness function, keyed on the
+	energies it was calculated from and the steepness. The fitness is
+	product over macrostates of (1 - w_k + w_k * f_k), where only f depends on the energies and
+	the steepness, so a candidate that only moved its weights costs one broadcast multiply
+	instead of recalculating all the exponentials.
+
+	Energy arrays are told apart by identity. Entries keep a reference to their energies so
+	the identity of an array stays unique while it is cached.
+	"""
+
+	maxEntries = 0;						# cap on the number of cached sigmoid tensors
+	entries = OrderedDict();			# Map<(id(energies), steepness), (energies, sigmoids)> in least to most recently used order
+	hits = 0;
+	misses = 0;
+
+	def __init__(self, maxEntries:int = 64):
+		"""
+		Default constructor
+
+		@param maxEntries		int, number of (energies, steepness) sigmoid tensors to keep
+		"""
+		self.maxEntries = maxEntries;
+		self.entries = OrderedDict();
+		self.hits = 0;
+		self.misses = 0;
+
+	def getSigmoids(self, energies:numpy.array, steepness:float) -> numpy.array:
+		"""
+		Gets the sigmoid term for a set of energies and a steepness, calculating it if not cached
+
+		@param energies			double[position][residue energy][macrostate] of averaged energies
+		@param steepness		float, steepness
+		@return float[position][residue][macrostate] of read-only sigmoid values
+		"""
+		key = (id(energies), float(steepness));
+		if key in self.entries:
+			self.hits += 1;
+			self.entries.move_to_end(key);
+			return self.entries[key][1];
+
+		self.misses += 1;
+		sigmoids = calcSigmoids(energies, numpy.array([steepness]))[0];
+		sigmoids.flags.writeable = False;
+		if self.maxEntries > 0:
+			if len(self.entries) >= self.maxEntries:
+				self.entries.popitem(last = False);
+			self.entries[key] = (energies, sigmoids);
+		return sigmoids;
+
+	def getFitnesses(self, energies:numpy.array, steepness:float, weights:numpy.array) -> numpy.array:
+		"""
+		Calculates the fitnesses of each residue at each position through the cached sigmoid term
+
+		@param energies			double[position][residue energy][macrostate] of averaged energies
+		@param steepness		float, steepness
+		@param weights			float[macrostate] of weights
+		@return float[position][residue] of fitnesses
+		"""
+		sigmoids = self.getSigmoids(energies, steepness);
+		return weightedProduct(sigmoids, numpy.asarray(weights, dtype = sigmoids.dtype));
+
+	def getStats(self) -> {}:
+		"""
+		Returns the cache counters.
+		Keys:
+			'hits'
+			'misses'
+			'entries'
+
+		@param void
+		@return Map<string, int>
+		"""
+		stats = {};
+		stats['hits'] = self.hits;
+		stats['misses'] = self.misses;
+		stats['entries'] = len(self.entries);
+		return stats;
+
+	def __str__(self, **kwargs):
+		return "Sigmoid cache, {:d} of {:d} entries, hits/misses: {:d}/{:d}".format(len(self.entries), self.maxEntries, self.hits, self.misses);
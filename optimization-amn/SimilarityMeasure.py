@@ -15,7 +15,7 @@ class SimilarityMeasure:
 		@param targetFrequencies	float[position][residue] of target frequencies to examine
 		"""
 
-		if targetFrequencies == None: # handle default constructor case
+		if targetFrequencies is None: # handle default constructor case
 			self.targetFrequencies = None;
 			return;
 
@@ -59,6 +59,29 @@ class SimilarityMeasure:
 		"""
 		raise NotImplementedError;
 
+	# VIRTUAL
+	def getSimilarityMeasures(self, expFrequencies:numpy.array) -> numpy.array:
+		"""
+		Similarities of a batch of experimental frequency sets to the target set. Measures that can
+		be vectorized over the candidates override this, by default each candidate is measured in turn
+
+		@param expFrequencies		float[candidate][position][residue] of experimental frequencies
+		@return						float[candidate] of similarities
+		"""
+		return numpy.array([self.getSimilarityMeasure(expFrequencies[i]) for i in range(expFrequencies.shape[0])], dtype = numpy.float64);
+
+	# VIRTUAL
+	def getSimilarityGradient(self, expFrequencies) -> numpy.array:
+		"""
+		Analytic gradient of getSimilarityMeasure() with respect to each experimental frequency.
+		Used by gradient based searches; measures that do not implement it can only be used
+		with derivative free searches
+
+		@param expFrequencies		float[position][residue] of experimental frequencies
+		@return						float[position][residue] of d(similarity)/d(frequency)
+		"""
+		raise NotImplementedError;
+
 	# VIRTUAL ABSTRACT
 	def __str__(self, **kwargs):
 		"""
@@ -0,0 +1,68 @@
+from EnergyTableParser import readEnergyTable
+import numpy
+import ast
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+# Times the streaming energy parser against the per-line ast.literal_eval parse it replaced,
+# on a synthetic microstate file in the format written by StateDataTools.write_microstate_energy_tsv
+# usage: python benchmarkEnergyParser.py [number of lines, default 2000000] [file to write, default a temp file]
+
+nLines = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000;
+sampleLines = min(nLines, 100000);		# the old parser is timed on a sample only, it would take minutes on the whole file
+MACROSTATES = ['E-DHF-NADPH', 'E-NADPH', 'E-OPEN', 'E-THF', 'TS'];
+RESIDUES = 'ACDEFGHIKLMNPQRSTVWY';
+WRITTEN_ORDER = 'WFYLIMVCAGPSTNQHRKDE';		# residue order StateDataTools writes the dicts in
+nPositions = 50;
+
+if len(sys.argv) > 2:
+	path = sys.argv[2];
+else:
+	handle, path = tempfile.mkstemp(suffix = '.tsv');
+	os.close(handle);
+
+# write the synthetic file
+start = time.time();
+rng = numpy.random.RandomState(0);
+with open(path, 'w') as outfile:
+	outfile.write('microstate energies for positions: synthetic\n');
+	for first in range(0, nLines, 10000):
+		energies = rng.normal(0, 2, [min(10000, nLines - first), 20]);
+		lines = [];
+		for i in range(energies.shape[0]):
+			n = first + i;
+			lines.append('%s\t%s\t%s\t%s\t{' % (MACROSTATES[n // nPositions % len(MACROSTATES)], '0.9', str(n % nPositions + 1), 'sub_%d' % (n // nPositions)));
+			lines.append(''.join(["'%s':%f, " % (WRITTEN_ORDER[j], energies[i][j]) for j in range(20)]));
+			lines.append('}\n');
+		outfile.write(''.join(lines));
+print("wrote {:d} lines ({:.1f} MB) in {:.1f} s".format(nLines, os.path.getsize(path) / 1048576, time.time() - start));
+
+# old parser, on a sample
+start = time.time();
+oldEnergies = numpy.zeros([sampleLines, 20]);
+with open(path, 'r') as infile:
+	infile.readline();
+	for i, line in enumerate(itertools.islice(infile, sampleLines)):
+		energies = ast.literal_eval(line.split('\t')[4]);
+		for j in range(20):
+			oldEnergies[i][j] = energies[RESIDUES[j]];
+oldTime = (time.time() - start) * nLines / sampleLines;
+print("ast.literal_eval:   {:8.1f} s ({:.0f} lines/s, extrapolated from {:d} lines)".format(oldTime, nLines / oldTime, sampleLines));
+
+# streaming parser, on the whole file
+start = time.time();
+nRead = 0;
+for fields, energies in readEnergyTable(path, 4):
+	if nRead < sampleLines:
+		n = min(sampleLines - nRead, energies.shape[0]);
+		if not numpy.array_equal(energies[:n], oldEnergies[nRead:nRead + n]):
+			raise AssertionError("The parsers disagree");
+	nRead += energies.shape[0];
+newTime = time.time() - start;
+print("readEnergyTable:    {:8.1f} s ({:.0f} lines/s), {:.1f}x faster".format(newTime, nRead / newTime, oldTime / newTime));
+
+if len(sys.argv) <= 2:
+	os.remove(path);
@@ -4,12 +4,112 @@ import numpy
 import warnings
 from io import *
 from enumeration import enum
+from BoltzmannTable import boltzmannAverage, boltzmannAverageDerivative
 from copy import *
 
 # should the macrostates be hard-coded? probably not if this ends up being actually used for tuning other models...
 #MACROSTATES_T = enum("E-DHF-NADPH", "E-NADPH", "E-OPEN", "E-THF", "E-THF-NADPX", "TS");
 RESIDUES = enum('A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y');
 
+def calcFitnesses(energies:numpy.array, weights:numpy.array, steepness:numpy.array) -> numpy.array:
+	"""
+	Calculates the fitnesses of each residue at each position from macrostate energies for a set of
+	weights and steepnesses at once, broadcasting over the candidates
+
+	@param energies			double[position][residue energy][macrostate] of averaged energies
+	@param weights			float[candidate][macrostate] of weights
+	@param steepness		float[candidate] of steepnesses
+	@return float[candidate][position][residue] of fitnesses
+	"""
+	return weightedProduct(calcSigmoids(energies, steepness), numpy.asarray(weights, dtype = energies.dtype)[:, numpy.newaxis, numpy.newaxis, :]);
+
+def calcSigmoids(energies:numpy.array, steepness:numpy.array) -> numpy.array:
+	"""
+	Calculates the per-macrostate sigmoid term f of the fitness function for a set of steepnesses.
+	It does not depend on the weights, so it can be reused for any set of weights
+
+	@param energies			double[position][residue energy][macrostate] of averaged energies
+	@param steepness		float[candidate] of steepnesses
+	@return float[candidate][position][residue][macrostate] of sigmoid values, in the precision of the energies
+	"""
+	steepness = numpy.asarray(steepness, dtype = energies.dtype)[:, numpy.newaxis, numpy.newaxis, numpy.newaxis];
+
+	minEnergies = numpy.amin(energies, axis = 1);	# for each position and macrostate, which residue had min energy?
+	offsets = minEnergies[numpy.newaxis, :, numpy.newaxis, :] + numpy.divide(magic.log(99), steepness);	# calculate offset is double[candidate][position][1][macrostate]
+	return 1.0 / (1.0 + numpy.exp(steepness * (energies[numpy.newaxis] - offsets)));
+
+def weightedProduct(sigmoids:numpy.array, weights:numpy.array) -> numpy.array:
+	"""
+	Combines sigmoid terms into fitnesses, product over macrostates of (1 - w + w * f)
+
+	@param sigmoids			float[...][macrostate] of sigmoid values
+	@param weights			float[...][macrostate] of weights, broadcastable against sigmoids
+	@return float[...] of fitnesses
+	"""
+	return numpy.prod(1 - weights + weights * sigmoids, axis = -1);
+
+def fitnessesToFrequencies(fitnesses:numpy.array) -> numpy.array:
+	"""
+	Converts fitnesses to residue frequencies normalized over the last (residue) axis
+
+	@param fitnesses		float[...][residue] of fitnesses
+	@return float[...][residue] of frequencies
+	"""
+	frequencies = numpy.divide(fitnesses, numpy.subtract(1.0, fitnesses));	# non-normalized frequencies
+	return frequencies / numpy.sum(frequencies, axis = -1, keepdims = True);
+
+def calcFrequencyJacobians(energies:numpy.array, weights:numpy.array, steepness:float, energiesDerivative:numpy.array = None) -> (numpy.array, numpy.array, numpy.array, numpy.array):
+	"""
+	Calculates the frequencies and their analytic derivatives with respect to the weights, the
+	steepness and, optionally, one parameter the energies depend on (e.g. the Boltzmann temperature).
+	The minimum energy in the sigmoid offset is differentiated through its argmin residue
+
+	@param energies				double[position][residue energy][macrostate] of averaged energies
+	@param weights				float[macrostate] of weights
+	@param steepness			float, steepness
+	@param energiesDerivative	double[position][residue energy][macrostate], optional, derivative of the energies w.r.t. the extra parameter
+	@return float[position][residue] frequencies,
+			float[position][residue][macrostate] d(frequency)/d(weight),
+			float[position][residue] d(frequency)/d(steepness),
+			float[position][residue] d(frequency)/d(parameter), or None if energiesDerivative is None
+	"""
+	weights = numpy.asarray(weights, dtype = numpy.float64);
+	minIndices = numpy.argmin(energies, axis = 1)[:, numpy.newaxis, :];		# [position][1][macrostate]
+	f = calcSigmoids(energies, numpy.array([steepness]))[0];
+	factors = 1 - weights + weights * f;
+
+	# product of all the other macrostates' factors, from exclusive prefix and suffix products so zero factors are fine
+	ones = numpy.ones(factors.shape[:-1] + (1,));
+	prefix = numpy.concatenate([ones, numpy.cumprod(factors[..., :-1], axis = -1)], axis = -1);
+	suffix = numpy.concatenate([numpy.cumprod(factors[..., :0:-1], axis = -1)[..., ::-1], ones], axis = -1);
+	others = prefix * suffix;
+	fitnesses = others[..., 0] * factors[..., 0];
+
+	# f = 1 / (1 + exp(x)), x = s * (E - minE) - log(99)
+	dfdx = -f * (1 - f);
+	dFitnessdWeights = others * (f - 1);
+	dFitnessdSteepness = numpy.sum(others * weights * dfdx * (energies - numpy.take_along_axis(energies, minIndices, axis = 1)), axis = -1);
+	dFitnessdParam = None;
+	if energiesDerivative is not None:
+		dxdParam = steepness * (energiesDerivative - numpy.take_along_axis(energiesDerivative, minIndices, axis = 1));
+		dFitnessdParam = numpy.sum(others * weights * dfdx * dxdParam, axis = -1);
+
+	# odds q = F / (1 - F), then normalized over residues p = q / sum(q)
+	odds = fitnesses / (1 - fitnesses);
+	dOdds = 1 / numpy.square(1 - fitnesses);
+	sums = numpy.sum(odds, axis = 1, keepdims = True);
+	frequencies = odds / sums;
+	# dp/dq = (dq - p * sum(dq)) / sum(q) at each position
+	dOddsdWeights = dOdds[..., numpy.newaxis] * dFitnessdWeights;
+	dWeights = (dOddsdWeights - frequencies[..., numpy.newaxis] * numpy.sum(dOddsdWeights, axis = 1, keepdims = True)) / sums[..., numpy.newaxis];
+	dOddsdSteepness = dOdds * dFitnessdSteepness;
+	dSteepness = (dOddsdSteepness - frequencies * numpy.sum(dOddsdSteepness, axis = 1, keepdims = True)) / sums;
+	dParam = None;
+	if dFitnessdParam is not None:
+		dOddsdParam = dOdds * dFitnessdParam;
+		dParam = (dOddsdParam - frequencies * numpy.sum(dOddsdParam, axis = 1, keepdims = True)) / sums;
+	return frequencies, dWeights, dSteepness, dParam;
+
 class Model:
 	"""
 	A multistate design model
@@ -42,12 +142,20 @@ class Model:
 	isFrequenciesCalculated = False;				# prevent unnecessary calculations
 	useMicrostateData = False;						# do we have data from individual microstates?
 	areMicrostatesPicked = False;					# have microstates been selected to be used in the ensemble?
-	microstateResidueEnergies = numpy.array(0);		# double[position][residue energy][macrostate][microstate]
+	areMicrostatesPacked = False;					# have the read in microstates been packed into contiguous blocks?
+	microstateDtype = numpy.float64;				# storage type of the raw microstate energies, float32 halves their memory
+	dtype = numpy.float64;							# precision of the averaged energies and everything calculated from them
+	microstateResidueEnergies = numpy.array(0);		# double[microstate][residue energy], one contiguous block per (position, macrostate) once packed
+	microstateOffsets = numpy.array(0);				# int[position][macrostate] first row of each block in microstateResidueEnergies
+	microstateBlocks = numpy.array(0);				# int[microstate] (position, macrostate) block of each staged microstate, only used while reading
+	nStagedMicrostates = 0;							# int, number of microstates read in so far
 	selectedMicrostateEnergies = numpy.array(0);	# double[position][residue energy][macrostate][microstate], subset of microstateREsidueEnergies
 	microstateCounts = numpy.array(0);				# double[position][macrostate] number of microstates
 	microstatesUsed = numpy.array(0);				# int[position][macrostate][microstate index], the microstates used to calculate the macrostates
+	ensembleSeed = None;							# int, seed the microstates are picked with when sharing an ensemble cache
+	ensembleCache = None;							# EnsembleCache shared by the models of a search, or None to pick privately
 
-	def __init__(self, macrostates:enum, ensembleSize:int, backrubTemp:float, boltzmannTemp:float, weights:numpy.array, steepness:float, positions:int, positionOffset:int, useMicrostateData:bool = False, posMap:dict = None, useAltAverageMethod:bool = False):
+	def __init__(self, macrostates:enum, ensembleSize:int, backrubTemp:float, boltzmannTemp:float, weights:numpy.array, steepness:float, positions:int, positionOffset:int, useMicrostateData:bool = False, posMap:dict = None, useAltAverageMethod:bool = False, microstateDtype:type = numpy.float64, dtype:type = numpy.float64):
 		"""
 		Default constructor
 
@@ -62,6 +170,8 @@ class Model:
 		@param useMicrostateData		bool, are we to actually average microstate data?
 		@param posMap					dict<int, int> a remapping of position values if the positions are not contiguous. ONLY pass an object if the positions are not contiguous
 		@param useAltAveragingMethod	bool, use the other Boltzmann averaging calculation method?
+		@param microstateDtype			numpy dtype used to store the raw microstate energies, numpy.float32 to halve memory
+		@param dtype					numpy dtype the averaged energies, fitnesses and frequencies are stored and calculated in
 		"""
 		self.MACROSTATES = macrostates;
 		self.nMacrostates = macrostates.size;
@@ -75,6 +185,8 @@ class Model:
 		self.isFrequenciesCalculated = False;
 		self.useMicrostateData = useMicrostateData;
 		self.useAltAveragingMethod = useAltAverageMethod;
+		self.microstateDtype = microstateDtype;
+		self.dtype = dtype;
 		self.macrostatesUsed = numpy.array([True] * self.nMacrostates);
 		self.positionMap = deepcopy(posMap);
 		if posMap is not None:
@@ -83,9 +195,9 @@ class Model:
 			self.contiguousPositions = True;
 
 		# allocate arrays
-		self.macrostateResidueEnergies = numpy.zeros([self.nPositions, 20, self.nMacrostates], dtype = numpy.float64);
-		self.fitnesses = numpy.ones([self.nPositions, 20], dtype = numpy.float64);
-		self.frequencies = numpy.zeros([self.nPositions, 20], dtype = numpy.float64);
+		self.macrostateResidueEnergies = numpy.zeros([self.nPositions, 20, self.nMacrostates], dtype = self.dtype);
+		self.fitnesses = numpy.ones([self.nPositions, 20], dtype = self.dtype);
+		self.frequencies = numpy.zeros([self.nPositions, 20], dtype = self.dtype);
 
 		# a little checker to prevent two identical entries, used in function addMacrostateData()
 		for i in range(self.nMacrostates):
@@ -94,11 +206,16 @@ class Model:
 
 		if self.useMicrostateData:
 			self.areMicrostatesPicked = False;
+			self.areMicrostatesPacked = False;
 			self.microstatesUsed = numpy.zeros([0]);
 			self.microstateCounts = numpy.zeros([self.nPositions, self.nMacrostates], dtype = int);
-			self.microstateResidueEnergies = numpy.zeros([self.nPositions, 20, self.nMacrostates, 700], dtype = numpy.float64); # magic number 700 - max expected number of microstates
+			self.microstateOffsets = numpy.zeros([self.nPositions, self.nMacrostates], dtype = int);
+			# microstates are staged in the order they are read and grown as needed, then packed by packMicrostateData()
+			self.microstateResidueEnergies = numpy.zeros([64, 20], dtype = self.microstateDtype);
+			self.microstateBlocks = numpy.zeros([64], dtype = int);
+			self.nStagedMicrostates = 0;
 
-	def constructFromExisting(existing, ensembleSize:int, backrubTemp:float, boltzmannTemp:float, weights:numpy.array, steepness:float):
+	def constructFromExisting(existing, ensembleSize:int, backrubTemp:float, boltzmannTemp:float, weights:numpy.array, steepness:float, ensembleSeed:int = None, ensembleCache:"EnsembleCache" = None):
 		"""
 		"Overloaded" "constructor" that uses a pre-existing Model as a template
 
@@ -107,13 +224,18 @@ class Model:
 		@param backrubTemp		float, new backrub temperate
 		@param boltzmannTemp	float, new Boltzmann temerature
 		@param weights			float[], new weights
+		@param steepness		float, new steepness
+		@param ensembleSeed		int, optional, seed to pick microstates with. Only used with ensembleCache
+		@param ensembleCache	EnsembleCache, optional, cache of picked ensembles and averaged energies shared between models
 		@return Model
 		"""
 
-		new = Model(existing.MACROSTATES, ensembleSize, backrubTemp, boltzmannTemp, weights, steepness, existing.nPositions, existing.positionOffset, existing.useMicrostateData);
+		new = Model(existing.MACROSTATES, ensembleSize, backrubTemp, boltzmannTemp, weights, steepness, existing.nPositions, existing.positionOffset, existing.useMicrostateData, microstateDtype = existing.microstateDtype, dtype = existing.dtype);
 		new.macrostatesUsed = existing.macrostatesUsed;
 		new.microstatesUsed = existing.microstatesUsed;
 		new.contiguousPositions = existing.contiguousPositions;
+		new.ensembleSeed = ensembleSeed;
+		new.ensembleCache = ensembleCache;
 
 		# TODO: is deepy copy necessary for all these values?
 		#new.positionMap = deepcopy(existing.positionMap);	# deep copy dict, keep instances completely separate
@@ -137,8 +259,11 @@ class Model:
 				new.areMicrostatesPicked = True;
 		#else:													# using microstate data, not collapsed
 			#print("!", end='')
+			existing.packMicrostateData();
 			new.microstateResidueEnergies = existing.microstateResidueEnergies;
 			new.microstateCounts = existing.microstateCounts;
+			new.microstateOffsets = existing.microstateOffsets;
+			new.areMicrostatesPacked = True;
 
 		return new;
 
@@ -191,14 +316,98 @@ class Model:
 		else:
 			position = self.positionMap[position];
 
+		if self.areMicrostatesPacked:
+			raise Exception("Microstate data has already been packed, no more can be added");
+
 		# TODO: do I need a overwrite check as in adding macrostate data?
-		for i in range(20):
-			self.microstateResidueEnergies[position][i][macrostate][self.microstateCounts[position][macrostate]] = energies[i];
+		if self.nStagedMicrostates == self.microstateBlocks.shape[0]:	# out of room, double the staging space
+			self.microstateResidueEnergies = numpy.concatenate([self.microstateResidueEnergies, numpy.zeros_like(self.microstateResidueEnergies)]);
+			self.microstateBlocks = numpy.concatenate([self.microstateBlocks, numpy.zeros_like(self.microstateBlocks)]);
+		self.microstateResidueEnergies[self.nStagedMicrostates] = energies;
+		self.microstateBlocks[self.nStagedMicrostates] = position * self.nMacrostates + macrostate;
+		self.nStagedMicrostates += 1;
 
 		self.microstateCounts[position][macrostate] += 1;
 
 		return None;
 
+	def addMicrostateDataBlock(self, macrostates:numpy.array, positions:numpy.array, energies:numpy.array) -> None:
+		"""
+		Inserts many microstates at once, in the order given. Same as calling addMicrostateData() on each row
+
+		@param macrostates		int[microstate], the macrostate each microstate belongs to
+		@param positions		int[microstate], the position each microstate is at
+		@param energies			double[microstate][residue energy]
+		@return void
+		"""
+		if self.areMicrostatesPacked:
+			raise Exception("Microstate data has already been packed, no more can be added");
+
+		if self.contiguousPositions:
+			positions = numpy.asarray(positions, dtype = int) - self.positionOffset;
+		else:
+			positions = numpy.array([self.positionMap[p] for p in positions], dtype = int);
+
+		n = positions.size;
+		needed = self.nStagedMicrostates + n;
+		if needed > self.microstateBlocks.shape[0]:		# out of room, at least double the staging space
+			size = max(needed, 2 * self.microstateBlocks.shape[0]);
+			grown = numpy.zeros([size, 20], dtype = self.microstateDtype);
+			grown[:self.nStagedMicrostates] = self.microstateResidueEnergies[:self.nStagedMicrostates];
+			self.microstateResidueEnergies = grown;
+			grown = numpy.zeros([size], dtype = int);
+			grown[:self.nStagedMicrostates] = self.microstateBlocks[:self.nStagedMicrostates];
+			self.microstateBlocks = grown;
+		blocks = positions * self.nMacrostates + macrostates;
+		self.microstateResidueEnergies[self.nStagedMicrostates:needed] = energies;
+		self.microstateBlocks[self.nStagedMicrostates:needed] = blocks;
+		self.nStagedMicrostates = needed;
+
+		self.microstateCounts += numpy.bincount(blocks, minlength = self.microstateCounts.size).reshape(self.microstateCounts.shape);
+
+		return None;
+
+	def packMicrostateData(self) -> None:
+		"""
+		Rearranges the microstates read in so far into one contiguous block per (position, macrostate),
+		in reading order, and records where each block starts in microstateOffsets. Called once all
+		microstate data has been added; nothing more can be added afterwards
+
+		@param void
+		@return void
+		"""
+		if self.areMicrostatesPacked:
+			return None;
+
+		order = numpy.argsort(self.microstateBlocks[:self.nStagedMicrostates], kind = 'stable');	# stable keeps the reading order within a block
+		self.microstateResidueEnergies = self.microstateResidueEnergies[order];
+		counts = self.microstateCounts.ravel();		# blocks are numbered position-major, same as ravel order
+		self.microstateOffsets = numpy.reshape(numpy.cumsum(counts) - counts, self.microstateCounts.shape);
+		self.microstateBlocks = numpy.array(0);
+		self.areMicrostatesPacked = True;
+		return None;
+
+	def setPackedMicrostateData(self, energies:numpy.array, counts:numpy.array) -> None:
+		"""
+		Takes microstate data that is already packed, e.g. loaded from a parsed data cache, instead
+		of having it added one microstate at a time. The energies are used as they are, not copied
+
+		@param energies		double[microstate][residue energy], one contiguous block per (position, macrostate) in position-major order
+		@param counts		int[position][macrostate] number of microstates in each block
+		@return void
+		"""
+		if self.areMicrostatesPacked or self.nStagedMicrostates > 0:
+			raise Exception("Microstate data has already been added to this model");
+
+		self.microstateResidueEnergies = energies;
+		self.microstateCounts = numpy.array(counts, dtype = int);
+		counts = self.microstateCounts.ravel();
+		self.microstateOffsets = numpy.reshape(numpy.cumsum(counts) - counts, self.microstateCounts.shape);
+		self.microstateBlocks = numpy.array(0);
+		self.nStagedMicrostates = energies.shape[0];
+		self.areMicrostatesPacked = True;
+		return None;
+
 	def useAltAverageMethod(self, yes:bool) -> None:
 		"""
 		Changes whether to use the other averaging method
@@ -219,51 +428,67 @@ class Model:
 	# TODO: add flag to only compute once. Then we should be able to remove the deep copy
 	def averageMicrostates(self) -> None:
 		"""
-		Boltzmann averages the microstates to calculate the energy for the macrostate
+		Boltzmann averages the microstates to calculate the energy for the macrostate.
+		If this model has an ensemble cache and seed, the picked ensemble and the averaged
+		energies are shared with every other model with the same parameters and seed
 
 		@param void
 		@return void
 		"""
-		#print(self.microstateResidueEnergies[0][0]);
-		#print();
-		if not self.areMicrostatesPicked:
-			# pick backbones to use for the ensemble.
-			self.microstatesUsed = numpy.zeros([self.nPositions, self.nMacrostates, self.ensembleSize], dtype = int);
-			for i in range(self.nPositions):
-				for j in range(self.nMacrostates):
-					self.microstatesUsed[i][j] = numpy.random.randint(0, self.microstateCounts[i][j], [self.ensembleSize]);
-			# cherry-pick out the selected microstates
-			self.selectedMicrostateEnergies = numpy.zeros([self.nPositions, 20, self.nMacrostates, self.ensembleSize]);
-			for i in range(self.nPositions):
-				for j in range(20):
-					for k in range(self.nMacrostates):
-						for l in range(self.ensembleSize):
-							self.selectedMicrostateEnergies[i][j][k][l] = self.microstateResidueEnergies[i][j][k][self.microstatesUsed[i][k][l]]
-
-			self.areMicrostatesPicked = True;
-
-		#print(self.selectedMicrostateEnergies[0][0]);
-		#print();
-		if not self.useAltAveragingMethod:
-			if (self.boltzmannTemp == 0.0):
-				self.macrostateResidueEnergies = numpy.amin(self.selectedMicrostateEnergies, axis = 3);
-			elif (self.boltzmannTemp == -1.0):
-				self.macrostateResidueEnergies = numpy.mean(self.selectedMicrostateEnergies, axis = 3);
-			else:
-				self.macrostateResidueEnergies = numpy.sum(self.selectedMicrostateEnergies * numpy.exp(self.selectedMicrostateEnergies / -self.boltzmannTemp), axis = 3) / numpy.sum(numpy.exp(self.selectedMicrostateEnergies / -self.boltzmannTemp), axis = 3);
+		if self.ensembleCache is not None and self.ensembleSeed is not None:
+			self.ensembleCache.averageMicrostates(self);
 		else:
-			if (self.boltzmannTemp == 0.0):
-				self.macrostateResidueEnergies = numpy.amin(self.selectedMicrostateEnergies, axis = 3);
-			elif (self.boltzmannTemp == -1.0):
-				self.macrostateResidueEnergies = numpy.mean(self.selectedMicrostateEnergies, axis = 3);
-			else:
-				self.macrostateResidueEnergies = -numpy.log(sum(numpy.exp(self.selectedMicrostateEnergies / -self.boltzmannTemp), axis = 3));
+			if not self.areMicrostatesPicked:
+				self.pickMicrostates(numpy.random);
+			self.macrostateResidueEnergies = self.calcAveragedEnergies();
 
 		#print(self.macrostateResidueEnergies[0]);
-		# After averaging, delete the 4D array to save space and flip the microstate flag
+		# After averaging, drop the reference to the raw data to save space and flip the microstate flag
 		self.microstateResidueEnergies = numpy.array(0);
 		return None;
 
+	# PRIVATE
+	def pickMicrostates(self, rng) -> None:
+		"""
+		Randomly picks the microstates used in the ensemble of each position and macrostate
+
+		@param rng		numpy.random or a numpy.random.RandomState to draw the picks from
+		@return void
+		"""
+		self.microstatesUsed, self.selectedMicrostateEnergies = self.selectMicrostates(self.ensembleSize, rng);
+		self.areMicrostatesPicked = True;
+		return None;
+
+	def selectMicrostates(self, ensembleSize:int, rng) -> (numpy.array, numpy.array):
+		"""
+		Randomly picks an ensemble of microstates for each position and macrostate from the
+		raw microstate data held by this model, without changing this model
+
+		@param ensembleSize		int, number of microstates to pick for each position and macrostate
+		@param rng				numpy.random or a numpy.random.RandomState to draw the picks from
+		@return int[position][macrostate][microstate index] of the picks and
+				double[position][residue energy][macrostate][microstate] of their energies
+		"""
+		# pick backbones to use for the ensemble.
+		# one draw over the whole [position][macrostate][microstate] block, each (position, macrostate) bounded by its own count
+		used = rng.randint(0, self.microstateCounts[:, :, numpy.newaxis], [self.nPositions, self.nMacrostates, ensembleSize]);
+		# cherry-pick out the selected microstates with a single gather of rows from the packed blocks,
+		# then put it back into [position][residue][macrostate][microstate] order for averaging
+		self.packMicrostateData();
+		rows = self.microstateOffsets[:, :, numpy.newaxis] + used;
+		selected = numpy.moveaxis(numpy.asarray(self.microstateResidueEnergies[rows], dtype = self.dtype), 3, 1);
+		return used, selected;
+
+	# PRIVATE
+	def calcAveragedEnergies(self) -> numpy.array:
+		"""
+		Boltzmann averages the picked microstates at this model's Boltzmann temperature
+
+		@param void
+		@return double[position][residue energy][macrostate]
+		"""
+		return boltzmannAverage(self.selectedMicrostateEnergies, self.boltzmannTemp, self.useAltAveragingMethod);
+
 	# PRIVATE
 	def calcFitness(self) -> None:
 		"""
@@ -278,14 +503,38 @@ class Model:
 		if self.useMicrostateData:
 			self.averageMicrostates();
 
-		minEnergies = numpy.amin(self.macrostateResidueEnergies, axis = 1);	# for each position and macrostate, which residue had min energy?
-		offsets = minEnergies + numpy.divide(numpy.log(99), self.steepness);		# calculate offset is double[position][macrostate]
-		self.fitnesses = numpy.ones([self.nPositions, 20], dtype = numpy.float64);
-		for i in range(self.nPositions):
-			for j in range(20):
-				for k in range(self.nMacrostates):
-					f = 1.0 / (1.0 + numpy.exp(self.steepness * (self.macrostateResidueEnergies[i][j][k] - offsets[i][k])));
-					self.fitnesses[i][j] *= (1 - self.weights[k] + self.weights[k] * f);
+		self.fitnesses = self.calcFitnessBatch(numpy.array([self.weights]), numpy.array([self.steepness]))[0];
+
+	# PRIVATE
+	def calcFitnessBatch(self, weights:numpy.array, steepness:numpy.array) -> numpy.array:
+		"""
+		Calculates the fitnesses of each residue at each position for a set of weights and
+		steepnesses at once, broadcasting over the candidates. Energies must already be averaged
+
+		@param weights			float[candidate][macrostate] of weights
+		@param steepness		float[candidate] of steepnesses
+		@return float[candidate][position][residue] of fitnesses
+		"""
+		return calcFitnesses(self.macrostateResidueEnergies, weights, steepness);
+
+	def getFrequenciesBatch(self, weights:numpy.array, steepness:numpy.array) -> numpy.array:
+		"""
+		Calculates the frequencies for a whole population of weights and steepnesses in one pass,
+		using this model's ensemble size, backrub and Boltzmann temperatures. Does not change the
+		weights, steepness or frequencies stored in this model
+
+		@param weights			float[candidate][macrostate] of weights
+		@param steepness		float[candidate] of steepnesses
+		@return float[candidate][position][residue] of frequencies
+		"""
+		# this is a special instance for storing data
+		if self.ensembleSize == 0 and self.useMicrostateData:
+			raise PermissionError("This object is a raw data storage instance and this call should not have been made");
+
+		if self.useMicrostateData:
+			self.averageMicrostates();
+
+		return fitnessesToFrequencies(self.calcFitnessBatch(weights, steepness));
 
 		# PRIVATE
 	def calcFrequencies(self) -> None:
@@ -299,10 +548,33 @@ class Model:
 			self.isFrequenciesCalculated = True;
 			self.calcFitness();
 
-			self.frequencies = numpy.divide(self.fitnesses, numpy.subtract(1.0, self.fitnesses));	# non-normalized frequencies
-			sums = numpy.sum(self.frequencies, axis = 1);
-			for i in range(self.nPositions):	# normalize
-				self.frequencies[i] = numpy.divide(self.frequencies[i], sums[i]);
+			self.frequencies = fitnessesToFrequencies(self.fitnesses);
+
+	def getFrequencyJacobians(self) -> {}:
+		"""
+		Returns the analytic derivatives of this model's frequencies with respect to its continuous parameters.
+		Keys:
+			'weights'			float[position][residue][macrostate]
+			'steepness'			float[position][residue]
+			'boltzmannTemp'		float[position][residue], None unless microstate data are Boltzmann averaged
+								at a temperature other than the min (0) or mean (-1) endpoints
+
+		@param void
+		@return Map<string, float[][]>
+		"""
+		if not self.isFrequenciesCalculated:
+			self.calcFrequencies();
+
+		energiesDerivative = None;
+		if self.useMicrostateData and self.boltzmannTemp != 0.0 and self.boltzmannTemp != -1.0:
+			energiesDerivative = boltzmannAverageDerivative(self.selectedMicrostateEnergies, self.boltzmannTemp, self.useAltAveragingMethod);
+
+		frequencies, dWeights, dSteepness, dBoltzmann = calcFrequencyJacobians(self.macrostateResidueEnergies, self.weights, self.steepness, energiesDerivative);
+		jacobians = {};
+		jacobians['weights'] = dWeights;
+		jacobians['steepness'] = dSteepness;
+		jacobians['boltzmannTemp'] = dBoltzmann;
+		return jacobians;
 
 	# get functions
 	# member fields should not be directly accessed; use these get funtions instead
@@ -31,6 +31,12 @@ except OSError:
     if not os.path.isdir(output_path):
         raise
 
+# searches save their state to a checkpoint file next to their outputs and resume from it when the
+# job is resubmitted, e.g. after the node was preempted. The checkpoint is removed once the outputs
+# are written. Set both to None to not checkpoint
+checkpoint_seconds = 1800
+checkpoint_generations = None
+
 #input_path = '/kortemmelab/home/anatale/opt3/opt_rnd3'
 input_path = '/Users/anatale/school/UCSF/Kortemme_lab/code/multi-state-design/opt_rnd3'
 
@@ -140,13 +146,18 @@ def optimize():
         # set parameters
         search.setParamBounds(ensembleSizes, backrubTemps, boltzmannTemps, steepnessRange, minWeights, maxWeights)
         search.setSearchParameters(True, False, True, True, usedstates)
+        if checkpoint_seconds is not None or checkpoint_generations is not None:
+            search.setCheckpoints(os.path.join(output_path, "var_ensembles_"+job_tag+".checkpoint"), checkpoint_generations, checkpoint_seconds, optimizer.getDataHash())
         # load search algorithm
         optimizer.useAlgorithm(search)
         # optimize
         optimizer.optimize()
         #now = datetime.now()
         optimizer.writeFrequenciesToFASTA(optimizer.getBestFrequencies(), os.path.join(output_path, "var_ensembles_"+job_tag+".fasta"))
+        optimizer.writeFrequenciesToNPY(optimizer.getBestFrequencies(), os.path.join(output_path, "var_ensembles_"+job_tag+".npy"))
         optimizer.writeBestParamsToText(os.path.join(output_path, "var_ensembles_"+job_tag))
+        if search.checkpointPath is not None and os.path.exists(search.checkpointPath):
+            os.remove(search.checkpointPath)
     else:
         # init search algorithm
         if simMeas_id == 'JS':
@@ -166,13 +177,18 @@ def optimize():
         # set parameters
         search.setParamBounds(ensembleSizes, backrubTemps, boltzmannTemps, steepnessRange, minWeights, maxWeights)
         search.setSearchParameters(False, False, False, True, usedstates)
+        if checkpoint_seconds is not None or checkpoint_generations is not None:
+            search.setCheckpoints(os.path.join(output_path, "fixed_ensembles_"+job_tag+".checkpoint"), checkpoint_generations, checkpoint_seconds, optimizer.getDataHash())
         # load search algorithm
         optimizer.useAlgorithm(search)
         # optimize
         optimizer.optimize()
         #now = datetime.now()
         optimizer.writeFrequenciesToFASTA(optimizer.getBestFrequencies(), os.path.join(output_path, "fixed_ensembles_"+job_tag+".fasta"))
+        optimizer.writeFrequenciesToNPY(optimizer.getBestFrequencies(), os.path.join(output_path, "fixed_ensembles_"+job_tag+".npy"))
         optimizer.writeBestParamsToText(os.path.join(output_path, "fixed_ensembles_"+job_tag))
+        if search.checkpointPath is not None and os.path.exists(search.checkpointPath):
+            os.remove(search.checkpointPath)
     #print(optimizer.getBestParameters()['match'])
 
 optimize()
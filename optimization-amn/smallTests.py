@@ -10,9 +10,11 @@ from EntropyWeightsMixedSimilarity import EntropyWeightsMixedSimilarity;
 from EntropyWeightedSimilarity import EntropyWeightedSimilarity
 from Chi2Kernel import Chi2Kernel;
 from enumeration import enum;
+from EnergyTableParser import RESIDUES, parseEnergyDicts;
 from datetime import *
 import numpy;
 import threading
+import os
 from io import *
 # tests with small subsets of data
 
@@ -471,7 +473,7 @@ def simpleRepeatTest():
 	for i in range(64):
 		optimizer.optimize();
 		params = optimizer.getBestParameters();
-		m = search.population[0];
+		m = search.getBestModel();
 		#print(search.similarityMeasure.getSimilarityMeasure(m.getFrequencies()));
 		# TODO: getModelByParams doesn't always return the same object.
 		m1 = Model.constructFromExisting(optimizer.getModelByParams(m.backrubTemp, m.ensembleSize, m.boltzmannTemp), m.ensembleSize, m.backrubTemp, m.boltzmannTemp, m.getWeights(), m.steepness);
@@ -637,4 +639,77 @@ def DHFRcomparemeasures(similarity:int):
 
 	name = "DHFR compare measures " + measure + " " + datetime.now().strftime('%Y%m%d%H%M');
 	optimizer.writeFrequenciesToFASTA(optimizer.getBestFrequencies(), name + ".fasta", 3);
-	optimizer.writeBestParamsToText(name + ".txt");
\ No newline at end of file
+	optimizer.writeBestParamsToText(name + ".txt");
+
+# checks that the faster ways of reading and searching give the same results as the plain ones
+
+DHFR_MACROSTATES = enum("E-DHF-NADPH", "E-NADPH", "E-OPEN", "E-THF", "E-THF-NADPX", "TS");
+DHFR_DATA = "/netapp/home/tianjiao.zhang/data/DHFR_MSD_M20loop_repeat1.tsv";
+DHFR_TARGET = "/netapp/home/tianjiao.zhang/data/ecDHFR_openseq_bacterial_representative_final_align_trim.fasta";
+
+def testParseNoTrailingSeparator():
+	energies = numpy.round(numpy.random.randn(8, 20), 6);
+	order = numpy.random.permutation(20);
+	dicts = ["{" + "".join(["'{:s}':{:f}, ".format(RESIDUES[j], energies[i, j]) for j in order]) + "}" for i in range(8)];
+	# as written by StateDataTools, then without the separator after the last value
+	print(numpy.array_equal(parseEnergyDicts(dicts), energies));
+	print(numpy.array_equal(parseEnergyDicts([d.replace(", }", "}") for d in dicts]), energies));
+
+def smallMacroSearch(data:str, targetFreqs:str, MACROSTATES, lazy:bool = False, nIslands:int = 1, nProcesses:int = None, checkpoint:str = None, searchType = CuckooSearch):
+	numpy.random.seed(1);
+	optimizer = Optimizer(MACROSTATES);
+	optimizer.readTargetFrequencies(targetFreqs);
+	optimizer.readData(data, lazy = lazy);
+	lattice = optimizer.getModelLattice();
+
+	search = searchType(optimizer.models, JensenShannonDistance(optimizer.targetFrequencies), False, 16, 1, 0.25);
+	search.suppressOutputs = True;
+	search.setMaxIterations(32);
+	search.setParamBounds(lattice.axes[1], lattice.axes[0], lattice.axes[2], numpy.array([0.5, 5]), numpy.zeros(MACROSTATES.size), numpy.ones(MACROSTATES.size));
+	search.setAllSearchToTrue();
+	if nIslands > 1:
+		search.setIslands(nIslands, 4, 2, 'ring', nProcesses);
+	if checkpoint is not None:
+		search.setCheckpoints(checkpoint, everyGenerations = 4, dataHash = optimizer.getDataHash());
+	optimizer.useAlgorithm(search);
+	optimizer.optimize();
+	return optimizer;
+
+def testLazyRead(data:str = DHFR_DATA, targetFreqs:str = DHFR_TARGET, MACROSTATES = DHFR_MACROSTATES):
+	eager = smallMacroSearch(data, targetFreqs, MACROSTATES);
+	lazy = smallMacroSearch(data, targetFreqs, MACROSTATES, lazy = True);
+	lattice = lazy.getModelLattice();
+	print(len(eager.models) == len(lattice) and all([numpy.array_equal(m.macrostateResidueEnergies, lattice.getByParams(m.backrubTemp, m.ensembleSize, m.boltzmannTemp).macrostateResidueEnergies) for m in eager.models.values()]));
+	print(eager.getBestParameters()['match'], lazy.getBestParameters()['match']);
+
+class InterruptedCuckooSearch(CuckooSearch):
+	"""
+	A cuckoo search that stops as if the job were killed after 10 generations
+	"""
+	generationsLeft = 10;
+
+	def nextGeneration(self):
+		if self.generationsLeft == 0:
+			raise KeyboardInterrupt;
+		self.generationsLeft -= 1;
+		return super().nextGeneration();
+
+def testCheckpointResume(data:str = DHFR_DATA, targetFreqs:str = DHFR_TARGET, MACROSTATES = DHFR_MACROSTATES, path:str = "smallTests checkpoint.pkl"):
+	if os.path.exists(path):
+		os.remove(path);
+	whole = smallMacroSearch(data, targetFreqs, MACROSTATES);
+	try:
+		smallMacroSearch(data, targetFreqs, MACROSTATES, checkpoint = path, searchType = InterruptedCuckooSearch);
+	except KeyboardInterrupt:
+		print("interrupted");
+	resumed = smallMacroSearch(data, targetFreqs, MACROSTATES, checkpoint = path);
+	os.remove(path);
+	print(resumed.optimizationAlgorithm.resumedGeneration);
+	print(whole.getBestParameters()['match'], resumed.getBestParameters()['match']);
+	print(all([numpy.array_equal(whole.getTrace()[key], resumed.getTrace()[key]) for key in ['generation', 'best', 'mean', 'evaluations']]));
+
+def testIslandProcesses(data:str = DHFR_DATA, targetFreqs:str = DHFR_TARGET, MACROSTATES = DHFR_MACROSTATES):
+	one = smallMacroSearch(data, targetFreqs, MACROSTATES, nIslands = 3, nProcesses = 1);
+	several = smallMacroSearch(data, targetFreqs, MACROSTATES, nIslands = 3, nProcesses = 3);
+	print(one.getBestParameters()['match'], several.getBestParameters()['match']);
+	print(one.optimizationAlgorithm.islandMatches, several.optimizationAlgorithm.islandMatches);